@@ -1,22 +1,75 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
 import os
 import asyncio
+import functools
+import hashlib
+import json
+import logging
+import mimetypes
 import time
-import subprocess
-from typing import List, Dict, Any
-
-from models import APIConfig, ModelConfig, PaperConfig
+from contextlib import asynccontextmanager
+from typing import List, Dict, Any, AsyncIterator, BinaryIO, Optional, Tuple, Union
+from urllib.parse import quote
+
+from artifact_store import COMPRESSIBLE_EXTENSIONS, artifact_store, is_artifact_id
+from checkpoint import checkpoint_journal
+from client_pool import client_registry
+from exporter import EXPORT_BACKENDS, EXPORT_FORMATS
+from jobs import (
+    JOB_COMPLETED,
+    JOB_QUEUED,
+    JOB_RUNNING,
+    JobConflictError,
+    JobManager,
+    JobQueueFullError,
+)
+from llm_cache import llm_cache
+from logging_setup import setup_logging
+from metrics import ARTIFACT_BYTES, JOBS_ACTIVE, metrics_registry
+from models import (
+    APIConfig,
+    ExportRequest,
+    ModelConfig,
+    PaperConfig,
+    RegenerateRequest,
+    ResumeRequest,
+)
 from openai_client import OpenAIClient
-from utils import (
-    current_dir,
-    paper_generation_status,
-    prompt_templates,
-    reset_paper_generation_status,
-    save_prompt_templates,
+from outline import OutlineTree
+from prefetch import speculative_store
+from paper_generator import (
+    assemble_markdown,
+    generate_section_for_job,
+    run_paper_generation,
+    save_markdown,
+    start_export,
 )
+from prompt_store import prompt_store
+from utils import load_env_endpoints
+
+logger = logging.getLogger(__name__)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 直接用uvicorn api:app启动时也启用日志，已配置时不重复配置
+    setup_logging()
+    client_registry.start()
+    # 状态存储在这里首次使用时创建，模板通过它在工作进程之间同步
+    prompt_store.start(shared=job_manager.store)
+    # 启动时即开始从共享存储认领任务，不必等本进程收到提交
+    job_manager.start()
+    yield
+    # 运行中的任务交还存储，由其他工作进程接手
+    await job_manager.close()
+    await prompt_store.close()
+    # 关闭共享的HTTP连接池
+    await client_registry.close()
+
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # 配置 CORS
 app.add_middleware(
@@ -27,29 +80,36 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-
-async def generate_paper_section(
-    client: OpenAIClient,
-    topic: str,
-    title: str,
-    outline: List[str],
-    section: str,
-    config: ModelConfig,
-) -> str:
-    return await client.generate_section(topic, title, outline, section, config)
+# 客户端断开事件流后等待重连的时间（秒），超时仍未重连则取消设置了cancel_on_disconnect的任务
+DISCONNECT_GRACE_SECONDS = float(os.getenv("DISCONNECT_GRACE_SECONDS", "30"))
+# Range请求每次从文件读取的块大小（字节）
+RANGE_CHUNK_SIZE = 64 * 1024
+
+# 论文生成任务管理器，任务和进度保存在共享状态存储中，多个工作进程可以同时运行
+job_manager = JobManager(
+    run_paper_generation,
+    max_running_jobs=int(os.getenv("MAX_RUNNING_JOBS", "4")),
+    max_queued_jobs=int(os.getenv("MAX_QUEUED_JOBS", "64")),
+    max_jobs_per_tenant=int(os.getenv("MAX_JOBS_PER_TENANT", "8")),
+    section_runner=generate_section_for_job,
+)
 
 
 @app.get("/api/config")
 async def get_config():
     """获取初始配置"""
-    print(f"OPENAI_API_KEY: {os.getenv('OPENAI_API_KEY')}")
-    print(f"OPENAI_BASE_URL: {os.getenv('OPENAI_BASE_URL')}")
-    print(f"OPENAI_MODEL_NAME: {os.getenv('OPENAI_MODEL_NAME')}")
+    logger.debug(
+        "Serving initial config for %s (%s)",
+        os.getenv("OPENAI_BASE_URL"),
+        os.getenv("OPENAI_MODEL_NAME"),
+    )
 
     return {
         "api_key": os.getenv("OPENAI_API_KEY", ""),
         "base_url": os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1"),
         "model_name": os.getenv("OPENAI_MODEL_NAME", "gpt-4-turbo-preview"),
+        "endpoints": load_env_endpoints(),
+        "routing_strategy": os.getenv("OPENAI_ROUTING_STRATEGY", "least_outstanding"),
     }
 
 
@@ -65,26 +125,25 @@ async def generate_title(config: PaperConfig):
         else config.api_config
     )
     model_config = (
-        ModelConfig(**config.model_config)
-        if isinstance(config.model_config, dict)
-        else config.model_config or ModelConfig()
+        ModelConfig(**config.model_params)
+        if isinstance(config.model_params, dict)
+        else config.model_params or ModelConfig()
     )
 
-    # 调试输出
-    print(f"API Config: {api_config}")
-    print(f"Model Config: {model_config}")
+    # 调试输出，API配置的repr不包含密钥
+    logger.debug("API config: %r, model config: %r", api_config, model_config)
 
     try:
-        client = OpenAIClient(api_config)
+        client = OpenAIClient(api_config, model_config)
         title = await client.generate_title(config.topic, model_config)
         return {"title": title}
     except Exception as e:
-        print(f"Error in generate_title endpoint: {str(e)}")
+        logger.warning("generate_title failed: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.post("/api/generate-outline")
-async def generate_outline(config: PaperConfig):
+async def generate_outline(config: PaperConfig, request: Request):
     if not config.title or not config.api_config:
         raise HTTPException(
             status_code=400, detail="Title and API configuration are required"
@@ -97,31 +156,76 @@ async def generate_outline(config: PaperConfig):
         else config.api_config
     )
     model_config = (
-        ModelConfig(**config.model_config)
-        if isinstance(config.model_config, dict)
-        else config.model_config or ModelConfig()
+        ModelConfig(**config.model_params)
+        if isinstance(config.model_params, dict)
+        else config.model_params or ModelConfig()
     )
 
-    # 调试输出
-    print(f"API Config: {api_config}")
-    print(f"Model Config: {model_config}")
+    # 调试输出，API配置的repr不包含密钥
+    logger.debug("API config: %r, model config: %r", api_config, model_config)
 
     try:
-        client = OpenAIClient(api_config)
-        outline = await client.generate_outline(
-            config.topic, config.title, model_config
+        client = OpenAIClient(api_config, model_config)
+        # 用户选定了标题：优先使用推测生成的大纲，其余标题的推测请求取消
+        key = client.request_key(
+            client.outline_messages(config.topic, config.title), model_config
+        )
+        outline = await speculative_store.commit(
+            get_session_id(request, api_config), key
         )
+        if outline is not None:
+            logger.debug("Serving prefetched outline for %s", config.title)
+        else:
+            outline = await client.generate_outline(
+                config.topic, config.title, model_config
+            )
         return {"outline": outline}
     except Exception as e:
-        print(f"Error in generate_outline endpoint: {str(e)}")
+        logger.warning("generate_outline failed: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.post("/api/generate-paper")
-async def generate_paper(config: PaperConfig):
-    global paper_generation_status
+def get_tenant_id(request: Request, api_config: APIConfig) -> str:
+    """租户标识：优先使用X-Tenant-ID请求头，否则使用API密钥的摘要"""
+    tenant = request.headers.get("X-Tenant-ID")
+    if tenant:
+        return tenant
+    return hashlib.sha256(api_config.api_key.encode("utf-8")).hexdigest()[:16]
+
+
+def get_session_id(request: Request, api_config: APIConfig) -> str:
+    """推测结果所属的会话：优先使用X-Session-ID请求头，否则与租户相同"""
+    return request.headers.get("X-Session-ID") or get_tenant_id(request, api_config)
+
 
-    if not config.title or not config.outline or not config.api_config:
+def prefetch_outlines(
+    session: str,
+    client: OpenAIClient,
+    topic: str,
+    titles: List[str],
+    model_config: ModelConfig,
+):
+    """在后台为标题建议推测生成大纲，新的建议取代同一会话之前的推测"""
+    speculative_store.cancel(session)
+    for title in titles:
+        key = client.request_key(client.outline_messages(topic, title), model_config)
+        speculative_store.submit(
+            session,
+            key,
+            functools.partial(client.generate_outline, topic, title, model_config),
+        )
+
+
+@app.post("/api/generate-paper")
+async def generate_paper(config: PaperConfig, request: Request):
+    if config.auto_outline:
+        # 一键生成：缺少的标题和大纲在任务中生成
+        if not (config.topic or config.title) or not config.api_config:
+            raise HTTPException(
+                status_code=400,
+                detail="Topic or title and API configuration are required",
+            )
+    elif not config.title or not config.outline or not config.api_config:
         raise HTTPException(
             status_code=400, detail="Title, outline and API configuration are required"
         )
@@ -133,143 +237,132 @@ async def generate_paper(config: PaperConfig):
         else config.api_config
     )
     model_config = (
-        ModelConfig(**config.model_config)
-        if isinstance(config.model_config, dict)
-        else config.model_config or ModelConfig()
+        ModelConfig(**config.model_params)
+        if isinstance(config.model_params, dict)
+        else config.model_params or ModelConfig()
     )
 
-    # 调试输出
-    print(f"API Config: {api_config}")
-    print(f"Model Config: {model_config}")
-    print(f"Outline length: {len(config.outline)}")
-    print(f"Outline: {config.outline}")
-
+    # 已开始生成论文，不再需要推测的大纲
+    speculative_store.cancel(get_session_id(request, api_config))
     try:
-        # 初始化生成状态
-        paper_generation_status = {
-            "is_generating": True,
-            "total_sections": len(config.outline),
-            "completed_sections": 0,
-            "current_section": config.outline[0] if config.outline else "",
-            "completed_content": [],
-            "start_time": time.time(),
-            "estimated_time_remaining": None,
-        }
-
-        print(f"Initialized paper_generation_status: {paper_generation_status}")
-
-        client = OpenAIClient(api_config)
-        sections = []
-        tasks = []
-
-        # 将大纲分成多个块
-        chunks = [
-            config.outline[i : i + model_config.concurrent_requests]
-            for i in range(0, len(config.outline), model_config.concurrent_requests)
-        ]
-
-        print(f"Split outline into {len(chunks)} chunks")
-
-        # 创建并发任务
-        for i, chunk in enumerate(chunks):
-            print(f"Processing chunk {i+1}/{len(chunks)} with {len(chunk)} sections")
-            chunk_tasks = []
-            for section in chunk:
-                paper_generation_status["current_section"] = section
-                print(f"Creating task for section: {section}")
-                task = generate_paper_section(
-                    client,
-                    config.topic,
-                    config.title,
-                    config.outline,
-                    section,
-                    model_config,
+        job = await job_manager.submit(
+            get_tenant_id(request, api_config), config, api_config, model_config
+        )
+    except JobQueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+
+    return {
+        "job_id": job.job_id,
+        "state": job.state,
+        "queue_position": await job_manager.queue_position(job),
+    }
+
+
+def _without_regenerate(config: PaperConfig) -> PaperConfig:
+    return config.model_copy(update={"regenerate_sections": [], "custom_prompt": None})
+
+
+async def load_job_config(
+    job_id: str, api_config: Optional[Union[Dict[str, Any], APIConfig]]
+) -> Tuple[PaperConfig, ModelConfig, APIConfig]:
+    """取得重新运行任务所需的配置：优先使用状态存储中的任务，否则从检查点读取
+
+    上一次重新生成指定的章节和修改指令只对那一次运行有效，这里清除，恢复时不会再次请求
+    """
+    job = await job_manager.load(job_id)
+    if job is not None:
+        config, model_config = _without_regenerate(job.config), job.model_config
+        if not api_config:
+            if job.api_config is None:
+                # 已结束的任务不再保存API密钥
+                raise HTTPException(
+                    status_code=400, detail="API configuration is required to resume"
                 )
-                chunk_tasks.append(task)
-
-            # 等待当前批次的任务完成
-            print(f"Waiting for {len(chunk_tasks)} tasks to complete")
-            section_contents = await asyncio.gather(*chunk_tasks)
-            print(f"Completed {len(section_contents)} tasks")
-
-            # 更新进度和内容
-            for j, content in enumerate(section_contents):
-                section_index = i * model_config.concurrent_requests + j
-                if section_index < len(config.outline):
-                    section_title = config.outline[section_index]
-                    paper_generation_status["completed_sections"] += 1
-                    paper_generation_status["completed_content"].append(
-                        {"title": section_title, "content": content}
-                    )
-
-                    # 计算预估剩余时间
-                    elapsed_time = time.time() - paper_generation_status["start_time"]
-                    if paper_generation_status["completed_sections"] > 0:
-                        avg_time_per_section = (
-                            elapsed_time / paper_generation_status["completed_sections"]
-                        )
-                        remaining_sections = (
-                            paper_generation_status["total_sections"]
-                            - paper_generation_status["completed_sections"]
-                        )
-                        paper_generation_status["estimated_time_remaining"] = (
-                            avg_time_per_section * remaining_sections
-                        )
-
-                    print(
-                        f"Updated progress: {paper_generation_status['completed_sections']}/{paper_generation_status['total_sections']}"
-                    )
-
-            sections.extend(section_contents)
-
-        # 合并所有章节
-        full_paper = "\n\n".join(sections)
-        print(f"Generated full paper with {len(full_paper)} characters")
-
-        # 使用标题作为文件名（处理特殊字符）
-        safe_title = (
-            config.title.replace("/", "_")
-            .replace("\\", "_")
-            .replace(":", "_")
-            .replace("*", "_")
-            .replace("?", "_")
-            .replace('"', "_")
-            .replace("<", "_")
-            .replace(">", "_")
-            .replace("|", "_")
+            return config, model_config, job.api_config
+    else:
+        # 任务已不在状态存储中（已过期清理），从检查点读取配置
+        job_info = await checkpoint_journal.load_job(job_id)
+        if job_info is None:
+            raise HTTPException(status_code=404, detail="Job not found")
+        if not api_config:
+            raise HTTPException(
+                status_code=400, detail="API configuration is required to resume"
+            )
+        config = _without_regenerate(PaperConfig(**job_info["config"]))
+        model_config = ModelConfig(**job_info["model_config"])
+
+    api_config = APIConfig(**api_config) if isinstance(api_config, dict) else api_config
+    return config, model_config, api_config
+
+
+async def resubmit_job(
+    job_id: str,
+    request: Request,
+    config: PaperConfig,
+    api_config: APIConfig,
+    model_config: ModelConfig,
+) -> Dict[str, Any]:
+    """以原job_id重新提交任务，已完成的章节从检查点恢复"""
+    try:
+        job = await job_manager.submit(
+            get_tenant_id(request, api_config),
+            config,
+            api_config,
+            model_config,
+            job_id=job_id,
         )
+    except JobQueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    except JobConflictError as e:
+        raise HTTPException(status_code=409, detail=str(e))
 
-        # 使用绝对路径保存文件
-        md_file = os.path.join(current_dir, f"{safe_title}.md")
-        with open(md_file, "w", encoding="utf-8") as f:
-            f.write(f"# {config.title}\n\n")
-            f.write(full_paper)
+    return {
+        "job_id": job.job_id,
+        "state": job.state,
+        "queue_position": await job_manager.queue_position(job),
+    }
 
-        print(f"Saved paper to {md_file}")
 
-        # 转换为 docx
-        docx_file = os.path.join(current_dir, f"{safe_title}.docx")
-        subprocess.run(["pandoc", md_file, "-o", docx_file])
-        print(f"Converted paper to {docx_file}")
+@app.post("/api/resume-paper/{job_id}")
+async def resume_paper(job_id: str, body: ResumeRequest, request: Request):
+    """从检查点恢复失败或中断的任务，只重新生成缺失的章节"""
+    job = await job_manager.load(job_id)
+    if job is not None and job.state == JOB_COMPLETED:
+        raise HTTPException(status_code=409, detail="Job already completed")
 
-        # 完成生成
-        paper_generation_status["is_generating"] = False
-        print("Paper generation completed")
+    config, model_config, api_config = await load_job_config(job_id, body.api_config)
+    return await resubmit_job(job_id, request, config, api_config, model_config)
 
-        return {
-            "paper": full_paper,
-            "markdown_file": md_file,
-            "docx_file": docx_file,
-        }
-    except Exception as e:
-        # 发生错误时重置状态
-        reset_paper_generation_status()  # 使用重置函数
-        print(f"Error in generate_paper endpoint: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/api/regenerate-sections/{job_id}")
+async def regenerate_sections(job_id: str, body: RegenerateRequest, request: Request):
+    """只重新生成论文中指定的章节，其余章节从检查点复用，完成后重新导出"""
+    if not body.sections:
+        raise HTTPException(status_code=400, detail="Sections are required")
+
+    config, model_config, api_config = await load_job_config(job_id, body.api_config)
+    if body.model_params:
+        model_config = (
+            ModelConfig(**body.model_params)
+            if isinstance(body.model_params, dict)
+            else body.model_params
+        )
+
+    # 章节可以用大纲序号或大纲条目指定，上级章节展开为其下需要正文的章节
+    tree = OutlineTree.parse(config.outline, config.content_sections)
+    try:
+        indices = tree.select(body.sections)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    config = config.model_copy(
+        update={"regenerate_sections": indices, "custom_prompt": body.custom_prompt}
+    )
+    return await resubmit_job(job_id, request, config, api_config, model_config)
 
 
 @app.post("/api/generate-title-suggestions")
-async def generate_title_suggestions(config: PaperConfig):
+async def generate_title_suggestions(config: PaperConfig, request: Request):
     if not config.api_config:
         raise HTTPException(status_code=400, detail="API configuration is required")
 
@@ -280,23 +373,30 @@ async def generate_title_suggestions(config: PaperConfig):
         else config.api_config
     )
     model_config = (
-        ModelConfig(**config.model_config)
-        if isinstance(config.model_config, dict)
-        else config.model_config or ModelConfig()
+        ModelConfig(**config.model_params)
+        if isinstance(config.model_params, dict)
+        else config.model_params or ModelConfig()
     )
 
-    # 调试输出
-    print(f"API Config: {api_config}")
-    print(f"Model Config: {model_config}")
+    # 调试输出，API配置的repr不包含密钥
+    logger.debug("API config: %r, model config: %r", api_config, model_config)
 
     try:
-        client = OpenAIClient(api_config)
+        client = OpenAIClient(api_config, model_config)
         suggestions = await client.generate_title_suggestions(
             config.topic, model_config
         )
+        if config.prefetch_outlines > 0:
+            prefetch_outlines(
+                get_session_id(request, api_config),
+                client,
+                config.topic,
+                suggestions[: config.prefetch_outlines],
+                model_config,
+            )
         return {"suggestions": suggestions}
     except Exception as e:
-        print(f"Error in generate_title_suggestions endpoint: {str(e)}")
+        logger.warning("generate_title_suggestions failed: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 
@@ -314,20 +414,22 @@ async def generate_title_with_custom_prompt(config: PaperConfig):
         else config.api_config
     )
     model_config = (
-        ModelConfig(**config.model_config)
-        if isinstance(config.model_config, dict)
-        else config.model_config or ModelConfig()
+        ModelConfig(**config.model_params)
+        if isinstance(config.model_params, dict)
+        else config.model_params or ModelConfig()
     )
 
-    # 调试输出
-    print(f"API Config: {api_config}")
-    print(f"Model Config: {model_config}")
-    print(f"Custom Prompt: {config.custom_prompt}")
-    print(f"Is New Generation: {config.is_new_generation}")
-    print(f"Current Title: {config.title}")
+    # 调试输出，API配置的repr不包含密钥
+    logger.debug("API config: %r, model config: %r", api_config, model_config)
+    # 只记录提示词的长度，不记录内容
+    logger.debug(
+        "Custom title: prompt %d chars, new generation %s",
+        len(config.custom_prompt or ""),
+        config.is_new_generation,
+    )
 
     try:
-        client = OpenAIClient(api_config)
+        client = OpenAIClient(api_config, model_config)
         title = await client.generate_title_with_custom_prompt(
             config.topic,
             config.custom_prompt,
@@ -337,12 +439,12 @@ async def generate_title_with_custom_prompt(config: PaperConfig):
         )
         return {"title": title}
     except Exception as e:
-        print(f"Error in generate_title_with_custom_prompt endpoint: {str(e)}")
+        logger.warning("generate_title_with_custom_prompt failed: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.post("/api/generate-outline-with-custom-prompt")
-async def generate_outline_with_custom_prompt(config: PaperConfig):
+async def generate_outline_with_custom_prompt(config: PaperConfig, request: Request):
     if not config.api_config or not config.custom_prompt:
         raise HTTPException(
             status_code=400, detail="API configuration and custom prompt are required"
@@ -355,21 +457,25 @@ async def generate_outline_with_custom_prompt(config: PaperConfig):
         else config.api_config
     )
     model_config = (
-        ModelConfig(**config.model_config)
-        if isinstance(config.model_config, dict)
-        else config.model_config or ModelConfig()
+        ModelConfig(**config.model_params)
+        if isinstance(config.model_params, dict)
+        else config.model_params or ModelConfig()
     )
 
-    # 调试输出
-    print(f"API Config: {api_config}")
-    print(f"Model Config: {model_config}")
-    print(f"Custom Prompt: {config.custom_prompt}")
-    print(f"Is New Generation: {config.is_new_generation}")
-    print(f"Current Title: {config.title}")
-    print(f"Current Outline: {config.outline}")
+    # 调试输出，API配置的repr不包含密钥
+    logger.debug("API config: %r, model config: %r", api_config, model_config)
+    # 只记录提示词和大纲的长度，不记录内容
+    logger.debug(
+        "Custom outline: prompt %d chars, new generation %s, current outline %d entries",
+        len(config.custom_prompt or ""),
+        config.is_new_generation,
+        len(config.outline or []),
+    )
 
+    # 按自定义提示词生成大纲，推测的大纲不再有用
+    speculative_store.cancel(get_session_id(request, api_config))
     try:
-        client = OpenAIClient(api_config)
+        client = OpenAIClient(api_config, model_config)
         outline = await client.generate_outline_with_custom_prompt(
             config.topic,
             config.title,
@@ -380,25 +486,41 @@ async def generate_outline_with_custom_prompt(config: PaperConfig):
         )
         return {"outline": outline}
     except Exception as e:
-        print(f"Error in generate_outline_with_custom_prompt endpoint: {str(e)}")
+        logger.warning("generate_outline_with_custom_prompt failed: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.get("/api/paper-generation-status")
-async def get_paper_generation_status():
-    global paper_generation_status
+@app.get("/api/paper-generation-status/{job_id}")
+async def get_paper_generation_status(
+    job_id: str,
+    request: Request,
+    response: Response,
+    since: Optional[int] = None,
+    fields: Optional[str] = None,
+):
+    """查询任务状态
 
-    # 打印当前状态
-    print(f"Current paper_generation_status: {paper_generation_status}")
+    - since：上次响应中的cursor，只返回之后完成的章节
+    - fields=progress：只返回进度信息，不包含章节内容和结果
+    - 支持If-None-Match，状态未变化时返回304
+
+    任务可能由其他工作进程运行，状态从共享存储读取。
+    """
+    job = await job_manager.load(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    paper_generation_status = job.status
 
     # 计算已用时间
     elapsed_time = 0
     if paper_generation_status["start_time"]:
         elapsed_time = time.time() - paper_generation_status["start_time"]
-        # 如果已经过去了很长时间（例如10分钟）但状态仍为生成中，强制重置
-        if elapsed_time > 600 and paper_generation_status["is_generating"]:
-            print("Forcing reset of paper_generation_status due to timeout")
-            reset_paper_generation_status()
+    # 工作进程中途退出时快照中可能仍是生成中；运行中的任务由租约保证不会卡住
+    # （租约过期后由其他进程接手），因此只需修正已结束任务的标记，
+    # 已完成的章节保留在检查点中，可通过恢复接口继续生成
+    if paper_generation_status["is_generating"] and job.is_finished:
+        paper_generation_status["is_generating"] = False
 
     # 计算进度百分比
     progress = 0
@@ -414,52 +536,401 @@ async def get_paper_generation_status():
     if not paper_generation_status["is_generating"] and progress >= 100:
         estimated_time_remaining = 0
 
+    # completed_content只追加，cursor即已完成章节的条数；状态被重置后从头返回
+    completed_content = paper_generation_status["completed_content"]
+    cursor = len(completed_content)
+    if since is None or since > cursor:
+        since = 0
+    progress_only = fields == "progress"
+
+    # ETag不包含已用时间，前端本地计时即可
+    queue_position = await job_manager.queue_position(job)
+    etag_source = json.dumps(
+        [
+            job.state,
+            queue_position,
+            paper_generation_status["is_generating"],
+            paper_generation_status["total_sections"],
+            paper_generation_status.get("outline_complete", True),
+            paper_generation_status["completed_sections"],
+            paper_generation_status["current_section"],
+            paper_generation_status["retries"],
+            paper_generation_status["concurrency_limit"],
+            paper_generation_status["prompt_tokens"],
+            paper_generation_status.get("aborted_calls", 0),
+            cursor,
+            since,
+            progress_only,
+            job.error,
+            paper_generation_status["export"],
+        ],
+        ensure_ascii=False,
+    )
+    etag = 'W/"%s"' % hashlib.sha1(etag_source.encode("utf-8")).hexdigest()
+    if request.headers.get("If-None-Match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+
     response_data = {
+        "job_id": job.job_id,
+        "state": job.state,
+        "queue_position": queue_position,
         "is_generating": paper_generation_status["is_generating"],
         "progress": progress,
         "total_sections": paper_generation_status["total_sections"],
+        # 一键生成时大纲仍在流式生成，total_sections还会增加
+        "outline_complete": paper_generation_status.get("outline_complete", True),
         "completed_sections": paper_generation_status["completed_sections"],
         "current_section": paper_generation_status["current_section"],
-        "completed_content": paper_generation_status["completed_content"],
         "elapsed_time": elapsed_time,
         "estimated_time_remaining": estimated_time_remaining,
+        "retries": paper_generation_status["retries"],
+        "concurrency_limit": paper_generation_status["concurrency_limit"],
+        "prompt_tokens": paper_generation_status["prompt_tokens"],
+        "resumed_sections": paper_generation_status["resumed_sections"],
+        # 任务被取消时中止的在途模型请求数
+        "aborted_calls": paper_generation_status.get("aborted_calls", 0),
+        "cursor": cursor,
+        "error": job.error,
+        "export": paper_generation_status["export"],
     }
+    if not progress_only:
+        response_data["completed_content"] = completed_content[since:]
+        response_data["result"] = job.result
 
-    print(f"Returning status: {response_data}")
     return response_data
 
 
-@app.get("/api/prompt-templates")
-async def get_prompt_templates():
-    global prompt_templates
-    return prompt_templates
+def format_sse(event: str, data: Dict[str, Any]) -> str:
+    """格式化一条Server-Sent Events消息"""
+    payload = json.dumps(data, ensure_ascii=False)
+    return f"event: {event}\ndata: {payload}\n\n"
+
+
+@app.get("/api/paper-generation-events/{job_id}")
+async def paper_generation_events(job_id: str):
+    """以SSE方式推送任务的章节增量文本和进度，取代轮询
+
+    任务由本进程提交或运行时直接订阅；由其他工作进程运行时跟随共享存储中的事件日志，
+    此时没有增量文本，章节内容随section_done事件送达。
+    """
+    job = await job_manager.load(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    # 先订阅再发送快照，保证快照之后的事件不会丢失（重复事件由前端按index去重）
+    events = job_manager.follow(job)
+    # 设置了cancel_on_disconnect的任务在最后一个事件流断开且宽限期内没有重连时取消
+    cancel_after = DISCONNECT_GRACE_SECONDS if job.config.cancel_on_disconnect else None
+
+    async def event_stream():
+        await job_manager.watch(job_id)
+        try:
+            yield format_sse(
+                "snapshot",
+                {
+                    "state": job.state,
+                    "total_sections": job.status["total_sections"],
+                    "completed_sections": job.status["completed_sections"],
+                    "completed_content": job.status["completed_content"],
+                },
+            )
+            if job.is_finished:
+                yield format_sse("done", {"state": job.state, "error": job.error})
+                return
+
+            async for item in events:
+                if item is None:
+                    # 定期发送注释行保持连接
+                    yield ": keepalive\n\n"
+                    continue
+                event, data = item
+                yield format_sse(event, data)
+                if event == "done":
+                    return
+        finally:
+            # 客户端断开时生成器被取消，同样执行到这里
+            job_manager.unwatch(job_id, None if job.is_finished else cancel_after)
+            await events.aclose()
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
-@app.post("/api/prompt-templates")
-async def update_prompt_templates(templates: dict):
-    global prompt_templates
-    # 确保所有必要的键都存在
-    required_keys = [
-        "title_prompt",
-        "title_suggestions_prompt",
-        "outline_prompt",
-        "section_prompt",
+@app.post("/api/export-paper/{job_id}")
+async def export_paper(job_id: str, request: ExportRequest):
+    """重新导出已生成的论文，进度见状态接口中的export字段"""
+    job = await job_manager.load(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job.state != JOB_COMPLETED or not job.result:
+        raise HTTPException(status_code=409, detail="Paper generation not completed")
+
+    unsupported = [fmt for fmt in request.formats if fmt not in EXPORT_FORMATS]
+    if unsupported:
+        raise HTTPException(
+            status_code=400, detail=f"Unsupported export formats: {unsupported}"
+        )
+
+    backend = request.backend or job.config.export_backend
+    if backend not in EXPORT_BACKENDS:
+        raise HTTPException(
+            status_code=400, detail=f"Unsupported export backend: {backend}"
+        )
+
+    md_file = job.result["markdown_file"]
+    if "artifact" in job.result:
+        # Markdown可能已被生成文件存储淘汰，按结果重新保存（内容未变时只更新访问时间）
+        saved = await save_markdown(
+            job.config.title, assemble_markdown(job.config.title, [job.result["paper"]])
+        )
+        md_file = saved["markdown_file"]
+
+    if not job_manager.is_local(job):
+        # 在本进程导出，导出进度写回共享存储
+        job_manager.track(job)
+    start_export(job, md_file, request.formats, backend)
+    return {"status": "success", "export": job.status["export"]}
+
+
+def _etag_matches(header: Optional[str], etag: str) -> bool:
+    # If-None-Match使用弱比较，可以是多个ETag或*
+    if not header:
+        return False
+    tags = [tag.strip() for tag in header.split(",")]
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+
+def _accepted_encodings(header: str) -> List[str]:
+    """客户端接受的压缩编码，按q值从高到低排列，同等时优先brotli"""
+    accepted = {}
+    for part in header.split(","):
+        name, _, params = part.partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                continue
+        if name.strip():
+            accepted[name.strip().lower()] = quality
+    default = accepted.get("*", 0)
+    ranked = [(accepted.get(name, default), name) for name in ("br", "gzip")]
+    return [
+        name for quality, name in sorted(ranked, key=lambda x: -x[0]) if quality > 0
     ]
-    for key in required_keys:
-        if key not in templates:
-            raise HTTPException(
-                status_code=400, detail=f"Missing required template: {key}"
+
+
+def _parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """解析单个字节范围，返回闭区间(start, end)
+
+    不支持的格式（如多个范围）返回None，按规范忽略Range返回完整内容；范围超出文件时返回416。
+    """
+    unit, _, spec = header.partition("=")
+    start_text, sep, end_text = spec.strip().partition("-")
+    if unit.strip().lower() != "bytes" or "," in spec or not sep:
+        return None
+    try:
+        if start_text:
+            start = int(start_text)
+            end = min(int(end_text), size - 1) if end_text else size - 1
+        else:
+            # 后缀范围：最后N个字节
+            start, end = max(0, size - int(end_text)), size - 1
+    except ValueError:
+        return None
+    if start < 0 or start > end:
+        raise HTTPException(
+            status_code=416,
+            detail="Requested range not satisfiable",
+            headers={"Content-Range": f"bytes */{size}"},
+        )
+    return start, end
+
+
+def _open_range(path: str, start: int) -> BinaryIO:
+    f = open(path, "rb")
+    f.seek(start)
+    return f
+
+
+async def _iter_range(f: BinaryIO, length: int) -> AsyncIterator[bytes]:
+    """分块读取已定位的文件，不把整个范围读入内存"""
+    try:
+        while length > 0:
+            chunk = await asyncio.to_thread(f.read, min(RANGE_CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        f.close()
+
+
+@app.api_route("/api/artifacts/{artifact_id}/{filename}", methods=["GET", "HEAD"])
+async def download_artifact(artifact_id: str, filename: str, request: Request):
+    """下载生成的Markdown和导出文件
+
+    URL中的内容哈希决定了内容，同一URL的内容不会变化，因此使用强ETag并允许客户端长期缓存；
+    Markdown、HTML等文本文件按Accept-Encoding返回预先压缩的gzip或brotli结果，
+    未压缩的响应支持单个Range请求（断点续传）。
+    """
+    path = None
+    if is_artifact_id(artifact_id):
+        path = await asyncio.to_thread(artifact_store.path, artifact_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Artifact not found")
+
+    media_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    if media_type.startswith("text/"):
+        media_type += "; charset=utf-8"
+    etag = f'"{artifact_id}"'
+    headers = {
+        "Cache-Control": "private, max-age=31536000, immutable",
+        "Accept-Ranges": "bytes",
+    }
+    compressible = os.path.splitext(filename)[1].lower() in COMPRESSIBLE_EXTENSIONS
+    if compressible:
+        headers["Vary"] = "Accept-Encoding"
+
+    range_header = request.headers.get("Range")
+    if range_header and request.headers.get("If-Range", etag) != etag:
+        # 客户端手中的部分内容已过期，返回完整内容
+        range_header = None
+    if compressible and not range_header:
+        encodings = _accepted_encodings(request.headers.get("Accept-Encoding", ""))
+        encoded = None
+        if encodings:
+            encoded = await asyncio.to_thread(
+                artifact_store.encoded, artifact_id, encodings
+            )
+        if encoded is not None:
+            # 每种编码是不同的表示，强ETag需要区分
+            encoding, path = encoded
+            etag = f'"{artifact_id}-{encoding}"'
+            headers["Content-Encoding"] = encoding
+    headers["ETag"] = etag
+
+    if _etag_matches(request.headers.get("If-None-Match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    headers["Content-Disposition"] = f"attachment; filename*=UTF-8''{quote(filename)}"
+    if range_header:
+        size = await asyncio.to_thread(os.path.getsize, path)
+        byte_range = _parse_range(range_header, size)
+        if byte_range is not None:
+            start, end = byte_range
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+            headers["Content-Length"] = str(end - start + 1)
+            if request.method == "HEAD":
+                return Response(status_code=206, headers=headers, media_type=media_type)
+            f = await asyncio.to_thread(_open_range, path, start)
+            return StreamingResponse(
+                _iter_range(f, end - start + 1),
+                status_code=206,
+                headers=headers,
+                media_type=media_type,
             )
+    return FileResponse(path, headers=headers, media_type=media_type)
+
+
+@app.get("/api/llm-cache/stats")
+async def get_llm_cache_stats():
+    return llm_cache.stats()
+
+
+def _collect_service_metrics():
+    cache_stats = llm_cache.stats()
+    speculative_stats = speculative_store.stats()
+    return [
+        (
+            "paper_llm_cache_hit_ratio",
+            "gauge",
+            "Response cache hit ratio since process start",
+            [({}, cache_stats["hit_rate"])],
+        ),
+        (
+            "paper_llm_cache_entries",
+            "gauge",
+            "Response cache entries by tier",
+            [
+                ({"tier": "memory"}, cache_stats["memory_entries"]),
+                ({"tier": "disk"}, cache_stats["disk_entries"]),
+            ],
+        ),
+        (
+            "paper_speculative_entries",
+            "gauge",
+            "Speculative outline results held in memory, and requests still running",
+            [
+                ({"state": "held"}, speculative_stats["entries"]),
+                ({"state": "running"}, speculative_stats["running"]),
+            ],
+        ),
+    ]
+
+
+metrics_registry.add_collector(_collect_service_metrics)
+
 
-    # 更新模板
-    prompt_templates = templates
-    # 保存到文件
-    save_prompt_templates(templates)
-    return {"status": "success"}
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus文本格式的指标"""
+    # 所有工作进程的任务数来自共享存储，抓取时查询
+    job_counts = await job_manager.store.job_counts()
+    for state in (JOB_QUEUED, JOB_RUNNING):
+        JOBS_ACTIVE.set(job_counts.get(state, 0), state=state)
+    # 首次统计需要遍历生成文件目录，在线程池中进行
+    artifact_stats = await asyncio.to_thread(artifact_store.stats)
+    ARTIFACT_BYTES.set(artifact_stats["bytes"])
+    return Response(metrics_registry.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/api/prompt-templates")
+async def get_prompt_templates(request: Request):
+    templates = prompt_store.current
+    # 版本号即ETag，模板未变化时返回304
+    etag = f'"{templates.version}"'
+    if request.headers.get("If-None-Match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    return JSONResponse(templates.to_dict(), headers={"ETag": etag})
+
+
+@app.post("/api/prompt-templates")
+async def update_prompt_templates(templates: dict):
+    # 校验必需的模板和占位符，通过后原子替换，新请求立即使用新版本
+    try:
+        compiled = await prompt_store.update(templates)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"status": "success", "version": compiled.version}
 
 
 # 添加重置生成状态的API端点
-@app.post("/api/reset-generation-status")
-async def reset_generation_status():
-    reset_paper_generation_status()
-    return {"status": "success", "message": "Generation status has been reset"}
+@app.post("/api/reset-generation-status/{job_id}")
+async def reset_generation_status(job_id: str):
+    """删除排队中或已结束的任务；运行中的任务被取消，在途的模型请求随之中止"""
+    result = await job_manager.reset(job_id)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return {
+        "status": "success",
+        "message": "Generation status has been reset",
+        **result,
+    }
+
+
+@app.post("/api/cancel-generation/{job_id}")
+async def cancel_generation(job_id: str):
+    """取消任务：中止在途的模型请求并释放并发槽位，已完成的章节可通过恢复接口继续生成
+
+    返回任务状态和中止的请求数；任务由其他工作进程运行时为cancelling，中止数为null。
+    """
+    result = await job_manager.cancel(job_id, "cancelled by user")
+    if result is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return {"status": "success", **result}
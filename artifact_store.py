@@ -0,0 +1,273 @@
+import gzip
+import hashlib
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import quote
+
+from utils import current_dir
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# 下载时可以压缩的文本格式（按下载文件名的扩展名）
+COMPRESSIBLE_EXTENSIONS = {".md", ".html", ".tex"}
+# 压缩结果与原文件保存在一起，文件名加上这些后缀
+ENCODING_SUFFIXES = {"br": ".br", "gzip": ".gz"}
+# 派生结果的索引文件后缀：文件名为派生键，内容为结果文件的id
+ALIAS_SUFFIX = ".ref"
+# 超过这个时间（秒）仍未移入存储的临时文件视为进程退出时遗留，扫描目录时删除
+STALE_TEMP_SECONDS = 3600
+
+
+def artifact_url(artifact_id: str, filename: str) -> str:
+    """下载地址：内容哈希决定内容，文件名只用于保存时的默认名称"""
+    return f"/api/artifacts/{artifact_id}/{quote(filename)}"
+
+
+def is_artifact_id(value: str) -> bool:
+    return len(value) == 64 and all(c in "0123456789abcdef" for c in value)
+
+
+class ArtifactStore:
+    """按内容寻址的生成文件存储
+
+    文件以内容的SHA-256命名保存在独立目录中，内容相同的文件只保存一份；下载文件名只出现在
+    URL和Content-Disposition中，不同论文的标题相同也不会互相覆盖。总大小超过max_bytes时
+    按最近访问时间淘汰。文本文件首次以gzip或brotli下载时压缩一次，压缩结果一起保存并计入配额。
+    派生结果（如导出文件）可以按输入的哈希登记（put_alias），之后直接查找复用，不必另建缓存。
+    所有方法都是同步的文件操作，异步代码中通过asyncio.to_thread调用。
+    """
+
+    def __init__(self, root_dir: str, max_bytes: int = 1024 * 1024 * 1024):
+        self.root_dir = root_dir
+        self.max_bytes = max_bytes
+        # 文件名 -> 大小，按最近访问顺序排列
+        self._index: "OrderedDict[str, int]" = OrderedDict()
+        self._bytes = 0
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.root_dir, name[:2], name)
+
+    def _load_index(self):
+        # 启动后第一次访问时扫描目录，按修改时间恢复访问顺序
+        entries = []
+        stale = time.time() - STALE_TEMP_SECONDS
+        if os.path.isdir(self.root_dir):
+            for root, _, files in os.walk(self.root_dir):
+                for name in files:
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                        if ".tmp" in name:
+                            if stat.st_mtime < stale:
+                                os.remove(path)
+                            continue
+                    except OSError:
+                        continue
+                    entries.append((stat.st_mtime, name, stat.st_size))
+        for _, name, size in sorted(entries):
+            self._index[name] = size
+            self._bytes += size
+        self._loaded = True
+
+    def _add(self, name: str, size: int):
+        """登记新文件并淘汰最久未访问的文件，调用方持有锁"""
+        self._bytes += size - self._index.pop(name, 0)
+        self._index[name] = size
+        while self._bytes > self.max_bytes and len(self._index) > 1:
+            evicted, evicted_size = self._index.popitem(last=False)
+            self._bytes -= evicted_size
+            try:
+                os.remove(self._path(evicted))
+            except OSError:
+                pass
+            logger.debug("Evicted artifact %s", evicted)
+
+    def _touch(self, name: str) -> Optional[str]:
+        """文件存在时更新访问顺序并返回路径，调用方持有锁"""
+        path = self._path(name)
+        try:
+            os.utime(path)
+        except OSError:
+            # 已被其他进程淘汰
+            if name in self._index:
+                self._bytes -= self._index.pop(name)
+            return None
+        if name in self._index:
+            self._index.move_to_end(name)
+        else:
+            # 其他进程写入的文件
+            self._add(name, os.path.getsize(path))
+        return path
+
+    def _describe(self, artifact_id: str, filename: str, size: int) -> Dict[str, Any]:
+        return {
+            "id": artifact_id,
+            "filename": filename,
+            "size": size,
+            "url": artifact_url(artifact_id, filename),
+        }
+
+    def temp_path(self, suffix: str = "") -> str:
+        """存储目录中的临时文件路径，写完后用put_file(move=True)移入存储"""
+        os.makedirs(self.root_dir, exist_ok=True)
+        return os.path.join(self.root_dir, f"{uuid.uuid4().hex}.tmp{suffix}")
+
+    def put_file(
+        self, source: str, filename: str, move: bool = False
+    ) -> Dict[str, Any]:
+        """复制source的内容到存储中，返回id、文件名、大小和下载地址
+
+        move为True时把source移入存储（source来自temp_path时只是重命名）。存储中的文件
+        总是独立的副本，不与其他路径共享（硬链接），淘汰时即释放磁盘空间。
+        """
+        digest = hashlib.sha256()
+        with open(source, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(block)
+        artifact_id = digest.hexdigest()
+        size = os.path.getsize(source)
+
+        with self._lock:
+            if not self._loaded:
+                self._load_index()
+            if self._touch(artifact_id) is not None:
+                if move:
+                    os.remove(source)
+                return self._describe(artifact_id, filename, size)
+
+            path = self._path(artifact_id)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.tmp.{threading.get_ident()}"
+            if move:
+                # 跨文件系统时shutil.move退化为复制后删除
+                shutil.move(source, tmp_path)
+            else:
+                shutil.copyfile(source, tmp_path)
+            os.replace(tmp_path, path)
+            self._add(artifact_id, size)
+        return self._describe(artifact_id, filename, size)
+
+    def put_bytes(self, data: bytes, filename: str) -> Dict[str, Any]:
+        artifact_id = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            if not self._loaded:
+                self._load_index()
+            if self._touch(artifact_id) is None:
+                path = self._path(artifact_id)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp_path = f"{path}.tmp.{threading.get_ident()}"
+                with open(tmp_path, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+                self._add(artifact_id, len(data))
+        return self._describe(artifact_id, filename, len(data))
+
+    def put_alias(self, key: str, artifact_id: str):
+        """登记key（如渲染参数与输入内容的哈希）对应的文件；索引文件与其他文件一起按访问时间淘汰"""
+        name = key + ALIAS_SUFFIX
+        with self._lock:
+            if not self._loaded:
+                self._load_index()
+            path = self._path(name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.tmp.{threading.get_ident()}"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(artifact_id)
+            os.replace(tmp_path, path)
+            self._add(name, len(artifact_id))
+
+    def resolve(self, key: str, filename: str) -> Optional[Dict[str, Any]]:
+        """查找put_alias登记的文件，返回与put_file相同的描述；未登记或文件已被淘汰时返回None"""
+        with self._lock:
+            if not self._loaded:
+                self._load_index()
+            alias_path = self._touch(key + ALIAS_SUFFIX)
+            if alias_path is None:
+                return None
+            try:
+                with open(alias_path, "r", encoding="utf-8") as f:
+                    artifact_id = f.read().strip()
+            except OSError:
+                return None
+            if not is_artifact_id(artifact_id):
+                return None
+            path = self._touch(artifact_id)
+            if path is None:
+                return None
+            return self._describe(artifact_id, filename, os.path.getsize(path))
+
+    def path(self, artifact_id: str) -> Optional[str]:
+        """返回文件路径并记为最近访问，不存在（或已被淘汰）时返回None"""
+        with self._lock:
+            if not self._loaded:
+                self._load_index()
+            return self._touch(artifact_id)
+
+    def encoded(
+        self, artifact_id: str, encodings: List[str]
+    ) -> Optional[Tuple[str, str]]:
+        """按客户端接受的编码返回(编码, 压缩文件路径)，首次请求时生成压缩文件
+
+        encodings按优先顺序排列；没有可用的编码或压缩后没有变小时返回None。
+        """
+        for encoding in encodings:
+            if encoding == "br" and brotli is None:
+                continue
+            if encoding not in ENCODING_SUFFIXES:
+                continue
+            name = artifact_id + ENCODING_SUFFIXES[encoding]
+            with self._lock:
+                if not self._loaded:
+                    self._load_index()
+                path = self._touch(name)
+                if path is not None:
+                    return encoding, path
+                source = self._touch(artifact_id)
+            if source is None:
+                return None
+
+            with open(source, "rb") as f:
+                data = f.read()
+            if encoding == "br":
+                compressed = brotli.compress(data, mode=brotli.MODE_TEXT)
+            else:
+                # mtime固定为0，同一内容的压缩结果（以及ETag）保持不变
+                compressed = gzip.compress(data, compresslevel=9, mtime=0)
+            if len(compressed) >= len(data):
+                return None
+
+            path = self._path(name)
+            tmp_path = f"{path}.tmp.{threading.get_ident()}"
+            with open(tmp_path, "wb") as f:
+                f.write(compressed)
+            with self._lock:
+                os.replace(tmp_path, path)
+                self._add(name, len(compressed))
+            return encoding, path
+        return None
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            if not self._loaded:
+                self._load_index()
+            return {"files": len(self._index), "bytes": self._bytes}
+
+
+# 全局生成文件存储
+artifact_store = ArtifactStore(
+    os.getenv("ARTIFACT_DIR", os.path.join(current_dir, "artifacts")),
+    max_bytes=int(os.getenv("ARTIFACT_MAX_BYTES", str(1024 * 1024 * 1024))),
+)
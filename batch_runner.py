@@ -0,0 +1,513 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from checkpoint import checkpoint_journal
+from client_pool import client_registry
+from jobs import JOB_RUNNING, Job
+from logging_setup import setup_logging
+from models import APIConfig, ModelConfig, PaperConfig
+from openai_client import OpenAIClient
+from outline import OutlineTree
+from paper_generator import run_paper_generation
+from rate_control import RetryPolicy, get_upstream
+from scheduler import SectionScheduler
+from utils import load_env_endpoints, safe_filename
+
+logger = logging.getLogger(__name__)
+
+# 无界面的批量论文生成
+#
+# 从JSONL清单读取主题（可选标题、大纲），对每一项执行 标题 → 大纲 → 章节 → 导出。
+# 所有论文共享同一个章节调度器和连接池，并发上限和RPM/TPM预算对整个批次生效；
+# 章节进度写入检查点日志，重新运行同一批次时跳过已完成的论文并复用已完成的章节。
+#
+# 也可以生成供应商Batch API格式的请求文件离线处理，再把结果导入检查点后继续下一阶段。
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+# 单个Batch API请求文件的最大请求数
+BATCH_FILE_MAX_REQUESTS = 50000
+RESULTS_FILE = "results.jsonl"
+SUMMARY_FILE = "summary.json"
+
+
+def load_manifest(path: str) -> List[Dict[str, Any]]:
+    """读取JSONL清单，每行至少包含topic或title，可选id、outline、content_sections、export_formats"""
+    items = []
+    seen = set()
+    with open(path, "r", encoding="utf-8") as f:
+        for lineno, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            item = json.loads(line)
+            if not item.get("topic") and not item.get("title"):
+                raise ValueError(f"{path}:{lineno}: topic or title is required")
+            item["id"] = str(item.get("id") or lineno)
+            if item["id"] in seen:
+                raise ValueError(f"{path}:{lineno}: duplicate id {item['id']}")
+            seen.add(item["id"])
+            item.setdefault("topic", item.get("title", ""))
+            items.append(item)
+    return items
+
+
+class BatchRunner:
+    def __init__(
+        self,
+        api_config: APIConfig,
+        model_config: ModelConfig,
+        output_dir: str,
+        max_papers: int = 4,
+        export_formats: Optional[List[str]] = None,
+        export_backend: str = "native",
+    ):
+        self.api_config = api_config
+        self.model_config = model_config
+        self.output_dir = os.path.abspath(output_dir)
+        self.max_papers = max(1, max_papers)
+        self.export_formats = export_formats or ["docx"]
+        self.export_backend = export_backend
+
+        self.client = OpenAIClient(api_config, model_config)
+        # 整个批次共享的调度器：章节、标题和大纲请求都经过同一个并发控制器和预算
+        upstream = get_upstream(
+            api_config.base_url,
+            model_config.concurrent_requests,
+            model_config.requests_per_minute,
+            model_config.tokens_per_minute,
+        )
+        self.scheduler = SectionScheduler(
+            model_config.concurrent_requests,
+            retry_policy=RetryPolicy(max_retries=model_config.max_retries),
+            budget=upstream.budget,
+            limiter=upstream.limiter,
+        )
+
+    def job_id(self, item_id: str) -> str:
+        # 同一输出目录下的同一条目总是得到相同的job_id，以便复用检查点
+        key = f"{self.output_dir}:{item_id}"
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]
+
+    def _paper_dir(self, item_id: str) -> str:
+        return os.path.join(self.output_dir, safe_filename(item_id))
+
+    def _append_result(self, record: Dict[str, Any]):
+        os.makedirs(self.output_dir, exist_ok=True)
+        with open(
+            os.path.join(self.output_dir, RESULTS_FILE), "a", encoding="utf-8"
+        ) as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def completed_items(self) -> Dict[str, Dict[str, Any]]:
+        """之前运行中已完成的条目"""
+        records: Dict[str, Dict[str, Any]] = {}
+        try:
+            with open(
+                os.path.join(self.output_dir, RESULTS_FILE), "r", encoding="utf-8"
+            ) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    records[record["id"]] = record
+        except OSError:
+            pass
+        return {
+            item_id: record
+            for item_id, record in records.items()
+            if record.get("state") == "completed"
+        }
+
+    async def _call(self, func, *args):
+        # 单个请求也经过共享调度器，享受同样的限流与重试
+        results = await self.scheduler.run([None], lambda index, item: func(*args))
+        return results[0]
+
+    async def _plan(self, item: Dict[str, Any], job_id: str) -> PaperConfig:
+        """确定标题和大纲：优先使用清单中的值，其次是检查点中上次生成的结果"""
+        job_info = await checkpoint_journal.load_job(job_id) or {}
+        previous = job_info.get("config", {})
+        if previous.get("topic") != item["topic"]:
+            previous = {}
+
+        title = item.get("title") or previous.get("title")
+        if not title:
+            title = await self._call(
+                self.client.generate_title, item["topic"], self.model_config
+            )
+            await self._record_plan(job_id, item["topic"], title, [])
+
+        outline = item.get("outline")
+        if not outline and previous.get("title") == title:
+            outline = previous.get("outline")
+
+        # 没有大纲时边流式生成大纲边生成章节，完整的大纲在生成过程中写入检查点
+        return PaperConfig(
+            topic=item["topic"],
+            title=title,
+            outline=outline or [],
+            auto_outline=not outline,
+            content_sections=item.get("content_sections", []),
+            export_formats=item.get("export_formats", self.export_formats),
+            export_backend=item.get("export_backend", self.export_backend),
+        )
+
+    async def _record_plan(
+        self, job_id: str, topic: str, title: str, outline: List[str]
+    ):
+        # 标题和大纲也写入检查点，重新运行时不必再次生成
+        await checkpoint_journal.start(
+            job_id,
+            "",
+            {
+                "tenant": "batch",
+                "config": {"topic": topic, "title": title, "outline": outline},
+                "model_config": self.model_config.model_dump(),
+                "api_config": {
+                    "base_url": self.api_config.base_url,
+                    "model_name": self.api_config.model_name,
+                },
+            },
+        )
+
+    async def run_item(
+        self, item: Dict[str, Any], papers: asyncio.Semaphore
+    ) -> Dict[str, Any]:
+        async with papers:
+            start_time = time.time()
+            job_id = self.job_id(item["id"])
+            record: Dict[str, Any] = {"id": item["id"], "job_id": job_id}
+            try:
+                config = await self._plan(item, job_id)
+                job = Job("batch", config, self.api_config, self.model_config, job_id)
+                job.state = JOB_RUNNING
+
+                paper_dir = self._paper_dir(item["id"])
+                os.makedirs(paper_dir, exist_ok=True)
+                result = await run_paper_generation(
+                    job, scheduler=self.scheduler, output_dir=paper_dir
+                )
+                exports = await job.export_task
+                record.update(
+                    {
+                        "state": "completed",
+                        "title": config.title,
+                        "markdown_file": result["markdown_file"],
+                        "exports": exports,
+                        "sections": job.status["total_sections"],
+                        "resumed_sections": job.status["resumed_sections"],
+                        "retries": job.status["retries"],
+                        "prompt_tokens": job.status["prompt_tokens"],
+                    }
+                )
+                logger.info("Batch item %s completed: %s", item["id"], config.title)
+            except Exception as e:
+                record.update(
+                    {"state": "failed", "error": str(getattr(e, "detail", None) or e)}
+                )
+                logger.warning("Batch item %s failed: %s", item["id"], record["error"])
+            record["elapsed"] = time.time() - start_time
+            await asyncio.to_thread(self._append_result, record)
+            return record
+
+    async def run(
+        self, items: List[Dict[str, Any]], force: bool = False
+    ) -> Dict[str, Any]:
+        """生成清单中的所有论文，返回汇总报告并写入summary.json"""
+        start_time = time.time()
+        done = {} if force else self.completed_items()
+        pending = [item for item in items if item["id"] not in done]
+        logger.info(
+            "Batch: %d items, %d already completed",
+            len(items),
+            len(items) - len(pending),
+        )
+
+        papers = asyncio.Semaphore(self.max_papers)
+        records = await asyncio.gather(
+            *[self.run_item(item, papers) for item in pending]
+        )
+        summary = self.summarize(
+            records, skipped=len(items) - len(pending), elapsed=time.time() - start_time
+        )
+        with open(
+            os.path.join(self.output_dir, SUMMARY_FILE), "w", encoding="utf-8"
+        ) as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+        return summary
+
+    def summarize(
+        self, records: List[Dict[str, Any]], skipped: int, elapsed: float
+    ) -> Dict[str, Any]:
+        completed = [record for record in records if record["state"] == "completed"]
+        prompt_tokens = {"full": 0, "sent": 0, "saved": 0, "upstream": 0, "cached": 0}
+        for record in completed:
+            for key in prompt_tokens:
+                # 之前版本的结果没有upstream和cached
+                prompt_tokens[key] += record["prompt_tokens"].get(key, 0)
+        return {
+            "total": len(records) + skipped,
+            "completed": len(completed),
+            "failed": len(records) - len(completed),
+            "skipped": skipped,
+            "elapsed": elapsed,
+            "papers_per_minute": len(completed) / elapsed * 60 if elapsed else 0.0,
+            "sections": sum(record["sections"] for record in completed),
+            "resumed_sections": sum(record["resumed_sections"] for record in completed),
+            "retries": sum(record["retries"] for record in completed),
+            "prompt_tokens": prompt_tokens,
+            "failures": [
+                {"id": record["id"], "error": record["error"]}
+                for record in records
+                if record["state"] != "completed"
+            ],
+        }
+
+    def _batch_request(
+        self, custom_id: str, messages: List[Dict[str, Any]]
+    ) -> Dict[str, Any]:
+        return {
+            "custom_id": custom_id,
+            "method": "POST",
+            "url": BATCH_ENDPOINT,
+            "body": {
+                "model": self.api_config.model_name,
+                "messages": messages,
+                "temperature": self.model_config.temperature,
+                "max_tokens": self.model_config.max_tokens,
+                "top_p": self.model_config.top_p,
+            },
+        }
+
+    async def write_batch_requests(self, items: List[Dict[str, Any]]) -> List[str]:
+        """为每个条目生成下一阶段的Batch API请求
+
+        缺少标题时生成标题请求，缺少大纲时生成大纲请求，否则生成所有缺失章节的请求。
+        custom_id格式为"<条目id>:<阶段>[:<大纲序号>]"，供import_batch_results解析。
+        """
+        requests = []
+        for item in items:
+            job_id = self.job_id(item["id"])
+            job_info = await checkpoint_journal.load_job(job_id) or {}
+            previous = job_info.get("config", {})
+            if previous.get("topic") != item["topic"]:
+                previous = {}
+
+            title = item.get("title") or previous.get("title")
+            if not title:
+                requests.append(
+                    self._batch_request(
+                        f"{item['id']}:title", self.client.title_messages(item["topic"])
+                    )
+                )
+                continue
+            outline = item.get("outline")
+            if not outline and previous.get("title") == title:
+                outline = previous.get("outline")
+            if not outline:
+                requests.append(
+                    self._batch_request(
+                        f"{item['id']}:outline",
+                        self.client.outline_messages(item["topic"], title),
+                    )
+                )
+                continue
+
+            tree = OutlineTree.parse(outline, item.get("content_sections", []))
+            lines = tree.lines()
+            outline_hash = checkpoint_journal.outline_hash(item["topic"], title, lines)
+            done = await checkpoint_journal.load_sections(job_id, outline_hash)
+            for node in tree.content_nodes():
+                if node.index in done:
+                    continue
+                messages, _, _ = self.client.section_messages(
+                    item["topic"],
+                    title,
+                    lines,
+                    node.text,
+                    self.model_config,
+                    section_index=node.index,
+                )
+                requests.append(
+                    self._batch_request(f"{item['id']}:section:{node.index}", messages)
+                )
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        files = []
+        for start in range(0, len(requests), BATCH_FILE_MAX_REQUESTS):
+            path = os.path.join(
+                self.output_dir,
+                f"batch_requests_{start // BATCH_FILE_MAX_REQUESTS:03d}.jsonl",
+            )
+            with open(path, "w", encoding="utf-8") as f:
+                for request in requests[start : start + BATCH_FILE_MAX_REQUESTS]:
+                    f.write(json.dumps(request, ensure_ascii=False) + "\n")
+            files.append(path)
+        logger.info("Batch: wrote %d requests to %d files", len(requests), len(files))
+        return files
+
+    async def import_batch_results(
+        self, items: List[Dict[str, Any]], results_file: str
+    ) -> int:
+        """把Batch API的输出导入检查点，之后重新生成请求文件或直接运行即可进入下一阶段"""
+        items_by_id = {item["id"]: item for item in items}
+        # 每个条目的(修复后的大纲, 大纲哈希)，导入章节时只需计算一次
+        plans: Dict[str, Tuple[List[str], str]] = {}
+        imported = 0
+        with open(results_file, "r", encoding="utf-8") as f:
+            results = [json.loads(line) for line in f if line.strip()]
+
+        for result in results:
+            response = result.get("response") or {}
+            if result.get("error") or response.get("status_code") != 200:
+                logger.warning(
+                    "Batch: skipping failed request %s", result.get("custom_id")
+                )
+                continue
+            item_id, stage, *rest = result["custom_id"].split(":")
+            item = items_by_id.get(item_id)
+            if item is None:
+                continue
+            content = response["body"]["choices"][0]["message"]["content"] or ""
+            job_id = self.job_id(item_id)
+
+            if stage == "title":
+                await self._record_plan(job_id, item["topic"], content.strip(), [])
+            elif stage == "outline":
+                title = item.get("title") or (
+                    (await checkpoint_journal.load_job(job_id) or {})
+                    .get("config", {})
+                    .get("title")
+                )
+                await self._record_plan(
+                    job_id, item["topic"], title, OpenAIClient.parse_outline(content)
+                )
+            elif stage == "section":
+                if item_id not in plans:
+                    config = await self._plan(item, job_id)
+                    outline = OutlineTree.parse(
+                        config.outline, config.content_sections
+                    ).lines()
+                    plans[item_id] = (
+                        outline,
+                        checkpoint_journal.outline_hash(
+                            config.topic, config.title, outline
+                        ),
+                    )
+                outline, outline_hash = plans[item_id]
+                index = int(rest[0])
+                await checkpoint_journal.append_section(
+                    job_id, outline_hash, index, outline[index], content
+                )
+            imported += 1
+        logger.info("Batch: imported %d results from %s", imported, results_file)
+        return imported
+
+
+def _load_json_arg(value: str) -> Any:
+    """命令行参数可以是JSON字符串，也可以是JSON文件路径"""
+    if os.path.exists(value):
+        with open(value, "r", encoding="utf-8") as f:
+            return json.load(f)
+    return json.loads(value)
+
+
+def _load_model_config(value: Optional[str]) -> ModelConfig:
+    if not value:
+        return ModelConfig()
+    return ModelConfig(**_load_json_arg(value))
+
+
+async def _main(args: argparse.Namespace) -> int:
+    api_config = APIConfig(
+        api_key=args.api_key or os.getenv("OPENAI_API_KEY", ""),
+        base_url=args.base_url
+        or os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1"),
+        model_name=args.model or os.getenv("OPENAI_MODEL_NAME", "gpt-4o"),
+        endpoints=(
+            _load_json_arg(args.endpoints) if args.endpoints else load_env_endpoints()
+        ),
+        routing_strategy=args.routing_strategy
+        or os.getenv("OPENAI_ROUTING_STRATEGY", "least_outstanding"),
+    )
+    runner = BatchRunner(
+        api_config,
+        _load_model_config(args.model_config),
+        args.output_dir,
+        max_papers=args.max_papers,
+        export_formats=args.formats.split(",") if args.formats else None,
+        export_backend=args.export_backend,
+    )
+    items = load_manifest(args.manifest)
+    try:
+        if args.import_batch:
+            await runner.import_batch_results(items, args.import_batch)
+        if args.emit_batch:
+            await runner.write_batch_requests(items)
+            return 0
+        summary = await runner.run(items, force=args.force)
+    finally:
+        await client_registry.close()
+
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+    return 1 if summary["failed"] else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="从JSONL清单批量生成论文")
+    parser.add_argument(
+        "manifest", help="JSONL清单，每行一个 {id, topic, title, outline}"
+    )
+    parser.add_argument(
+        "-o",
+        "--output-dir",
+        default="batch_output",
+        help="输出目录（默认batch_output）",
+    )
+    parser.add_argument("--api-key", help="默认读取OPENAI_API_KEY")
+    parser.add_argument("--base-url", help="默认读取OPENAI_BASE_URL")
+    parser.add_argument("--model", help="默认读取OPENAI_MODEL_NAME")
+    parser.add_argument(
+        "--endpoints",
+        help="额外上游端点的JSON数组或JSON文件路径（默认读取OPENAI_ENDPOINTS）",
+    )
+    parser.add_argument(
+        "--routing-strategy",
+        choices=["least_outstanding", "ewma"],
+        help="端点选择策略（默认读取OPENAI_ROUTING_STRATEGY）",
+    )
+    parser.add_argument("--model-config", help="模型配置的JSON字符串或JSON文件路径")
+    parser.add_argument(
+        "--max-papers", type=int, default=4, help="同时生成的论文数（默认4）"
+    )
+    parser.add_argument("--formats", help="导出格式，逗号分隔（默认docx）")
+    parser.add_argument(
+        "--export-backend", default="native", choices=["native", "pandoc"]
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="重新生成已完成的条目（章节检查点仍会复用）",
+    )
+    parser.add_argument(
+        "--emit-batch", action="store_true", help="只生成Batch API请求文件，不调用模型"
+    )
+    parser.add_argument("--import-batch", help="导入Batch API输出文件到检查点")
+    args = parser.parse_args()
+
+    load_dotenv(override=True)
+    setup_logging()
+    raise SystemExit(asyncio.run(_main(args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,346 @@
+import argparse
+import json
+import math
+import random
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+
+# 模拟输出使用的文本，一个汉字大约对应一个token
+FILLER_TEXT = "本研究围绕该主题展开系统分析并给出实验数据与讨论。"
+# 流式响应每个chunk包含的token数
+CHUNK_TOKENS = 8
+# 模拟前缀缓存的块大小（token数），只有完整的块才能命中
+PREFIX_BLOCK_TOKENS = 64
+
+
+class MockBehavior:
+    """模拟服务的行为配置：首个token延迟的分布、输出速率以及错误注入"""
+
+    def __init__(
+        self,
+        latency_dist: str = "lognormal",
+        latency_mean: float = 0.5,
+        latency_sigma: float = 0.5,
+        tokens_per_second: float = 200.0,
+        completion_tokens: int = 400,
+        error_rate: float = 0.0,
+        rate_limit_rate: float = 0.0,
+        retry_after: float = 1.0,
+        outline_sections: int = 12,
+        prefill_seconds_per_1k: float = 0.0,
+        prefix_cache_blocks: int = 4096,
+        seed: Optional[int] = None,
+    ):
+        self.latency_dist = latency_dist
+        self.latency_mean = latency_mean
+        self.latency_sigma = latency_sigma
+        self.tokens_per_second = tokens_per_second
+        self.completion_tokens = completion_tokens
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.outline_sections = outline_sections
+        self.prefill_seconds_per_1k = prefill_seconds_per_1k
+        self.prefix_cache_blocks = prefix_cache_blocks
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        # 已缓存的前缀块：键为从开头到该块结尾的整段前缀，最久未使用的先淘汰
+        self._prefix_blocks: "OrderedDict[str, None]" = OrderedDict()
+        self.stats = {
+            "requests": 0,
+            "errors": 0,
+            "rate_limited": 0,
+            "streams": 0,
+            "prompt_tokens": 0,
+            "cached_tokens": 0,
+        }
+
+    def first_token_delay(self) -> float:
+        with self._lock:
+            if self.latency_dist == "fixed":
+                return self.latency_mean
+            if self.latency_dist == "uniform":
+                return self._random.uniform(0, 2 * self.latency_mean)
+            # 对数正态分布，均值为latency_mean，长尾由latency_sigma控制
+            mu = math.log(max(self.latency_mean, 1e-6)) - self.latency_sigma**2 / 2
+            return self._random.lognormvariate(mu, self.latency_sigma)
+
+    def cached_tokens(self, prompt: str) -> int:
+        """提示词开头有多少token命中前缀缓存（按块计算）"""
+        cached = 0
+        with self._lock:
+            for end in range(PREFIX_BLOCK_TOKENS, len(prompt) + 1, PREFIX_BLOCK_TOKENS):
+                if prompt[:end] not in self._prefix_blocks:
+                    break
+                self._prefix_blocks.move_to_end(prompt[:end])
+                cached = end
+            self.stats["prompt_tokens"] += len(prompt)
+            self.stats["cached_tokens"] += cached
+        return cached
+
+    def remember_prefix(self, prompt: str):
+        """预填充完成（开始输出）后缓存提示词的所有完整块"""
+        if self.prefix_cache_blocks <= 0:
+            return
+        with self._lock:
+            for end in range(PREFIX_BLOCK_TOKENS, len(prompt) + 1, PREFIX_BLOCK_TOKENS):
+                self._prefix_blocks[prompt[:end]] = None
+                self._prefix_blocks.move_to_end(prompt[:end])
+            while len(self._prefix_blocks) > self.prefix_cache_blocks:
+                self._prefix_blocks.popitem(last=False)
+
+    def prefill_delay(self, prompt_tokens: int, cached_tokens: int) -> float:
+        return (prompt_tokens - cached_tokens) / 1000 * self.prefill_seconds_per_1k
+
+    def fault(self) -> Optional[int]:
+        with self._lock:
+            self.stats["requests"] += 1
+            value = self._random.random()
+            if value < self.rate_limit_rate:
+                self.stats["rate_limited"] += 1
+                return 429
+            if value < self.rate_limit_rate + self.error_rate:
+                self.stats["errors"] += 1
+                return 500
+        return None
+
+    def content(self, messages: List[Dict[str, Any]]) -> str:
+        # 按系统提示中的角色区分请求类型
+        system = messages[0].get("content", "") if messages else ""
+        if "标题" in system:
+            return "基准测试论文标题"
+        if "大纲" in system:
+            lines = []
+            for chapter in range(1, self.outline_sections // 4 + 2):
+                lines.append(f"{chapter}. 第{chapter}部分")
+                for section in range(1, 4):
+                    lines.append(f"{chapter}.{section} 小节{chapter}.{section}")
+            return "\n".join(lines[: self.outline_sections])
+        repeat = self.completion_tokens // len(FILLER_TEXT) + 1
+        return (FILLER_TEXT * repeat)[: self.completion_tokens]
+
+
+def make_handler(behavior: MockBehavior):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _send_json(
+            self,
+            status: int,
+            body: Dict[str, Any],
+            headers: Optional[Dict[str, str]] = None,
+        ):
+            data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _write_chunk(self, data: bytes):
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+
+        def do_GET(self):
+            if self.path.rstrip("/").endswith("/stats"):
+                self._send_json(200, behavior.stats)
+            else:
+                self._send_json(200, {"object": "list", "data": [{"id": "mock"}]})
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            body = json.loads(self.rfile.read(length) or b"{}")
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self._send_json(404, {"error": {"message": "Not found"}})
+                return
+
+            status = behavior.fault()
+            if status == 429:
+                self._send_json(
+                    429,
+                    {"error": {"message": "Rate limit reached", "type": "rate_limit"}},
+                    {"Retry-After": str(behavior.retry_after)},
+                )
+                return
+            if status:
+                self._send_json(
+                    status, {"error": {"message": "Injected failure", "type": "server"}}
+                )
+                return
+
+            messages = body.get("messages", [])
+            text = behavior.content(messages)
+            # 一个字符按一个token计，角色也计入前缀
+            prompt = "".join(
+                f"{m.get('role', '')}:{m.get('content', '')}\n" for m in messages
+            )
+            prompt_tokens = len(prompt)
+            cached_tokens = behavior.cached_tokens(prompt)
+            usage = {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": len(text),
+                "total_tokens": prompt_tokens + len(text),
+                "prompt_tokens_details": {"cached_tokens": cached_tokens},
+            }
+            time.sleep(
+                behavior.first_token_delay()
+                + behavior.prefill_delay(prompt_tokens, cached_tokens)
+            )
+            behavior.remember_prefix(prompt)
+
+            if not body.get("stream"):
+                time.sleep(len(text) / behavior.tokens_per_second)
+                self._send_json(
+                    200,
+                    {
+                        "id": "chatcmpl-mock",
+                        "object": "chat.completion",
+                        "created": int(time.time()),
+                        "model": body.get("model", "mock"),
+                        "choices": [
+                            {
+                                "index": 0,
+                                "message": {"role": "assistant", "content": text},
+                                "finish_reason": "stop",
+                            }
+                        ],
+                        "usage": usage,
+                    },
+                )
+                return
+
+            with behavior._lock:
+                behavior.stats["streams"] += 1
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            try:
+                for start in range(0, len(text), CHUNK_TOKENS):
+                    if start:
+                        time.sleep(CHUNK_TOKENS / behavior.tokens_per_second)
+                    chunk = {
+                        "id": "chatcmpl-mock",
+                        "object": "chat.completion.chunk",
+                        "created": int(time.time()),
+                        "model": body.get("model", "mock"),
+                        "choices": [
+                            {
+                                "index": 0,
+                                "delta": {
+                                    "content": text[start : start + CHUNK_TOKENS]
+                                },
+                                "finish_reason": None,
+                            }
+                        ],
+                    }
+                    self._write_chunk(
+                        f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode()
+                    )
+                if (body.get("stream_options") or {}).get("include_usage"):
+                    final = {
+                        "id": "chatcmpl-mock",
+                        "object": "chat.completion.chunk",
+                        "created": int(time.time()),
+                        "model": body.get("model", "mock"),
+                        "choices": [],
+                        "usage": usage,
+                    }
+                    self._write_chunk(f"data: {json.dumps(final)}\n\n".encode())
+                self._write_chunk(b"data: [DONE]\n\n")
+                self.wfile.write(b"0\r\n\r\n")
+            except (BrokenPipeError, ConnectionResetError):
+                # 客户端取消了请求
+                pass
+
+    return Handler
+
+
+def serve(behavior: MockBehavior, host: str = "127.0.0.1", port: int = 0):
+    server = ThreadingHTTPServer((host, port), make_handler(behavior))
+    server.daemon_threads = True
+    # 父进程读取这一行得到实际监听的端口
+    print(f"listening http://{host}:{server.server_address[1]}/v1", flush=True)
+    server.serve_forever()
+
+
+def add_behavior_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "--latency-dist", default="lognormal", choices=["fixed", "uniform", "lognormal"]
+    )
+    parser.add_argument(
+        "--latency-mean", type=float, default=0.5, help="首个token的平均延迟（秒）"
+    )
+    parser.add_argument(
+        "--latency-sigma", type=float, default=0.5, help="对数正态分布的sigma"
+    )
+    parser.add_argument(
+        "--tokens-per-second", type=float, default=200.0, help="每个请求的输出速率"
+    )
+    parser.add_argument(
+        "--completion-tokens", type=int, default=400, help="章节响应的token数"
+    )
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回500的比例")
+    parser.add_argument(
+        "--rate-limit-rate", type=float, default=0.0, help="返回429的比例"
+    )
+    parser.add_argument(
+        "--retry-after", type=float, default=1.0, help="429响应的Retry-After（秒）"
+    )
+    parser.add_argument(
+        "--outline-sections", type=int, default=12, help="大纲请求返回的条目数"
+    )
+    parser.add_argument(
+        "--prefill-seconds-per-1k",
+        type=float,
+        default=0.0,
+        help="每1000个未命中前缀缓存的提示词token增加的首个token延迟（秒）",
+    )
+    parser.add_argument(
+        "--prefix-cache-blocks",
+        type=int,
+        default=4096,
+        help="前缀缓存保留的块数（每块64个token），0表示不缓存",
+    )
+    parser.add_argument("--seed", type=int, default=None)
+
+
+def behavior_from_args(args: argparse.Namespace) -> MockBehavior:
+    return MockBehavior(
+        latency_dist=args.latency_dist,
+        latency_mean=args.latency_mean,
+        latency_sigma=args.latency_sigma,
+        tokens_per_second=args.tokens_per_second,
+        completion_tokens=args.completion_tokens,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        retry_after=args.retry_after,
+        outline_sections=args.outline_sections,
+        prefill_seconds_per_1k=args.prefill_seconds_per_1k,
+        prefix_cache_blocks=args.prefix_cache_blocks,
+        seed=args.seed,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OpenAI兼容的本地模拟服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=0, help="0表示随机端口")
+    add_behavior_arguments(parser)
+    args = parser.parse_args()
+    try:
+        serve(behavior_from_args(args), args.host, args.port)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
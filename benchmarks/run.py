@@ -0,0 +1,356 @@
+import argparse
+import asyncio
+import functools
+import itertools
+import json
+import math
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from typing import Any, Dict, List, Optional, Tuple
+
+from benchmarks.mock_server import add_behavior_arguments
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# 透传给模拟服务的参数，同时记录在结果中
+MOCK_OPTIONS = (
+    "latency_dist",
+    "latency_mean",
+    "latency_sigma",
+    "tokens_per_second",
+    "completion_tokens",
+    "error_rate",
+    "rate_limit_rate",
+    "retry_after",
+    "outline_sections",
+    "prefill_seconds_per_1k",
+    "prefix_cache_blocks",
+    "seed",
+)
+
+
+def make_outline(size: int) -> List[str]:
+    """生成size个条目的大纲：每章一个标题加三个小节"""
+    outline = []
+    chapter = 0
+    while len(outline) < size:
+        chapter += 1
+        outline.append(f"{chapter}. 第{chapter}章")
+        for section in range(1, 4):
+            if len(outline) < size:
+                outline.append(f"{chapter}.{section} 第{chapter}.{section}节")
+    return outline
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    # 最近秩法
+    rank = min(len(ordered), max(1, math.ceil(pct / 100 * len(ordered))))
+    return ordered[rank - 1]
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux以KB为单位，macOS以字节为单位
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _fetch_stats(base_url: str) -> Dict[str, int]:
+    with urllib.request.urlopen(f"{base_url}/stats", timeout=5) as response:
+        return json.loads(response.read())
+
+
+async def run_scenario(scenario: Dict[str, Any], base_url: str) -> Dict[str, Any]:
+    """在当前进程中运行一个场景：users个租户同时提交论文，每人papers_per_user篇"""
+    # 检查点、缓存和导出文件都写到临时目录，需在导入项目模块之前设置
+    work_dir = tempfile.mkdtemp(prefix="paper-bench-")
+    os.environ["CHECKPOINT_DIR"] = os.path.join(work_dir, "checkpoints")
+    os.environ["LLM_CACHE_DIR"] = os.path.join(work_dir, "llm_cache")
+    os.environ["ARTIFACT_DIR"] = os.path.join(work_dir, "artifacts")
+    os.environ["STATE_STORE_PATH"] = os.path.join(work_dir, "state.db")
+
+    from client_pool import client_registry
+    from jobs import JOB_COMPLETED, JobManager
+    from models import APIConfig, ModelConfig, PaperConfig
+    from paper_generator import run_paper_generation
+
+    users = scenario["users"]
+    papers = users * scenario["papers_per_user"]
+    api_config = APIConfig(api_key="benchmark", base_url=base_url, model_name="mock")
+    model_config = ModelConfig(
+        concurrent_requests=scenario["concurrent_requests"],
+        max_tokens=scenario["max_tokens"],
+        stream_sections=scenario["stream"],
+        prefix_cache=scenario.get("prefix_cache", False),
+    )
+    outline = make_outline(scenario["outline_size"])
+    manager = JobManager(
+        functools.partial(run_paper_generation, output_dir=work_dir),
+        max_running_jobs=users,
+        max_queued_jobs=papers,
+        max_jobs_per_tenant=papers,
+    )
+
+    section_latencies: List[float] = []
+    end_to_end: List[float] = []
+
+    async def _one_paper(i: int):
+        config = PaperConfig(
+            topic="基准测试",
+            title=f"benchmark paper {i}",
+            outline=[] if scenario["auto_outline"] else outline,
+            auto_outline=scenario["auto_outline"],
+            export_formats=scenario["export_formats"],
+        )
+        started = time.monotonic()
+        job = await manager.submit(
+            f"user-{i % users}", config, api_config, model_config
+        )
+        events = job.subscribe()
+        section_started: Dict[int, float] = {}
+        while True:
+            event, data = await events.get()
+            if event == "section_start":
+                section_started[data["index"]] = time.monotonic()
+            elif event == "section_done" and data["index"] in section_started:
+                section_latencies.append(
+                    time.monotonic() - section_started.pop(data["index"])
+                )
+            elif event == "done":
+                break
+        if job.export_task is not None:
+            await job.export_task
+        end_to_end.append(time.monotonic() - started)
+        return job
+
+    stats_before = _fetch_stats(base_url)
+    started = time.monotonic()
+    try:
+        jobs = await asyncio.gather(*[_one_paper(i) for i in range(papers)])
+    finally:
+        wall = time.monotonic() - started
+        await client_registry.close()
+        shutil.rmtree(work_dir, ignore_errors=True)
+    stats_after = _fetch_stats(base_url)
+
+    completed = [job for job in jobs if job.state == JOB_COMPLETED]
+    return {
+        "name": scenario["name"],
+        "params": {k: v for k, v in scenario.items() if k != "name"},
+        "papers": papers,
+        "failed": papers - len(completed),
+        "sections": len(section_latencies),
+        "wall_seconds": round(wall, 3),
+        "papers_per_min": round(len(completed) / wall * 60, 3) if wall else None,
+        "section_latency": {
+            "p50": percentile(section_latencies, 50),
+            "p95": percentile(section_latencies, 95),
+            "p99": percentile(section_latencies, 99),
+            "mean": (
+                sum(section_latencies) / len(section_latencies)
+                if section_latencies
+                else None
+            ),
+        },
+        "end_to_end": {
+            "p50": percentile(end_to_end, 50),
+            "p95": percentile(end_to_end, 95),
+            "max": max(end_to_end) if end_to_end else None,
+        },
+        "retries": sum(job.status.get("retries", 0) for job in jobs),
+        "upstream": {
+            key: stats_after[key] - stats_before.get(key, 0) for key in stats_after
+        },
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+
+def build_scenarios(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    scenarios = []
+    for outline_size, concurrency, users in itertools.product(
+        args.outline_sizes, args.concurrency, args.users
+    ):
+        scenarios.append(
+            {
+                "name": f"outline={outline_size},concurrency={concurrency},users={users}",
+                "outline_size": outline_size,
+                "concurrent_requests": concurrency,
+                "users": users,
+                "papers_per_user": args.papers_per_user,
+                "stream": not args.no_stream,
+                "max_tokens": args.completion_tokens,
+                "export_formats": args.export_formats,
+                "auto_outline": args.auto_outline,
+                "prefix_cache": args.prefix_cache,
+            }
+        )
+    return scenarios
+
+
+def start_mock_server(args: argparse.Namespace) -> Tuple[subprocess.Popen, str]:
+    command = [sys.executable, "-m", "benchmarks.mock_server", "--port", "0"]
+    for name in MOCK_OPTIONS:
+        value = getattr(args, name)
+        if value is not None:
+            command += [f"--{name.replace('_', '-')}", str(value)]
+    process = subprocess.Popen(command, cwd=REPO_DIR, stdout=subprocess.PIPE, text=True)
+    line = process.stdout.readline().strip()
+    if not line.startswith("listening "):
+        process.kill()
+        raise RuntimeError(f"Mock server failed to start: {line}")
+    return process, line.split(" ", 1)[1]
+
+
+def run_child(scenario: Dict[str, Any], base_url: str, verbose: bool) -> Dict[str, Any]:
+    with tempfile.NamedTemporaryFile("r", suffix=".json") as result_file:
+        command = [
+            sys.executable,
+            "-m",
+            "benchmarks.run",
+            "--child",
+            json.dumps(scenario),
+            "--base-url",
+            base_url,
+            "--result-file",
+            result_file.name,
+        ]
+        # 生成过程的日志写到stderr，默认只保留错误，避免干扰结果输出
+        env = dict(os.environ, LOG_LEVEL="INFO" if verbose else "ERROR")
+        completed = subprocess.run(
+            command,
+            cwd=REPO_DIR,
+            env=env,
+            stdout=None if verbose else subprocess.DEVNULL,
+        )
+        if completed.returncode != 0:
+            return {"name": scenario["name"], "error": f"exit {completed.returncode}"}
+        return json.load(result_file)
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=REPO_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: List[Dict[str, Any]], baseline_file: str):
+    """按场景名称对比吞吐量和p95章节延迟"""
+    with open(baseline_file, "r", encoding="utf-8") as f:
+        baseline = {s["name"]: s for s in json.load(f)["scenarios"]}
+
+    def _delta(new, old):
+        if new is None or not old:
+            return "n/a"
+        return f"{(new - old) / old * 100:+.1f}%"
+
+    print(f"\nCompared with {baseline_file}:")
+    for result in results:
+        old = baseline.get(result["name"])
+        if old is None or "error" in result or "error" in old:
+            continue
+        print(
+            f"  {result['name']}: papers/min {_delta(result['papers_per_min'], old['papers_per_min'])}, "
+            f"section p95 {_delta(result['section_latency']['p95'], old['section_latency']['p95'])}, "
+            f"peak RSS {_delta(result['peak_rss_mb'], old['peak_rss_mb'])}"
+        )
+
+
+def _int_list(value: str) -> List[int]:
+    return [int(part) for part in value.split(",") if part]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="论文生成流水线基准测试")
+    parser.add_argument("--outline-sizes", type=_int_list, default=[12, 48])
+    parser.add_argument("--concurrency", type=_int_list, default=[4, 16])
+    parser.add_argument("--users", type=_int_list, default=[1, 4])
+    parser.add_argument("--papers-per-user", type=int, default=2)
+    parser.add_argument("--no-stream", action="store_true", help="章节不使用流式请求")
+    parser.add_argument(
+        "--export-formats",
+        type=lambda value: [part for part in value.split(",") if part],
+        default=[],
+        help="每篇论文导出的格式，逗号分隔（默认不导出）",
+    )
+    parser.add_argument(
+        "--auto-outline",
+        action="store_true",
+        help="一键生成：由模拟服务流式返回大纲（条目数见--outline-sections），与章节流水线式生成",
+    )
+    parser.add_argument(
+        "--prefix-cache",
+        action="store_true",
+        help="章节提示词使用前缀缓存布局（模拟服务的前缀缓存见--prefill-seconds-per-1k）",
+    )
+    parser.add_argument("-o", "--output", help="结果JSON文件，默认输出到标准输出")
+    parser.add_argument("--compare", help="与之前的结果JSON对比")
+    parser.add_argument("--verbose", action="store_true", help="显示生成过程的日志")
+    add_behavior_arguments(parser)
+    # 子进程参数：运行单个场景并把结果写入文件
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--base-url", help=argparse.SUPPRESS)
+    parser.add_argument("--result-file", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        from logging_setup import setup_logging
+
+        setup_logging()
+        result = asyncio.run(run_scenario(json.loads(args.child), args.base_url))
+        with open(args.result_file, "w", encoding="utf-8") as f:
+            json.dump(result, f)
+        return
+
+    server, base_url = start_mock_server(args)
+    results = []
+    try:
+        for scenario in build_scenarios(args):
+            result = run_child(scenario, base_url, args.verbose)
+            results.append(result)
+            if "error" in result:
+                print(f"{result['name']}: failed ({result['error']})", file=sys.stderr)
+                continue
+            print(
+                f"{result['name']}: {result['papers_per_min']} papers/min, "
+                f"section p50/p95/p99 {result['section_latency']['p50']:.2f}/"
+                f"{result['section_latency']['p95']:.2f}/{result['section_latency']['p99']:.2f}s, "
+                f"wall {result['wall_seconds']}s, peak RSS {result['peak_rss_mb']}MB",
+                file=sys.stderr,
+            )
+    finally:
+        server.terminate()
+        server.wait()
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "mock": {name: getattr(args, name) for name in MOCK_OPTIONS},
+        "scenarios": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    else:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
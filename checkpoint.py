@@ -0,0 +1,144 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+import weakref
+from typing import Any, Dict, List, Optional
+
+from utils import current_dir
+
+
+class CheckpointJournal:
+    """章节级检查点日志
+
+    每个任务一个只追加的JSONL文件：第一行记录任务配置（不含API密钥），
+    之后每完成一个章节追加一行并落盘。章节按大纲哈希标记，大纲变化后旧章节不再复用。
+    任务失败或服务重启后，恢复接口据此只重新生成缺失的章节。
+    """
+
+    def __init__(
+        self,
+        journal_dir: str,
+        max_age: float = 7 * 24 * 3600,
+        prune_interval: float = 3600,
+    ):
+        self.journal_dir = journal_dir
+        self.max_age = max_age
+        # 清理过期日志需要遍历整个目录，两次清理之间至少间隔prune_interval秒
+        self.prune_interval = prune_interval
+        self._last_prune: Optional[float] = None
+        # 写入中的任务持有自己的锁，没有写入时锁随之回收，不会为每个任务永久保留一个
+        self._locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = (
+            weakref.WeakValueDictionary()
+        )
+
+    @staticmethod
+    def outline_hash(topic: str, title: str, outline: List[str]) -> str:
+        payload = json.dumps([topic, title, outline], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+    def _path(self, job_id: str) -> str:
+        return os.path.join(self.journal_dir, f"{job_id}.jsonl")
+
+    def _append(self, job_id: str, records: List[Dict[str, Any]]):
+        os.makedirs(self.journal_dir, exist_ok=True)
+        with open(self._path(job_id), "a", encoding="utf-8") as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _read(self, job_id: str) -> List[Dict[str, Any]]:
+        records = []
+        try:
+            with open(self._path(job_id), "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        # 进程在写入过程中退出时最后一行可能不完整
+                        continue
+        except OSError:
+            pass
+        return records
+
+    def _prune(self):
+        if not os.path.isdir(self.journal_dir):
+            return
+        now = time.time()
+        for name in os.listdir(self.journal_dir):
+            path = os.path.join(self.journal_dir, name)
+            try:
+                if now - os.path.getmtime(path) > self.max_age:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    async def _write(self, job_id: str, records: List[Dict[str, Any]]):
+        lock = self._locks.get(job_id)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._locks[job_id] = lock
+        async with lock:
+            await asyncio.to_thread(self._append, job_id, records)
+
+    async def start(self, job_id: str, outline_hash: str, job_info: Dict[str, Any]):
+        """记录一次运行的任务配置；恢复运行时追加新的头记录"""
+        now = time.monotonic()
+        if self._last_prune is None or now - self._last_prune >= self.prune_interval:
+            self._last_prune = now
+            await asyncio.to_thread(self._prune)
+        await self._write(
+            job_id,
+            [
+                {
+                    "type": "job",
+                    "outline_hash": outline_hash,
+                    "time": time.time(),
+                    **job_info,
+                }
+            ],
+        )
+
+    async def append_section(
+        self, job_id: str, outline_hash: str, index: int, title: str, content: str
+    ):
+        await self._write(
+            job_id,
+            [
+                {
+                    "type": "section",
+                    "outline_hash": outline_hash,
+                    "index": index,
+                    "title": title,
+                    "content": content,
+                }
+            ],
+        )
+
+    async def load_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """返回最近一次运行的任务配置，没有日志时返回None"""
+        records = await asyncio.to_thread(self._read, job_id)
+        headers = [record for record in records if record.get("type") == "job"]
+        return headers[-1] if headers else None
+
+    async def load_sections(
+        self, job_id: str, outline_hash: str
+    ) -> Dict[int, Dict[str, Any]]:
+        """返回与当前大纲匹配的已完成章节，按大纲序号索引"""
+        records = await asyncio.to_thread(self._read, job_id)
+        return {
+            record["index"]: record
+            for record in records
+            if record.get("type") == "section"
+            and record.get("outline_hash") == outline_hash
+        }
+
+
+# 全局检查点日志
+checkpoint_journal = CheckpointJournal(
+    os.getenv("CHECKPOINT_DIR", os.path.join(current_dir, "checkpoints")),
+    max_age=float(os.getenv("CHECKPOINT_MAX_AGE", str(7 * 24 * 3600))),
+    prune_interval=float(os.getenv("CHECKPOINT_PRUNE_INTERVAL", "3600")),
+)
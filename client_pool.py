@@ -0,0 +1,127 @@
+import asyncio
+import hashlib
+import logging
+import os
+import time
+from typing import Dict, List, Tuple
+
+import httpx
+from openai import DEFAULT_TIMEOUT, AsyncOpenAI
+
+from models import APIConfig
+
+logger = logging.getLogger(__name__)
+
+# 长连接空闲多久后关闭（秒）
+KEEPALIVE_EXPIRY = 30.0
+# 客户端多久没有被使用后从注册表中移除（秒），需大于单次请求的最长耗时
+IDLE_TIMEOUT = 900.0
+# 空闲清理的检查间隔（秒）
+EVICTION_INTERVAL = 60.0
+
+
+def _http2_enabled() -> bool:
+    """HTTP/2需要安装h2，且通过OPENAI_HTTP2=1显式开启"""
+    if os.getenv("OPENAI_HTTP2", "0") not in ("1", "true", "True"):
+        return False
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        logger.warning(
+            "OPENAI_HTTP2 is set but h2 is not installed, falling back to HTTP/1.1"
+        )
+        return False
+    return True
+
+
+class _PooledClient:
+    def __init__(self, api_config: APIConfig, max_connections: int, http2: bool):
+        self.max_connections = max_connections
+        self.http_client = httpx.AsyncClient(
+            http2=http2,
+            timeout=DEFAULT_TIMEOUT,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+                keepalive_expiry=KEEPALIVE_EXPIRY,
+            ),
+        )
+        self.client = AsyncOpenAI(
+            api_key=api_config.api_key,
+            base_url=api_config.base_url,
+            http_client=self.http_client,
+        )
+        self.last_used = time.monotonic()
+
+    async def close(self):
+        await self.client.close()
+
+
+class ClientRegistry:
+    """进程级的AsyncOpenAI客户端注册表
+
+    按(base_url, api_key摘要, model_name)复用客户端及其HTTP连接池，避免每个请求
+    都重新建立TCP/TLS连接。连接池大小取所有使用者中最大的concurrent_requests。
+    """
+
+    def __init__(self, idle_timeout: float = IDLE_TIMEOUT):
+        self.idle_timeout = idle_timeout
+        self.http2 = _http2_enabled()
+        self._clients: Dict[Tuple[str, str, str], _PooledClient] = {}
+        # 被更大连接池替换下来的客户端，空闲后再关闭，避免中断在途请求
+        self._retired: List[_PooledClient] = []
+        self._eviction_task = None
+
+    @staticmethod
+    def _key(api_config: APIConfig) -> Tuple[str, str, str]:
+        key_hash = hashlib.sha256(api_config.api_key.encode("utf-8")).hexdigest()
+        return (api_config.base_url.rstrip("/"), key_hash, api_config.model_name)
+
+    def get(self, api_config: APIConfig, max_connections: int) -> AsyncOpenAI:
+        key = self._key(api_config)
+        entry = self._clients.get(key)
+        if entry is None or entry.max_connections < max_connections:
+            if entry is not None:
+                self._retired.append(entry)
+            entry = _PooledClient(api_config, max_connections, self.http2)
+            self._clients[key] = entry
+        entry.last_used = time.monotonic()
+        return entry.client
+
+    async def evict_idle(self):
+        now = time.monotonic()
+        expired = [
+            key
+            for key, entry in self._clients.items()
+            if now - entry.last_used > self.idle_timeout
+        ]
+        closing = [self._clients.pop(key) for key in expired]
+        closing += [e for e in self._retired if now - e.last_used > self.idle_timeout]
+        self._retired = [e for e in self._retired if e not in closing]
+        for entry in closing:
+            await entry.close()
+        if closing:
+            logger.info("Closed %d idle OpenAI clients", len(closing))
+
+    async def _eviction_loop(self):
+        while True:
+            await asyncio.sleep(EVICTION_INTERVAL)
+            await self.evict_idle()
+
+    def start(self):
+        if self._eviction_task is None:
+            self._eviction_task = asyncio.create_task(self._eviction_loop())
+
+    async def close(self):
+        if self._eviction_task is not None:
+            self._eviction_task.cancel()
+            self._eviction_task = None
+        entries = list(self._clients.values()) + self._retired
+        self._clients.clear()
+        self._retired = []
+        for entry in entries:
+            await entry.close()
+
+
+# 全局客户端注册表
+client_registry = ClientRegistry()
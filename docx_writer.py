@@ -0,0 +1,448 @@
+import hashlib
+import re
+import threading
+import zipfile
+from collections import OrderedDict
+from typing import Iterable, List, Optional, Tuple
+from xml.sax.saxutils import escape
+
+# 纯Python的DOCX导出，不依赖pandoc
+#
+# 将Markdown章节逐个转换为WordprocessingML并流式写入zip中的word/document.xml，
+# 整篇文档不会在内存中保存两份。支持标题、段落、有序/无序列表、表格、
+# 代码块、引用以及粗体/斜体/行内代码。
+
+W_NS = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+R_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+
+CONTENT_TYPES_XML = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">
+<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
+<Default Extension="xml" ContentType="application/xml"/>
+<Override PartName="/word/document.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>
+<Override PartName="/word/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.styles+xml"/>
+<Override PartName="/word/numbering.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.numbering+xml"/>
+</Types>"""
+
+ROOT_RELS_XML = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="word/document.xml"/>
+</Relationships>"""
+
+DOCUMENT_RELS_XML = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" Target="styles.xml"/>
+<Relationship Id="rId2" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/numbering" Target="numbering.xml"/>
+</Relationships>"""
+
+_HEADING_SIZES = {1: 32, 2: 28, 3: 26, 4: 24, 5: 22, 6: 22}
+
+
+def _styles_xml() -> str:
+    headings = "".join(
+        f'<w:style w:type="paragraph" w:styleId="Heading{level}">'
+        f'<w:name w:val="heading {level}"/><w:basedOn w:val="Normal"/>'
+        f'<w:next w:val="Normal"/><w:qFormat/>'
+        f'<w:pPr><w:keepNext/><w:spacing w:before="240" w:after="120"/>'
+        f'<w:outlineLvl w:val="{level - 1}"/></w:pPr>'
+        f'<w:rPr><w:b/><w:sz w:val="{size}"/></w:rPr></w:style>'
+        for level, size in _HEADING_SIZES.items()
+    )
+    return (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        f'<w:styles xmlns:w="{W_NS}">'
+        "<w:docDefaults><w:rPrDefault><w:rPr>"
+        '<w:rFonts w:ascii="Times New Roman" w:hAnsi="Times New Roman" w:eastAsia="SimSun"/>'
+        '<w:sz w:val="21"/></w:rPr></w:rPrDefault>'
+        '<w:pPrDefault><w:pPr><w:spacing w:after="120" w:line="360" w:lineRule="auto"/>'
+        "</w:pPr></w:pPrDefault></w:docDefaults>"
+        '<w:style w:type="paragraph" w:default="1" w:styleId="Normal">'
+        '<w:name w:val="Normal"/><w:qFormat/></w:style>'
+        '<w:style w:type="paragraph" w:styleId="Title"><w:name w:val="Title"/>'
+        '<w:basedOn w:val="Normal"/><w:qFormat/><w:pPr><w:jc w:val="center"/>'
+        '<w:spacing w:after="240"/></w:pPr><w:rPr><w:b/><w:sz w:val="36"/></w:rPr></w:style>'
+        f"{headings}"
+        '<w:style w:type="paragraph" w:styleId="ListParagraph"><w:name w:val="List Paragraph"/>'
+        '<w:basedOn w:val="Normal"/><w:pPr><w:ind w:left="720"/></w:pPr></w:style>'
+        '<w:style w:type="paragraph" w:styleId="Quote"><w:name w:val="Quote"/>'
+        '<w:basedOn w:val="Normal"/><w:pPr><w:ind w:left="720"/></w:pPr>'
+        '<w:rPr><w:i/><w:color w:val="595959"/></w:rPr></w:style>'
+        '<w:style w:type="paragraph" w:styleId="SourceCode"><w:name w:val="Source Code"/>'
+        '<w:basedOn w:val="Normal"/><w:pPr><w:spacing w:after="0" w:line="240" w:lineRule="auto"/>'
+        '<w:shd w:val="clear" w:color="auto" w:fill="F6F8FA"/></w:pPr>'
+        '<w:rPr><w:rFonts w:ascii="Consolas" w:hAnsi="Consolas"/><w:sz w:val="18"/></w:rPr></w:style>'
+        '<w:style w:type="character" w:styleId="VerbatimChar"><w:name w:val="Verbatim Char"/>'
+        '<w:rPr><w:rFonts w:ascii="Consolas" w:hAnsi="Consolas"/><w:shd w:val="clear" w:color="auto" w:fill="F6F8FA"/></w:rPr></w:style>'
+        '<w:style w:type="table" w:styleId="TableGrid"><w:name w:val="Table Grid"/>'
+        "<w:tblPr><w:tblBorders>"
+        '<w:top w:val="single" w:sz="4" w:space="0" w:color="auto"/>'
+        '<w:left w:val="single" w:sz="4" w:space="0" w:color="auto"/>'
+        '<w:bottom w:val="single" w:sz="4" w:space="0" w:color="auto"/>'
+        '<w:right w:val="single" w:sz="4" w:space="0" w:color="auto"/>'
+        '<w:insideH w:val="single" w:sz="4" w:space="0" w:color="auto"/>'
+        '<w:insideV w:val="single" w:sz="4" w:space="0" w:color="auto"/>'
+        "</w:tblBorders></w:tblPr></w:style>"
+        "</w:styles>"
+    )
+
+
+def _numbering_xml(ordered_lists: int) -> str:
+    def _levels(ordered: bool) -> str:
+        levels = []
+        for ilvl in range(9):
+            if ordered:
+                fmt, text = "decimal", f"%{ilvl + 1}."
+            else:
+                fmt, text = "bullet", "•" if ilvl % 2 == 0 else "◦"
+            levels.append(
+                f'<w:lvl w:ilvl="{ilvl}"><w:start w:val="1"/>'
+                f'<w:numFmt w:val="{fmt}"/><w:lvlText w:val="{text}"/>'
+                f'<w:lvlJc w:val="left"/><w:pPr><w:ind w:left="{720 * (ilvl + 1)}" '
+                f'w:hanging="360"/></w:pPr></w:lvl>'
+            )
+        return "".join(levels)
+
+    # numId 1 为无序列表；每个有序列表单独分配numId，保证编号从1重新开始
+    nums = ['<w:num w:numId="1"><w:abstractNumId w:val="0"/></w:num>']
+    for i in range(ordered_lists):
+        nums.append(
+            f'<w:num w:numId="{i + 2}"><w:abstractNumId w:val="1"/>'
+            '<w:lvlOverride w:ilvl="0"><w:startOverride w:val="1"/></w:lvlOverride></w:num>'
+        )
+    return (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        f'<w:numbering xmlns:w="{W_NS}">'
+        f'<w:abstractNum w:abstractNumId="0"><w:multiLevelType w:val="hybridMultilevel"/>{_levels(False)}</w:abstractNum>'
+        f'<w:abstractNum w:abstractNumId="1"><w:multiLevelType w:val="hybridMultilevel"/>{_levels(True)}</w:abstractNum>'
+        f"{''.join(nums)}</w:numbering>"
+    )
+
+
+# XML 1.0 不允许的控制字符
+_INVALID_XML_CHARS = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+_INLINE_PATTERN = re.compile(
+    r"(?P<code>`[^`]+`)"
+    r"|(?P<bold_italic>\*\*\*(?=\S)(.+?)(?<=\S)\*\*\*)"
+    r"|(?P<bold>\*\*(?=\S)(.+?)(?<=\S)\*\*|__(?=\S)(.+?)(?<=\S)__)"
+    r"|(?P<italic>\*(?=[^\s*])(.+?)(?<=[^\s*])\*|(?<!\w)_(?=\S)(.+?)(?<=\S)_(?!\w))"
+    r"|(?P<link>\[([^\]]+)\]\([^)]*\))"
+)
+
+_HEADING_PATTERN = re.compile(r"^(#{1,6})\s+(.*?)\s*#*\s*$")
+_BULLET_PATTERN = re.compile(r"^(\s*)[-*+]\s+(.*)$")
+_ORDERED_PATTERN = re.compile(r"^(\s*)\d+[.)]\s+(.*)$")
+_TABLE_SEPARATOR_PATTERN = re.compile(
+    r"^\s*\|?\s*:?-{3,}:?\s*(\|\s*:?-{3,}:?\s*)*\|?\s*$"
+)
+_HR_PATTERN = re.compile(r"^\s*([-*_])(\s*\1){2,}\s*$")
+# 章节片段中有序列表numId的占位符，\x00不会出现在合法的XML文本中
+_NUM_ID_PLACEHOLDER = re.compile("\x00(\\d+)\x00")
+
+
+def _text(text: str) -> str:
+    return escape(_INVALID_XML_CHARS.sub("", text))
+
+
+def _run(text: str, bold=False, italic=False, code=False) -> str:
+    props = ""
+    if code:
+        props += '<w:rStyle w:val="VerbatimChar"/>'
+    if bold:
+        props += "<w:b/>"
+    if italic:
+        props += "<w:i/>"
+    rpr = f"<w:rPr>{props}</w:rPr>" if props else ""
+    return f'<w:r>{rpr}<w:t xml:space="preserve">{_text(text)}</w:t></w:r>'
+
+
+def _inline_runs(text: str, bold=False, italic=False) -> str:
+    """将行内Markdown（粗体、斜体、行内代码、链接）转换为w:r序列"""
+    runs = []
+    pos = 0
+    for match in _INLINE_PATTERN.finditer(text):
+        if match.start() > pos:
+            runs.append(_run(text[pos : match.start()], bold, italic))
+        token = match.group(0)
+        if match.group("code"):
+            runs.append(_run(token[1:-1], bold, italic, code=True))
+        elif match.group("bold_italic"):
+            runs.append(_inline_runs(token[3:-3], True, True))
+        elif match.group("bold"):
+            runs.append(_inline_runs(token[2:-2], True, italic))
+        elif match.group("italic"):
+            runs.append(_inline_runs(token[1:-1], bold, True))
+        else:
+            # 链接只保留文字
+            runs.append(_inline_runs(token[1 : token.index("]")], bold, italic))
+        pos = match.end()
+    if pos < len(text):
+        runs.append(_run(text[pos:], bold, italic))
+    return "".join(runs)
+
+
+def _paragraph(runs: str, style: Optional[str] = None, numbering: str = "") -> str:
+    ppr = ""
+    if style or numbering:
+        style_xml = f'<w:pStyle w:val="{style}"/>' if style else ""
+        ppr = f"<w:pPr>{style_xml}{numbering}</w:pPr>"
+    return f"<w:p>{ppr}{runs}</w:p>"
+
+
+def _split_table_row(line: str) -> List[str]:
+    line = line.strip()
+    if line.startswith("|"):
+        line = line[1:]
+    if line.endswith("|"):
+        line = line[:-1]
+    return [cell.strip() for cell in line.split("|")]
+
+
+def _table(rows: List[List[str]]) -> str:
+    columns = max(len(row) for row in rows)
+    xml = [
+        '<w:tbl><w:tblPr><w:tblStyle w:val="TableGrid"/><w:tblW w:w="5000" w:type="pct"/></w:tblPr>',
+        "<w:tblGrid>" + '<w:gridCol w:w="2000"/>' * columns + "</w:tblGrid>",
+    ]
+    for i, row in enumerate(rows):
+        cells = row + [""] * (columns - len(row))
+        xml.append("<w:tr>")
+        for cell in cells:
+            # 表头行加粗
+            runs = _inline_runs(cell, bold=(i == 0))
+            xml.append(
+                f'<w:tc><w:tcPr><w:tcW w:w="0" w:type="auto"/></w:tcPr>{_paragraph(runs)}</w:tc>'
+            )
+        xml.append("</w:tr>")
+    xml.append("</w:tbl>")
+    return "".join(xml)
+
+
+class FragmentCache:
+    """章节转换结果的LRU缓存，按片段的字节数限制总量
+
+    键为章节Markdown的摘要，不保留Markdown原文。由导出器持有，并发的导出之间复用相同章节的
+    转换结果，没有进行中的导出时清空，不在进程中长期保留文档内容。
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        # 摘要 -> (片段, 有序列表数量, 字节数)
+        self._fragments: "OrderedDict[str, Tuple[str, int, int]]" = OrderedDict()
+        # 导出在线程池中进行
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(markdown: str) -> str:
+        return hashlib.sha256(markdown.encode("utf-8")).hexdigest()
+
+    def get(self, markdown: str) -> Optional[Tuple[str, int]]:
+        key = self._key(markdown)
+        with self._lock:
+            entry = self._fragments.get(key)
+            if entry is None:
+                return None
+            self._fragments.move_to_end(key)
+            return entry[0], entry[1]
+
+    def put(self, markdown: str, fragment: Tuple[str, int]):
+        size = len(fragment[0].encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        key = self._key(markdown)
+        with self._lock:
+            if key in self._fragments:
+                return
+            self._fragments[key] = (*fragment, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (_, _, evicted) = self._fragments.popitem(last=False)
+                self.size -= evicted
+
+    def clear(self):
+        with self._lock:
+            self._fragments.clear()
+            self.size = 0
+
+
+def render_markdown(markdown: str) -> Tuple[str, int]:
+    """把一段Markdown转换为document.xml片段，返回(片段, 有序列表数量)
+
+    有序列表的numId以占位符表示，写入文档时再换算，因此同一章节的转换结果与其在文档中的
+    位置无关，可以放入FragmentCache复用。
+    """
+    xml: List[str] = []
+    ordered_lists = 0
+    lines = markdown.splitlines()
+    paragraph: List[str] = []
+    list_num_id = None
+    i = 0
+
+    def flush_paragraph():
+        if paragraph:
+            xml.append(_paragraph(_inline_runs(" ".join(paragraph))))
+            paragraph.clear()
+
+    while i < len(lines):
+        line = lines[i]
+        stripped = line.strip()
+
+        # 代码块
+        if stripped.startswith("```"):
+            flush_paragraph()
+            list_num_id = None
+            code_lines = []
+            i += 1
+            while i < len(lines) and not lines[i].strip().startswith("```"):
+                code_lines.append(lines[i])
+                i += 1
+            i += 1
+            for code_line in code_lines or [""]:
+                xml.append(_paragraph(_run(code_line), style="SourceCode"))
+            continue
+
+        if not stripped:
+            flush_paragraph()
+            list_num_id = None
+            i += 1
+            continue
+
+        heading = _HEADING_PATTERN.match(stripped)
+        if heading:
+            flush_paragraph()
+            list_num_id = None
+            level = len(heading.group(1))
+            xml.append(
+                _paragraph(_inline_runs(heading.group(2)), style=f"Heading{level}")
+            )
+            i += 1
+            continue
+
+        if _HR_PATTERN.match(stripped):
+            flush_paragraph()
+            list_num_id = None
+            i += 1
+            continue
+
+        # 表格：当前行含|且下一行为分隔行
+        if (
+            "|" in stripped
+            and i + 1 < len(lines)
+            and _TABLE_SEPARATOR_PATTERN.match(lines[i + 1])
+        ):
+            flush_paragraph()
+            list_num_id = None
+            rows = [_split_table_row(stripped)]
+            i += 2
+            while i < len(lines) and "|" in lines[i] and lines[i].strip():
+                rows.append(_split_table_row(lines[i]))
+                i += 1
+            xml.append(_table(rows))
+            continue
+
+        bullet = _BULLET_PATTERN.match(line)
+        ordered = None if bullet else _ORDERED_PATTERN.match(line)
+        if bullet or ordered:
+            flush_paragraph()
+            match = bullet or ordered
+            ilvl = min(len(match.group(1).expandtabs(4)) // 2, 8)
+            if bullet:
+                num_id = 1
+            else:
+                if list_num_id is None:
+                    ordered_lists += 1
+                    list_num_id = f"\x00{ordered_lists}\x00"
+                num_id = list_num_id
+            numbering = f'<w:numPr><w:ilvl w:val="{ilvl}"/><w:numId w:val="{num_id}"/></w:numPr>'
+            xml.append(
+                _paragraph(
+                    _inline_runs(match.group(2)),
+                    style="ListParagraph",
+                    numbering=numbering,
+                )
+            )
+            i += 1
+            continue
+
+        if stripped.startswith(">"):
+            flush_paragraph()
+            list_num_id = None
+            xml.append(
+                _paragraph(_inline_runs(stripped.lstrip("> ").strip()), style="Quote")
+            )
+            i += 1
+            continue
+
+        paragraph.append(stripped)
+        i += 1
+
+    flush_paragraph()
+    return "".join(xml), ordered_lists
+
+
+class DocxWriter:
+    """流式DOCX写入器：逐个章节写入，结束时补全样式和编号部件"""
+
+    def __init__(self, output_file: str, cache: Optional[FragmentCache] = None):
+        self._cache = cache
+        self._zip = zipfile.ZipFile(output_file, "w", zipfile.ZIP_DEFLATED)
+        self._zip.writestr("[Content_Types].xml", CONTENT_TYPES_XML)
+        self._zip.writestr("_rels/.rels", ROOT_RELS_XML)
+        self._zip.writestr("word/_rels/document.xml.rels", DOCUMENT_RELS_XML)
+        self._document = self._zip.open("word/document.xml", "w")
+        self._write(
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            f'<w:document xmlns:w="{W_NS}" xmlns:r="{R_NS}"><w:body>'
+        )
+        self._ordered_lists = 0
+
+    def _write(self, xml: str):
+        self._document.write(xml.encode("utf-8"))
+
+    def add_title(self, title: str):
+        self._write(_paragraph(_inline_runs(title), style="Title"))
+
+    def add_markdown(self, markdown: str):
+        """转换一段Markdown并立即写入文档"""
+        fragment = self._cache.get(markdown) if self._cache is not None else None
+        if fragment is None:
+            fragment = render_markdown(markdown)
+            if self._cache is not None:
+                self._cache.put(markdown, fragment)
+        xml, ordered_lists = fragment
+        if ordered_lists:
+            # 把章节内的有序列表序号换算为文档内的numId，numId 1留给无序列表
+            base = self._ordered_lists + 1
+            xml = _NUM_ID_PLACEHOLDER.sub(lambda m: str(base + int(m.group(1))), xml)
+            self._ordered_lists += ordered_lists
+        self._write(xml)
+
+    def close(self):
+        self._write(
+            '<w:sectPr><w:pgSz w:w="11906" w:h="16838"/>'
+            '<w:pgMar w:top="1440" w:right="1800" w:bottom="1440" w:left="1800" '
+            'w:header="851" w:footer="992" w:gutter="0"/></w:sectPr>'
+            "</w:body></w:document>"
+        )
+        self._document.close()
+        # 编号部件依赖文档中有序列表的数量，因此在正文之后写入
+        self._zip.writestr("word/styles.xml", _styles_xml())
+        self._zip.writestr("word/numbering.xml", _numbering_xml(self._ordered_lists))
+        self._zip.close()
+
+
+def write_docx(
+    output_file: str,
+    title: str,
+    sections: Iterable[str],
+    cache: Optional[FragmentCache] = None,
+):
+    """将标题和Markdown章节列表写为DOCX文件，指定cache时复用其中的章节转换结果"""
+    writer = DocxWriter(output_file, cache)
+    try:
+        writer.add_title(title)
+        for section in sections:
+            writer.add_markdown(section)
+    finally:
+        writer.close()
@@ -0,0 +1,229 @@
+import asyncio
+import hashlib
+import logging
+import os
+import shutil
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from artifact_store import ArtifactStore, artifact_store
+from docx_writer import FragmentCache, write_docx
+from metrics import EXPORT_DURATION, EXPORT_FAILURES
+
+logger = logging.getLogger(__name__)
+
+# 支持的导出格式及对应的文件扩展名
+EXPORT_FORMATS = {
+    "docx": "docx",
+    "html": "html",
+    "pdf": "pdf",
+    "latex": "tex",
+}
+
+# 各格式额外的pandoc参数
+PANDOC_EXTRA_ARGS = {
+    "html": ["--standalone"],
+    "pdf": ["--pdf-engine=xelatex"],
+    "latex": ["--standalone"],
+}
+
+
+# 导出后端：native为内置docx写入器，pandoc为外部进程
+EXPORT_BACKENDS = ("native", "pandoc")
+
+
+class ExportError(Exception):
+    pass
+
+
+class PaperExporter:
+    """异步的论文导出器
+
+    docx默认使用内置的流式写入器（docx_writer），失败时回退到pandoc；
+    其他格式通过异步子进程调用pandoc。多个格式并发渲染，不阻塞事件循环。
+    导出结果直接保存到生成文件存储（ArtifactStore），并按(章节内容, 格式, 后端, 参数)的哈希
+    登记，内容未变化时直接复用；导出文件与其他生成文件一起受存储的容量上限约束。
+    指定output_dir时再复制到该目录。
+    """
+
+    def __init__(
+        self,
+        store: ArtifactStore,
+        max_parallel: int = 4,
+        fragment_cache_bytes: int = 8 * 1024 * 1024,
+    ):
+        self.store = store
+        self._semaphore = asyncio.Semaphore(max_parallel)
+        # 内置docx写入器的章节转换结果，只在有导出进行时保留
+        self._fragments = FragmentCache(fragment_cache_bytes)
+        self._native_exports = 0
+
+    def _render_key(
+        self, title: str, sections: List[str], fmt: str, backend: str
+    ) -> str:
+        # 逐章节计算哈希，无需拼接出完整文档
+        digest = hashlib.sha256()
+        digest.update(f"{fmt}:{backend}".encode("utf-8"))
+        digest.update("\0".join(PANDOC_EXTRA_ARGS.get(fmt, [])).encode("utf-8"))
+        digest.update(title.encode("utf-8"))
+        for section in sections:
+            digest.update(b"\0")
+            digest.update(section.encode("utf-8"))
+        return digest.hexdigest()
+
+    async def _run_pandoc(self, md_file: str, output_file: str, fmt: str):
+        args = ["pandoc", md_file, "-o", output_file] + PANDOC_EXTRA_ARGS.get(fmt, [])
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *args,
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.PIPE,
+            )
+        except FileNotFoundError:
+            raise ExportError("pandoc is not installed")
+        _, stderr = await process.communicate()
+        if process.returncode != 0:
+            raise ExportError(stderr.decode("utf-8", errors="replace").strip())
+
+    async def _render(
+        self,
+        md_file: str,
+        fmt: str,
+        backend: str,
+        title: str,
+        sections: List[str],
+        filename: str,
+    ) -> Tuple[Dict[str, Any], bool]:
+        """渲染并保存到存储，返回文件描述以及是否命中之前的渲染结果"""
+        key = self._render_key(title, sections, fmt, backend)
+        artifact = await asyncio.to_thread(self.store.resolve, key, filename)
+        if artifact is not None:
+            return artifact, True
+
+        tmp_file = self.store.temp_path(f".{EXPORT_FORMATS[fmt]}")
+        try:
+            async with self._semaphore:
+                if backend == "native":
+                    self._native_exports += 1
+                    try:
+                        await asyncio.to_thread(
+                            write_docx, tmp_file, title, sections, self._fragments
+                        )
+                    finally:
+                        self._native_exports -= 1
+                        if not self._native_exports:
+                            self._fragments.clear()
+                else:
+                    await self._run_pandoc(md_file, tmp_file, fmt)
+            artifact = await asyncio.to_thread(
+                self.store.put_file, tmp_file, filename, True
+            )
+        finally:
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+        await asyncio.to_thread(self.store.put_alias, key, artifact["id"])
+        return artifact, False
+
+    async def export_format(
+        self,
+        md_file: str,
+        basename: str,
+        fmt: str,
+        title: str,
+        sections: List[str],
+        backend: str = "native",
+        output_dir: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """导出单个格式，返回导出文件路径、实际使用的后端以及是否命中缓存
+
+        保存到生成文件存储时还返回artifact（id、文件名、大小和下载地址）。
+        """
+        if fmt not in EXPORT_FORMATS:
+            raise ExportError(f"Unsupported export format: {fmt}")
+
+        # 内置后端只支持docx，其他格式总是使用pandoc
+        backend = "native" if fmt == "docx" and backend == "native" else "pandoc"
+        filename = f"{basename}.{EXPORT_FORMATS[fmt]}"
+        try:
+            artifact, cached = await self._render(
+                md_file, fmt, backend, title, sections, filename
+            )
+        except Exception as e:
+            if backend != "native":
+                raise
+            logger.warning("Native docx export failed, falling back to pandoc: %s", e)
+            backend = "pandoc"
+            artifact, cached = await self._render(
+                md_file, fmt, backend, title, sections, filename
+            )
+
+        path = await asyncio.to_thread(self.store.path, artifact["id"])
+        if path is None:
+            # 容量不足时刚保存的文件也可能被淘汰
+            raise ExportError("Export was evicted from the artifact store")
+        if output_dir is None:
+            return {
+                "file": path,
+                "artifact": artifact,
+                "cached": cached,
+                "backend": backend,
+            }
+        output_file = os.path.join(output_dir, filename)
+        await asyncio.to_thread(shutil.copyfile, path, output_file)
+        return {"file": output_file, "cached": cached, "backend": backend}
+
+    async def export(
+        self,
+        md_file: str,
+        basename: str,
+        formats: List[str],
+        title: str,
+        sections: List[str],
+        backend: str = "native",
+        on_progress: Optional[Callable[[str, Dict[str, Any]], None]] = None,
+        output_dir: Optional[str] = None,
+    ) -> Dict[str, Dict[str, Any]]:
+        """并发导出多个格式，单个格式失败不影响其他格式"""
+        results: Dict[str, Dict[str, Any]] = {
+            fmt: {"state": "pending"} for fmt in formats
+        }
+
+        def _report(fmt: str, info: Dict[str, Any]):
+            results[fmt] = info
+            if on_progress:
+                on_progress(fmt, info)
+
+        async def _export_one(fmt: str):
+            _report(fmt, {"state": "running"})
+            started = time.monotonic()
+            try:
+                info = await self.export_format(
+                    md_file, basename, fmt, title, sections, backend, output_dir
+                )
+                EXPORT_DURATION.observe(
+                    time.monotonic() - started,
+                    format=fmt,
+                    backend=info["backend"],
+                    cached=str(info["cached"]).lower(),
+                )
+                _report(fmt, {"state": "done", **info})
+                logger.info(
+                    "Exported %s to %s (cached: %s)", basename, fmt, info["cached"]
+                )
+            except Exception as e:
+                EXPORT_FAILURES.inc(format=fmt)
+                _report(fmt, {"state": "failed", "error": str(e)})
+                logger.warning("Failed to export %s to %s: %s", basename, fmt, e)
+
+        await asyncio.gather(*[_export_one(fmt) for fmt in formats])
+        return results
+
+
+# 全局导出器
+paper_exporter = PaperExporter(
+    artifact_store,
+    max_parallel=int(os.getenv("EXPORT_MAX_PARALLEL", "4")),
+    fragment_cache_bytes=int(
+        os.getenv("EXPORT_FRAGMENT_CACHE_BYTES", str(8 * 1024 * 1024))
+    ),
+)
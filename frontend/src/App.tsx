@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useCallback } from 'react';
 import { Layout, Card, Steps, Button, message, Spin, Typography, theme, App as AntApp, Modal } from 'antd';
 import { FileOutlined, RocketOutlined, SettingOutlined, EditOutlined, CodeOutlined } from '@ant-design/icons';
 import TopicInput from './components/TopicInput';
@@ -7,7 +7,7 @@ import OutlineEditor from './components/OutlineEditor';
 import PaperGenerator from './components/PaperGenerator';
 import ModelConfig from './components/ModelConfig';
 import CustomPromptModal from './components/CustomPromptModal';
-import PaperGenerationProgress from './components/PaperGenerationProgress';
+import PaperGenerationProgress, { PaperGenerationStatus } from './components/PaperGenerationProgress';
 import PromptTemplateEditor from './components/PromptTemplateEditor';
 
 const { Header, Content, Footer } = Layout;
@@ -17,6 +17,8 @@ interface APIConfigType {
   api_key: string;
   base_url: string;
   model_name: string;
+  endpoints?: { api_key: string; base_url: string; model_name?: string; weight?: number }[];
+  routing_strategy?: string;
 }
 
 interface ModelConfigType {
@@ -48,8 +50,10 @@ const App: React.FC = () => {
   const [title, setTitle] = useState('');
   const [outline, setOutline] = useState<string[]>([]);
   const [paper, setPaper] = useState('');
+  const [paperJobId, setPaperJobId] = useState<string | null>(null);
   const [progress, setProgress] = useState(0);
   const [loading, setLoading] = useState(false);
+  const [jobId, setJobId] = useState<string | null>(null);
   const [titleSuggestions, setTitleSuggestions] = useState<string[]>([]);
   const [suggestionsLoading, setSuggestionsLoading] = useState(false);
   
@@ -114,7 +118,9 @@ const App: React.FC = () => {
         setApiConfig({
           api_key: data.api_key || '',
           base_url: data.base_url || 'https://api.openai.com/v1',
-          model_name: data.model_name || 'gpt-4-turbo'
+          model_name: data.model_name || 'gpt-4-turbo',
+          endpoints: data.endpoints || [],
+          routing_strategy: data.routing_strategy || 'least_outstanding'
         });
       } catch (error) {
         console.error('加载配置失败:', error);
@@ -123,6 +129,18 @@ const App: React.FC = () => {
     fetchConfig();
   }, []);
 
+  const handlePaperGenerationFinished = useCallback((status: PaperGenerationStatus) => {
+    if (status.state === 'completed' && status.result) {
+      setPaper(status.result.paper);
+      setPaperJobId(status.job_id || null);
+      message.success('论文生成成功');
+    } else {
+      message.error(`生成论文失败: ${status.error || '请重试'}`);
+    }
+    setJobId(null);
+    setLoading(false);
+  }, []);
+
   const steps = [
     {
       title: '输入主题',
@@ -170,11 +188,16 @@ const App: React.FC = () => {
       icon: <RocketOutlined />,
       content: (
         <>
-          <PaperGenerationProgress isGenerating={loading} />
+          <PaperGenerationProgress
+            isGenerating={loading}
+            jobId={jobId}
+            onFinished={handlePaperGenerationFinished}
+          />
           <PaperGenerator 
             paper={paper} 
             progress={progress}
             title={title}
+            jobId={paperJobId}
           />
         </>
       ),
@@ -345,6 +368,7 @@ const App: React.FC = () => {
     setLoading(true);
     setProgress(0);
     setPaper('');
+    setPaperJobId(null);
     setCurrent(3); // 立即切换到生成论文页面，这样用户可以看到进度
     
     try {
@@ -368,42 +392,22 @@ const App: React.FC = () => {
           title,
           outline,
           api_config: apiConfig,
-          model_config: modelConfig
+          model_config: modelConfig,
+          // 关闭页面后不再继续生成
+          cancel_on_disconnect: true
         }),
       });
       
+      const data = await response.json();
       if (response.ok) {
-        const data = await response.json();
-        setPaper(data.paper);
-        message.success('论文生成成功');
-        
-        // 确保重置后端状态
-        try {
-          await fetch('http://localhost:8000/api/reset-generation-status', {
-            method: 'POST'
-          });
-          console.log('Backend generation status reset successfully after paper generation');
-        } catch (resetError) {
-          console.error('Failed to reset backend generation status:', resetError);
-        }
+        // 后端立即返回任务ID，进度组件负责轮询任务状态
+        setJobId(data.job_id);
       } else {
-        const errorData = await response.json();
-        throw new Error(errorData.detail || errorData.message || JSON.stringify(errorData) || '生成失败');
+        throw new Error(data.detail || data.message || JSON.stringify(data) || '生成失败');
       }
     } catch (error) {
       console.error('生成论文失败:', error);
       message.error(`生成论文失败: ${error instanceof Error ? error.message : '请重试'}`);
-      
-      // 出错时也尝试重置状态
-      try {
-        await fetch('http://localhost:8000/api/reset-generation-status', {
-          method: 'POST'
-        });
-        console.log('Backend generation status reset after error');
-      } catch (resetError) {
-        console.error('Failed to reset backend generation status after error:', resetError);
-      }
-    } finally {
       setLoading(false);
     }
   }
@@ -8,6 +8,8 @@ interface APIConfigType {
   api_key: string;
   base_url: string;
   model_name: string;
+  endpoints?: { api_key: string; base_url: string; model_name?: string; weight?: number }[];
+  routing_strategy?: string;
 }
 
 interface ModelConfigType {
@@ -137,7 +139,7 @@ const ModelConfig: React.FC<ModelConfigProps> = ({ apiConfig, modelConfig, onCha
           </Col>
           <Col span={8}>
             <Form.Item 
-              label="每个块的大小" 
+              label="提示词token上限" 
               name="chunk_size"
             >
               <InputNumber
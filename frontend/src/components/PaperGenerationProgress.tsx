@@ -9,11 +9,14 @@ const { Title, Text, Paragraph } = Typography;
 const { Panel } = Collapse;
 
 interface CompletedSection {
+  index?: number;
   title: string;
   content: string;
 }
 
-interface PaperGenerationStatus {
+export interface PaperGenerationStatus {
+  job_id?: string;
+  state?: string;
   is_generating: boolean;
   progress: number;
   total_sections: number;
@@ -22,13 +25,18 @@ interface PaperGenerationStatus {
   completed_content: CompletedSection[];
   elapsed_time: number;
   estimated_time_remaining: number | null;
+  result?: { paper: string; markdown_file: string; artifact?: { id: string; filename: string; url: string } } | null;
+  export?: Record<string, { state: string; artifact?: { id: string; filename: string; url: string }; error?: string }>;
+  error?: string | null;
 }
 
 interface PaperGenerationProgressProps {
   isGenerating: boolean;
+  jobId: string | null;
+  onFinished: (status: PaperGenerationStatus) => void;
 }
 
-const PaperGenerationProgress: React.FC<PaperGenerationProgressProps> = ({ isGenerating }) => {
+const PaperGenerationProgress: React.FC<PaperGenerationProgressProps> = ({ isGenerating, jobId, onFinished }) => {
   const [status, setStatus] = useState<PaperGenerationStatus>({
     is_generating: false,
     progress: 0,
@@ -40,7 +48,7 @@ const PaperGenerationProgress: React.FC<PaperGenerationProgressProps> = ({ isGen
     estimated_time_remaining: 0
   });
   
-  const [pollingInterval, setPollingInterval] = useState<NodeJS.Timeout | null>(null);
+  const [streamingContent, setStreamingContent] = useState<Record<number, string>>({});
   const [localElapsedTime, setLocalElapsedTime] = useState<number>(0);
   const [lastUpdateTime, setLastUpdateTime] = useState<number>(Date.now());
   
@@ -106,102 +114,110 @@ const PaperGenerationProgress: React.FC<PaperGenerationProgressProps> = ({ isGen
     return formatTime(status.estimated_time_remaining);
   };
   
-  // 轮询获取生成状态
+  // 通过SSE订阅生成事件，按章节序号接收增量文本
   useEffect(() => {
-    const fetchStatus = async () => {
+    if (!isGenerating || !jobId) return;
+    
+    const startTime = Date.now();
+    const source = new EventSource(`http://localhost:8000/api/paper-generation-events/${jobId}`);
+    
+    // 同一章节可能在快照和实时事件中重复出现，按index覆盖即可
+    const upsertSection = (section: CompletedSection) => {
+      setStatus(prev => {
+        const others = prev.completed_content.filter(item => item.index !== section.index);
+        return { ...prev, completed_content: [...others, section] };
+      });
+    };
+    
+    source.addEventListener('snapshot', (e: MessageEvent) => {
+      const data = JSON.parse(e.data);
+      setStatus(prev => ({
+        ...prev,
+        is_generating: !['completed', 'failed', 'cancelled'].includes(data.state),
+        total_sections: data.total_sections,
+        completed_sections: data.completed_sections,
+        progress: data.total_sections > 0 ? (data.completed_sections / data.total_sections) * 100 : 0,
+        completed_content: data.completed_content
+      }));
+    });
+    
+    source.addEventListener('section_start', (e: MessageEvent) => {
+      const data = JSON.parse(e.data);
+      setStatus(prev => ({ ...prev, is_generating: true, current_section: data.title }));
+    });
+    
+    source.addEventListener('delta', (e: MessageEvent) => {
+      const data = JSON.parse(e.data);
+      setStreamingContent(prev => ({ ...prev, [data.index]: (prev[data.index] || '') + data.text }));
+    });
+    
+    source.addEventListener('section_retry', (e: MessageEvent) => {
+      // 章节将被重新生成，丢弃已收到的部分内容
+      const data = JSON.parse(e.data);
+      setStreamingContent(prev => {
+        const next = { ...prev };
+        delete next[data.index];
+        return next;
+      });
+    });
+    
+    source.addEventListener('section_done', (e: MessageEvent) => {
+      const data = JSON.parse(e.data);
+      upsertSection({ index: data.index, title: data.title, content: data.content });
+      setStreamingContent(prev => {
+        const next = { ...prev };
+        delete next[data.index];
+        return next;
+      });
+    });
+    
+    source.addEventListener('progress', (e: MessageEvent) => {
+      const data = JSON.parse(e.data);
+      setStatus(prev => ({
+        ...prev,
+        total_sections: data.total_sections,
+        completed_sections: data.completed_sections,
+        progress: data.total_sections > 0 ? (data.completed_sections / data.total_sections) * 100 : 0,
+        elapsed_time: (Date.now() - startTime) / 1000,
+        estimated_time_remaining: data.estimated_time_remaining
+      }));
+    });
+    
+    source.addEventListener('done', async () => {
+      source.close();
       try {
-        console.log('Fetching paper generation status...');
-        const response = await fetch('http://localhost:8000/api/paper-generation-status');
+        // 任务结束后获取一次完整状态（包含最终结果）
+        const response = await fetch(`http://localhost:8000/api/paper-generation-status/${jobId}`);
         const data = await response.json();
-        console.log('Received status:', data);
         setStatus(data);
-        
-        // 如果生成完成，停止轮询
-        if (!data.is_generating && pollingInterval) {
-          console.log('Generation completed, stopping polling');
-          clearInterval(pollingInterval);
-          setPollingInterval(null);
-          
-          // 尝试重置后端状态
-          try {
-            await fetch('http://localhost:8000/api/reset-generation-status', {
-              method: 'POST'
-            });
-            console.log('Backend generation status reset successfully');
-          } catch (resetError) {
-            console.error('Failed to reset backend generation status:', resetError);
-          }
-        }
+        setStreamingContent({});
+        // 任务记录保留到过期，以便随后下载导出的文件
+        onFinished(data);
       } catch (error) {
-        console.error('获取生成状态失败:', error);
+        console.error('获取生成结果失败:', error);
       }
-    };
+    });
     
-    // 如果正在生成，开始轮询
-    if (isGenerating && !pollingInterval) {
-      console.log('Starting polling for paper generation status');
-      fetchStatus(); // 立即获取一次
-      const interval = setInterval(fetchStatus, 2000); // 每2秒获取一次
-      setPollingInterval(interval);
-    } else if (!isGenerating && pollingInterval) {
-      console.log('Not generating anymore, clearing interval');
-      clearInterval(pollingInterval);
-      setPollingInterval(null);
-      
-      // 当组件检测到不再生成时，也尝试重置后端状态
-      fetch('http://localhost:8000/api/reset-generation-status', {
-        method: 'POST'
-      }).then(() => {
-        console.log('Backend generation status reset successfully');
-      }).catch(error => {
-        console.error('Failed to reset backend generation status:', error);
-      });
-    }
+    source.onerror = (error) => {
+      // EventSource会自动重连，重连后服务端会重新发送快照
+      console.error('生成事件连接中断:', error);
+    };
     
-    // 清理函数
     return () => {
-      if (pollingInterval) {
-        console.log('Cleaning up interval');
-        clearInterval(pollingInterval);
-      }
+      source.close();
     };
-  }, [isGenerating, pollingInterval]);
+  }, [isGenerating, jobId, onFinished]);
   
   // 监听isGenerating属性变化
   useEffect(() => {
-    // 当isGenerating从true变为false时，立即重置状态
     if (!isGenerating) {
-      console.log('isGenerating changed to false, updating status');
       setStatus(prevStatus => ({
         ...prevStatus,
         is_generating: false
       }));
-      
-      // 尝试重置后端状态
-      fetch('http://localhost:8000/api/reset-generation-status', {
-        method: 'POST'
-      }).then(() => {
-        console.log('Backend generation status reset due to isGenerating change');
-      }).catch(error => {
-        console.error('Failed to reset backend generation status:', error);
-      });
     }
   }, [isGenerating]);
   
-  // 组件卸载时重置后端状态
-  useEffect(() => {
-    return () => {
-      // 组件卸载时，尝试重置后端状态
-      fetch('http://localhost:8000/api/reset-generation-status', {
-        method: 'POST'
-      }).then(() => {
-        console.log('Backend generation status reset on component unmount');
-      }).catch(error => {
-        console.error('Failed to reset backend generation status on unmount:', error);
-      });
-    };
-  }, []);
-  
   // 即使没有生成过程，也显示组件（用于调试）
   console.log('Rendering PaperGenerationProgress', { isGenerating, progress: status.progress });
   
@@ -266,13 +282,31 @@ const PaperGenerationProgress: React.FC<PaperGenerationProgressProps> = ({ isGen
         )}
       </Card>
       
+      {Object.keys(streamingContent).length > 0 && (
+        <Card 
+          title={<span><LoadingOutlined spin /> 正在生成的章节</span>}
+          bordered={false}
+          style={{ marginBottom: 16 }}
+        >
+          <div style={{ maxHeight: '300px', overflow: 'auto' }}>
+            {Object.entries(streamingContent).map(([index, content]) => (
+              <Paragraph key={index} style={{ whiteSpace: 'pre-wrap' }}>
+                {content}
+              </Paragraph>
+            ))}
+          </div>
+        </Card>
+      )}
+      
       {status.completed_content.length > 0 && (
         <Card 
           title={<span><FileTextOutlined /> 已生成内容预览</span>}
           bordered={false}
         >
           <Collapse defaultActiveKey={[]} style={{ maxHeight: '400px', overflow: 'auto' }}>
-            {status.completed_content.map((section, index) => (
+            {[...status.completed_content]
+              .sort((a, b) => (a.index ?? 0) - (b.index ?? 0))
+              .map((section, index) => (
               <Panel 
                 header={
                   <span>
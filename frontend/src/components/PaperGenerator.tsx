@@ -12,9 +12,10 @@ interface PaperGeneratorProps {
   paper: string;
   progress: number;
   title: string;
+  jobId?: string | null;
 }
 
-const PaperGenerator: React.FC<PaperGeneratorProps> = ({ paper, progress, title }) => {
+const PaperGenerator: React.FC<PaperGeneratorProps> = ({ paper, progress, title, jobId }) => {
   const [activeTab, setActiveTab] = useState('preview');
   
   const getSafeFileName = (fileName: string): string => {
@@ -45,9 +46,21 @@ const PaperGenerator: React.FC<PaperGeneratorProps> = ({ paper, progress, title
   
   const handleDownloadWord = () => {
     const safeTitle = getSafeFileName(title || '论文');
-    const docxUrl = `http://localhost:8000/static/${safeTitle}.docx`;
-    
-    fetch(docxUrl)
+    if (!jobId) {
+      message.error('Word文档下载失败，请稍后重试');
+      return;
+    }
+
+    // 导出在后台进行，下载地址见状态接口中的export.docx
+    fetch(`http://localhost:8000/api/paper-generation-status/${jobId}?fields=progress`)
+      .then(response => response.json())
+      .then(status => {
+        const docx = status.export && status.export.docx;
+        if (!docx || docx.state !== 'done' || !docx.artifact) {
+          throw new Error(docx && docx.state === 'failed' ? docx.error : 'Word文档仍在导出');
+        }
+        return fetch(`http://localhost:8000${docx.artifact.url}`);
+      })
       .then(response => {
         if (!response.ok) {
           throw new Error('文件下载失败');
@@ -0,0 +1,747 @@
+import asyncio
+import base64
+import hashlib
+import logging
+import os
+import time
+import uuid
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Set,
+    Tuple,
+)
+
+from metrics import JOBS_FINISHED
+from models import APIConfig, ModelConfig, PaperConfig
+from state_store import (
+    DEFAULT_LEASE_SECONDS,
+    FINISHED_STATES,
+    JOB_CANCELLED,
+    JOB_COMPLETED,
+    JOB_FAILED,
+    JOB_QUEUED,
+    JOB_RUNNING,
+    WORKER_ID,
+    Event,
+    JobConflictError,
+    JobQueueFullError,
+    StateStore,
+    get_state_store,
+)
+from utils import new_generation_status
+
+try:
+    from cryptography.fernet import Fernet, InvalidToken
+except ImportError:
+    Fernet = None
+
+logger = logging.getLogger(__name__)
+
+# 每个订阅者最多缓存的事件数，慢速客户端超出后丢弃增量文本事件
+SUBSCRIBER_QUEUE_SIZE = 1024
+
+# 取消任务时等待在途请求中止的最长时间（秒）
+CANCEL_WAIT_SECONDS = 5
+
+
+def _create_sealer() -> Optional["Fernet"]:
+    """按STATE_SECRET创建加密API配置的密钥；未配置或未安装cryptography时返回None"""
+    secret = os.getenv("STATE_SECRET")
+    if not secret:
+        return None
+    if Fernet is None:
+        logger.warning(
+            "STATE_SECRET is set but cryptography is not installed, "
+            "API keys stay in the memory of the submitting worker"
+        )
+        return None
+    key = hashlib.sha256(secret.encode("utf-8")).digest()
+    return Fernet(base64.urlsafe_b64encode(key))
+
+
+# API密钥不以明文写入状态存储：配置了STATE_SECRET（各工作进程相同）时，API配置加密后
+# 写入存储，任何工作进程都能运行任务或协助生成章节；否则只保存在提交任务的进程内存中，
+# 任务只由该进程运行
+api_config_sealer = _create_sealer()
+
+
+def seal_api_config(api_config: APIConfig) -> str:
+    return api_config_sealer.encrypt(api_config.model_dump_json().encode()).decode()
+
+
+def open_api_config(token: str) -> Optional[APIConfig]:
+    """解密存储中的API配置，密钥不一致（或未配置）时返回None"""
+    if api_config_sealer is None:
+        return None
+    try:
+        return APIConfig.model_validate_json(api_config_sealer.decrypt(token.encode()))
+    except InvalidToken:
+        logger.warning("Failed to decrypt the API config of a job, check STATE_SECRET")
+        return None
+
+
+class Job:
+    def __init__(
+        self,
+        tenant: str,
+        config: PaperConfig,
+        api_config: Optional[APIConfig],
+        model_config: ModelConfig,
+        job_id: Optional[str] = None,
+    ):
+        # 恢复运行的任务沿用原来的job_id，以便找到检查点
+        self.job_id = job_id or uuid.uuid4().hex
+        self.tenant = tenant
+        self.config = config
+        # 从存储读取的任务在API配置无法解密（只保存在提交任务的进程中，或任务已结束）时为None
+        self.api_config = api_config
+        self.model_config = model_config
+        self.state = JOB_QUEUED
+        self.status = new_generation_status()
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        # 按大纲顺序排列的章节内容，生成完成后用于导出
+        self.sections: List[str] = []
+        # 后台导出任务，生成完成后启动
+        self.export_task: Optional[asyncio.Task] = None
+        # 本进程中运行生成的协程，取消任务时取消它
+        self.task: Optional[asyncio.Task] = None
+        # 被取消时的原因，为None表示没有被取消（进程退出时协程也会被取消）
+        self.cancel_reason: Optional[str] = None
+        self._subscribers: List[asyncio.Queue] = []
+        # 共享存储：由JobManager设置，状态和事件据此写入，章节可由其他进程协助生成；
+        # 批量任务等独立运行的任务为None
+        self.store: Optional[StateStore] = None
+        # 是否由本进程运行，本进程运行的任务以内存中的状态为准
+        self.owned = False
+        self.event_seq = 0
+        self._pending_events: List[Event] = []
+        self.dirty = False
+
+    @property
+    def is_finished(self) -> bool:
+        return self.state in FINISHED_STATES
+
+    def spec(self, include_api_config: bool = True) -> Dict[str, Any]:
+        return {
+            "config": self.config.model_dump(exclude={"api_config", "model_params"}),
+            "model_config": self.model_config.model_dump(),
+            "sealed_api_config": (
+                seal_api_config(self.api_config)
+                if include_api_config
+                and self.api_config is not None
+                and api_config_sealer is not None
+                else None
+            ),
+        }
+
+    def to_record(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.job_id,
+            "tenant": self.tenant,
+            "state": self.state,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "owner": None,
+            "lease_until": None,
+            # API配置无法加密时只有提交任务的进程能运行它
+            "key_holder": (
+                WORKER_ID
+                if self.api_config is not None and api_config_sealer is None
+                else None
+            ),
+            "spec": self.spec(),
+            "status": self.status,
+            "result": self.result,
+            "error": self.error,
+            "event_seq": self.event_seq,
+        }
+
+    @classmethod
+    def from_record(cls, record: Dict[str, Any]) -> "Job":
+        spec = record["spec"]
+        sealed = spec.get("sealed_api_config")
+        job = cls(
+            record["tenant"],
+            PaperConfig(**spec["config"]),
+            open_api_config(sealed) if sealed else None,
+            ModelConfig(**spec["model_config"]),
+            job_id=record["job_id"],
+        )
+        job.state = record["state"]
+        job.status = record["status"]
+        job.result = record.get("result")
+        job.error = record.get("error")
+        job.created_at = record["created_at"]
+        job.finished_at = record.get("finished_at")
+        job.event_seq = record.get("event_seq") or 0
+        if job.is_finished:
+            # 已完成的章节按大纲顺序还原，用于在其他进程中重新导出
+            completed = sorted(
+                job.status.get("completed_content", []), key=lambda c: c["index"]
+            )
+            job.sections = [c["content"] for c in completed]
+        return job
+
+    def subscribe(self) -> asyncio.Queue:
+        """订阅任务事件，返回的队列中元素为(事件名, 数据)"""
+        queue: asyncio.Queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self._subscribers.append(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        if queue in self._subscribers:
+            self._subscribers.remove(queue)
+
+    def publish(self, event: str, data: Dict[str, Any]):
+        if self.store is not None and event != "delta":
+            # 除增量文本外的事件写入共享存储的事件日志，其他进程的订阅者从中读取
+            self.event_seq += 1
+            self._pending_events.append((self.event_seq, event, data))
+            self.dirty = True
+        for queue in self._subscribers:
+            try:
+                queue.put_nowait((event, data))
+            except asyncio.QueueFull:
+                if event == "delta":
+                    # 增量文本可以丢弃，section_done事件会带上完整内容
+                    continue
+                # 关键事件必须送达：丢弃最早的一个事件腾出空间
+                queue.get_nowait()
+                queue.put_nowait((event, data))
+
+    def take_pending_events(self) -> List[Event]:
+        events, self._pending_events = self._pending_events, []
+        self.dirty = False
+        return events
+
+
+class JobManager:
+    """论文生成任务管理器
+
+    任务保存在共享的状态存储中，使用同一存储的多个进程（多个uvicorn worker或多台机器）
+    共同消费：每个进程的工作协程从存储中认领任务，按租户公平调度——优先选择当前运行任务
+    最少的租户，相同时选择排队最久的任务。运行中的任务靠租约心跳保持归属，进程退出后
+    由其他进程接手，已完成的章节不会重新生成。没有任务可运行的工作协程会认领其他进程
+    任务中尚未开始的章节，协助生成。
+    """
+
+    def __init__(
+        self,
+        runner: Callable[[Job], Awaitable[Dict[str, Any]]],
+        max_running_jobs: int = 4,
+        max_queued_jobs: int = 64,
+        max_jobs_per_tenant: int = 8,
+        finished_job_ttl: float = 3600,
+        store: Optional[StateStore] = None,
+        section_runner: Optional[Callable[[Job, int, str], Awaitable[str]]] = None,
+        poll_interval: float = 0.5,
+        flush_interval: float = 0.25,
+        lease_seconds: float = DEFAULT_LEASE_SECONDS,
+    ):
+        self.runner = runner
+        self.max_running_jobs = max_running_jobs
+        self.max_queued_jobs = max_queued_jobs
+        self.max_jobs_per_tenant = max_jobs_per_tenant
+        self.finished_job_ttl = finished_job_ttl
+        # 未指定时在首次使用（启动或提交任务）时创建全局状态存储
+        self._store = store
+        # 生成其他进程任务中的单个章节，为None时不协助
+        self.section_runner = section_runner
+        self.poll_interval = poll_interval
+        self.flush_interval = flush_interval
+        self.lease_seconds = lease_seconds
+
+        # 本进程提交或运行的任务
+        self.jobs: Dict[str, Job] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._workers: list = []
+        # 本进程中各任务的事件流连接数，用于断开连接后取消任务；有连接的任务在续约时
+        # 向存储写入心跳，其他进程据此判断客户端是否重新连接到了别处
+        self._watchers: Dict[str, int] = {}
+        # 等待宽限期结束的断开检查，保留引用避免任务在运行前被回收
+        self._abandon_checks: Set[asyncio.Task] = set()
+
+    @property
+    def store(self) -> StateStore:
+        if self._store is None:
+            self._store = get_state_store()
+        return self._store
+
+    def start(self):
+        """启动工作协程；服务启动时调用，也会在首次提交时自动调用"""
+        # 工作协程需运行在服务的事件循环中
+        if self._workers:
+            return
+        self._wakeup = asyncio.Event()
+        for _ in range(self.max_running_jobs):
+            self._workers.append(asyncio.create_task(self._worker()))
+        self._workers.append(asyncio.create_task(self._sync_loop()))
+
+    async def close(self):
+        """停止工作协程，并把本进程运行中的任务交还存储，由其他进程立即接手"""
+        workers, self._workers = self._workers, []
+        workers += self._abandon_checks
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        await self._flush_all()
+        await self.store.release_owner(WORKER_ID)
+
+    def _evict_local_jobs(self):
+        now = time.time()
+        expired = [
+            job_id
+            for job_id, job in self.jobs.items()
+            if (job.is_finished and now - job.finished_at > self.finished_job_ttl)
+            # 由其他进程运行的任务只在本进程保留到TTL；API配置只保存在本进程中的任务
+            # 由本进程运行，排队期间一直保留
+            or (
+                not job.owned
+                and now - job.created_at > self.finished_job_ttl
+                and api_config_sealer is not None
+            )
+        ]
+        for job_id in expired:
+            del self.jobs[job_id]
+
+    async def submit(
+        self,
+        tenant: str,
+        config: PaperConfig,
+        api_config: APIConfig,
+        model_config: ModelConfig,
+        job_id: Optional[str] = None,
+    ) -> Job:
+        self.start()
+        self._evict_local_jobs()
+
+        job = Job(tenant, config, api_config, model_config, job_id=job_id)
+        record = job.to_record()
+        if record["key_holder"] is not None:
+            # 排队期间也续约，本进程退出后其他进程据此判断任务已无法运行
+            record["lease_until"] = time.time() + self.lease_seconds
+        # 准入控制（全局队列长度、单租户任务数、同一任务是否仍在运行）在存储的事务中完成
+        await self.store.create_job(
+            record, self.max_queued_jobs, self.max_jobs_per_tenant
+        )
+        self.jobs[job.job_id] = job
+        self._wakeup.set()
+
+        logger.info("Submitted job for tenant %s", tenant, extra={"job_id": job.job_id})
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        """返回本进程中运行的任务"""
+        job = self.jobs.get(job_id)
+        return job if job is not None and job.owned else None
+
+    async def load(self, job_id: str) -> Optional[Job]:
+        """读取任务：由本进程运行且仍是存储中的当前运行时返回内存中的任务，否则返回存储中的快照"""
+        record = await self.store.get_job(job_id)
+        if record is None:
+            return None
+        job = self.get(job_id)
+        if (
+            job is not None
+            and record["owner"] == WORKER_ID
+            and record["created_at"] == job.created_at
+        ):
+            return job
+        return Job.from_record(record)
+
+    def is_local(self, job: Job) -> bool:
+        return job.owned and self.jobs.get(job.job_id) is job
+
+    def track(self, job: Job):
+        """由本进程继续更新的快照任务（如重新导出），状态变化时写回存储"""
+        job.store = self.store
+        self.jobs[job.job_id] = job
+
+    async def queue_position(self, job: Job) -> int:
+        """返回任务在所属租户队列中的位置（从0开始），不在队列中返回-1"""
+        if job.state != JOB_QUEUED:
+            return -1
+        return await self.store.queue_position(job.job_id)
+
+    def _local_job(self, job: Job) -> Optional[Job]:
+        """本进程提交或运行的同一任务（内存中的对象），没有时返回None"""
+        local = self.jobs.get(job.job_id)
+        if local is None or local.created_at != job.created_at:
+            return None
+        return local
+
+    async def _missed_events(
+        self, job_id: str, local: Job, seq: int
+    ) -> List[Tuple[str, Dict[str, Any]]]:
+        """刚订阅本进程的任务时，补齐序号seq之后已经产生的事件：可能已写入存储，也可能仍在等待写入"""
+        pending = list(local._pending_events)
+        missed = {
+            s: (event, data)
+            for s, event, data in await self.store.events_since(job_id, seq)
+        }
+        missed.update((s, (event, data)) for s, event, data in pending if s > seq)
+        return [missed[s] for s in sorted(missed)]
+
+    async def follow(
+        self, job: Job, keepalive: float = 15
+    ) -> AsyncIterator[Optional[Tuple[str, Dict[str, Any]]]]:
+        """依次产生job（快照）之后的事件(事件名, 数据)，keepalive秒内没有新事件时产生None；
+        以done事件结束，任务被删除或过期时也产生done事件
+
+        本进程提交或运行的任务订阅内存中的任务，可以收到增量文本；由其他进程运行的任务轮询
+        存储中的事件日志，没有增量文本。本进程提交的任务被其他进程认领，或由本进程接手时
+        随之切换。切换时补发的事件可能与之后收到的重复，由前端按index去重。
+        """
+        seq = job.event_seq
+        local = self._local_job(job)
+        queue: Optional[asyncio.Queue] = None
+        idle = 0.0
+        try:
+            if local is not None:
+                queue = local.subscribe()
+                for event, data in await self._missed_events(job.job_id, local, seq):
+                    yield event, data
+                    if event == "done":
+                        return
+            while True:
+                if queue is not None:
+                    try:
+                        item = await asyncio.wait_for(queue.get(), self.poll_interval)
+                    except asyncio.TimeoutError:
+                        item = None
+                    if item is not None:
+                        idle = 0.0
+                        yield item
+                        if item[0] == "done":
+                            return
+                        continue
+                else:
+                    events = await self.store.events_since(job.job_id, seq)
+                    for seq, event, data in events:
+                        yield event, data
+                        if event == "done":
+                            return
+                    if events:
+                        idle = 0.0
+                        continue
+                    await asyncio.sleep(self.poll_interval)
+
+                idle += self.poll_interval
+                if idle >= keepalive:
+                    idle = 0.0
+                    yield None
+                if local is not None and local.owned:
+                    # 本进程运行中，事件（包括done）都经由订阅队列送达
+                    continue
+
+                # 空闲时检查任务是否仍然存在、是否已结束，以及由哪个进程运行
+                record = await self.store.get_job(job.job_id)
+                if record is None or record["created_at"] != job.created_at:
+                    yield "done", {"state": "deleted", "error": "Job not found"}
+                    return
+                if queue is not None:
+                    if record["owner"] is None or record["owner"] == WORKER_ID:
+                        # 仍在排队，或本进程刚刚认领
+                        continue
+                    # 由其他进程认领：改为读取事件日志
+                    local.unsubscribe(queue)
+                    local, queue = None, None
+                    continue
+                if record["state"] in FINISHED_STATES:
+                    # done事件与最终状态一起写入，先补发检查之前刚写入的事件
+                    for seq, event, data in await self.store.events_since(
+                        job.job_id, seq
+                    ):
+                        yield event, data
+                        if event == "done":
+                            return
+                    yield "done", {"state": record["state"], "error": record["error"]}
+                    return
+                if record["owner"] == WORKER_ID:
+                    local = self._local_job(job)
+                    if local is None or not local.owned:
+                        local = None
+                        continue
+                    # 由本进程接手：改为订阅
+                    queue = local.subscribe()
+                    for event, data in await self._missed_events(
+                        job.job_id, local, seq
+                    ):
+                        yield event, data
+                        if event == "done":
+                            return
+        finally:
+            if queue is not None:
+                local.unsubscribe(queue)
+
+    async def reset(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """删除尚未开始或已结束的任务，取消运行中的任务；任务不存在时返回None"""
+        if await self.store.delete_job(job_id, (JOB_QUEUED, *FINISHED_STATES)):
+            self.jobs.pop(job_id, None)
+            return {"state": "deleted", "aborted_calls": 0}
+        return await self.cancel(job_id, "reset")
+
+    async def cancel(self, job_id: str, reason: str) -> Optional[Dict[str, Any]]:
+        """取消任务，返回任务状态和中止的模型请求数；任务不存在时返回None
+
+        排队中的任务直接删除。本进程运行的任务立即取消：在途的章节请求被中止、流式连接关闭，
+        并发槽位随即释放给其他任务，已完成的章节保留在检查点中，可通过恢复接口继续。
+        其他进程运行的任务登记取消请求，由其在下次同步时取消，此时中止数未知（None）。
+        """
+        if await self.store.delete_job(job_id, (JOB_QUEUED,)):
+            self.jobs.pop(job_id, None)
+            return {"state": "deleted", "aborted_calls": 0}
+        record = await self.store.get_job(job_id)
+        if record is None:
+            return None
+        if record["state"] in FINISHED_STATES:
+            return {"state": record["state"], "aborted_calls": 0}
+
+        job = self.get(job_id)
+        if job is not None and job.task is not None and record["owner"] == WORKER_ID:
+            self._cancel_local(job, reason)
+            await asyncio.wait({job.task}, timeout=CANCEL_WAIT_SECONDS)
+            return {
+                "state": JOB_CANCELLED,
+                "aborted_calls": job.status.get("aborted_calls", 0),
+            }
+        await self.store.request_cancel(job_id, reason)
+        return {"state": "cancelling", "aborted_calls": None}
+
+    def _cancel_local(self, job: Job, reason: str):
+        if job.task is None or job.task.done() or job.cancel_reason is not None:
+            return
+        job.cancel_reason = reason
+        job.task.cancel()
+        logger.info("Cancelling job: %s", reason, extra={"job_id": job.job_id})
+
+    async def watch(self, job_id: str):
+        """客户端开始接收任务的事件流"""
+        self._watchers[job_id] = self._watchers.get(job_id, 0) + 1
+        try:
+            await self.store.touch_watchers([job_id], time.time())
+        except Exception as e:
+            logger.warning(
+                "Failed to record job watcher: %s", e, extra={"job_id": job_id}
+            )
+
+    def unwatch(self, job_id: str, cancel_after: Optional[float] = None):
+        """客户端断开事件流；给出cancel_after时，若此后cancel_after秒内没有客户端重新连接
+        （连接到本进程，或连接到其他进程并写入了心跳）则取消任务
+        """
+        count = self._watchers.get(job_id, 0) - 1
+        if count > 0:
+            self._watchers[job_id] = count
+            return
+        self._watchers.pop(job_id, None)
+        if cancel_after is not None:
+            check = asyncio.create_task(
+                self._cancel_if_abandoned(job_id, cancel_after, time.time())
+            )
+            self._abandon_checks.add(check)
+            check.add_done_callback(self._abandon_checks.discard)
+
+    async def _cancel_if_abandoned(
+        self, job_id: str, delay: float, disconnected_at: float
+    ):
+        # 留出时间给浏览器自动重连或刷新页面；其他进程上的连接每隔三分之一租约写一次心跳，
+        # 宽限期应大于这个间隔
+        await asyncio.sleep(delay)
+        if self._watchers.get(job_id, 0) > 0:
+            return
+        try:
+            record = await self.store.get_job(job_id)
+            if record is None or (record.get("watched_at") or 0) > disconnected_at:
+                return
+            await self.cancel(job_id, "client disconnected")
+        except Exception as e:
+            logger.warning(
+                "Failed to cancel abandoned job: %s", e, extra={"job_id": job_id}
+            )
+
+    async def flush(self, job: Job, **fields: Any) -> bool:
+        """把任务的状态和待写事件写入存储"""
+        events = job.take_pending_events()
+        fields.setdefault("status", job.status)
+        saved = await self.store.save_job(
+            job.job_id, fields, events, owner=WORKER_ID if job.owned else None
+        )
+        if not saved and job.owned:
+            logger.warning(
+                "Job is no longer owned by this worker", extra={"job_id": job.job_id}
+            )
+        return saved
+
+    async def _flush_all(self):
+        for job in list(self.jobs.values()):
+            if job.dirty:
+                await self.flush(job)
+
+    async def _apply_cancel_requests(self):
+        # 其他进程登记的取消请求
+        running = {
+            job_id: job
+            for job_id, job in self.jobs.items()
+            if job.owned and job.task is not None and not job.task.done()
+        }
+        if not running:
+            return
+        requests = await self.store.cancel_requests(list(running))
+        for job_id, reason in requests.items():
+            self._cancel_local(running[job_id], reason)
+
+    async def _sync_loop(self):
+        # 定期批量写入状态和事件（而不是每个事件写一次），续约本进程持有的任务和章节，
+        # 并检查其他进程登记的取消请求
+        last_renewal = time.monotonic()
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self._apply_cancel_requests()
+                await self._flush_all()
+                if time.monotonic() - last_renewal >= self.lease_seconds / 3:
+                    last_renewal = time.monotonic()
+                    await self.store.renew_leases(WORKER_ID, self.lease_seconds)
+                    await self.store.touch_watchers(list(self._watchers), time.time())
+                    await self.store.prune(self.finished_job_ttl)
+                    self._evict_local_jobs()
+            except Exception as e:
+                logger.warning("Failed to sync job state: %s", e)
+
+    async def _worker(self):
+        while True:
+            try:
+                record = await self.store.claim_job(WORKER_ID, self.lease_seconds)
+                if record is not None:
+                    await self._run_job(record)
+                    continue
+                if self.section_runner is not None:
+                    task = await self.store.claim_any_section(
+                        WORKER_ID, self.lease_seconds
+                    )
+                    if task is not None:
+                        await self._run_section(task)
+                        continue
+            except Exception as e:
+                logger.warning("Job worker error: %s", e)
+            # 本进程提交任务时立即唤醒，其他进程提交的任务靠轮询发现
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def _run_job(self, record: Dict[str, Any]):
+        job = local = self.jobs.get(record["job_id"])
+        if job is None or job.created_at != record["created_at"] or job.owned:
+            # 其他进程提交的任务，或从租约过期的进程接手的任务
+            job = Job.from_record(record)
+            if (
+                job.api_config is None
+                and local is not None
+                and local.created_at == job.created_at
+            ):
+                # API配置只保存在本进程内存中
+                job.api_config = local.api_config
+            if job.api_config is None:
+                # 存储中没有可用的API配置，无法运行
+                job.error = "API configuration is missing"
+                job.state = JOB_FAILED
+        job.store = self.store
+        job.owned = True
+        self.jobs[job.job_id] = job
+
+        if job.state != JOB_FAILED:
+            job.state = JOB_RUNNING
+            job.task = asyncio.create_task(self.runner(job))
+            try:
+                job.result = await job.task
+                job.state = JOB_COMPLETED
+            except asyncio.CancelledError:
+                if job.cancel_reason is None:
+                    raise
+                job.error = f"Cancelled: {job.cancel_reason}"
+                job.state = JOB_CANCELLED
+                logger.info(
+                    "Job cancelled, aborted %d model requests",
+                    job.status.get("aborted_calls", 0),
+                    extra={"job_id": job.job_id},
+                )
+            except Exception as e:
+                # HTTPException的str()为空，优先使用detail
+                job.error = str(getattr(e, "detail", None) or e)
+                job.state = JOB_FAILED
+                logger.warning(
+                    "Job failed: %s", job.error, extra={"job_id": job.job_id}
+                )
+        # 被取消（进程退出）时不会执行到这里，任务留在存储中由其他进程接手
+
+        job.finished_at = time.time()
+        JOBS_FINISHED.inc(state=job.state)
+        job.publish("done", {"state": job.state, "error": job.error})
+        # 结束的任务不再需要API配置，从存储中清除加密的配置
+        await self.flush(
+            job,
+            state=job.state,
+            result=job.result,
+            error=job.error,
+            finished_at=job.finished_at,
+            spec=job.spec(include_api_config=False),
+            key_holder=None,
+        )
+
+    async def _run_section(self, task: Dict[str, Any]):
+        job_id, index = task["job_id"], task["index"]
+        record = await self.store.get_job(job_id)
+        job = Job.from_record(record) if record is not None else None
+        if job is None or job.api_config is None:
+            await self.store.release_section(job_id, index, WORKER_ID)
+            return
+        runner = asyncio.create_task(self.section_runner(job, index, task["title"]))
+        aborted = False
+        try:
+            # 任务被取消（或已结束）时中止协助生成的请求
+            while not runner.done():
+                await asyncio.wait({runner}, timeout=self.poll_interval)
+                if runner.done():
+                    break
+                record = await self.store.get_job(job_id)
+                if record is None or record["state"] != JOB_RUNNING:
+                    aborted = True
+                    runner.cancel()
+                    break
+            content = await runner
+        except asyncio.CancelledError:
+            if not aborted:
+                # 进程退出
+                runner.cancel()
+                raise
+            logger.info(
+                "Aborted section %d of a job that is no longer running",
+                index,
+                extra={"job_id": job_id},
+            )
+            return
+        except Exception as e:
+            # 交还章节，由任务所在进程按其重试策略生成
+            await self.store.release_section(job_id, index, WORKER_ID)
+            logger.warning(
+                "Failed to generate section %d for another worker: %r",
+                index,
+                e,
+                extra={"job_id": job_id},
+            )
+            return
+        await self.store.complete_section(job_id, index, content)
+        logger.info(
+            "Generated section %d for another worker", index, extra={"job_id": job_id}
+        )
@@ -0,0 +1,141 @@
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import re
+import sys
+import time
+from collections import defaultdict
+from typing import Dict, Optional, Tuple
+
+# 当前任务的job_id，由任务协程设置，其创建的子任务自动继承
+job_context: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar(
+    "job_id", default=None
+)
+
+# 日志中需要遮盖的密钥：OpenAI风格的key、Bearer令牌以及api_key=...形式的字段
+_SECRET_PATTERNS = [
+    re.compile(r"sk-[A-Za-z0-9_\-]{8,}"),
+    re.compile(r"(Bearer\s+)[A-Za-z0-9_\-\.=]{8,}", re.IGNORECASE),
+    re.compile(r"(api_key['\"]?\s*[:=]\s*['\"]?)[^'\"\s,)]+", re.IGNORECASE),
+]
+# 单条日志的最大长度，超出部分截断，避免把论文正文等大段内容写入日志
+MAX_MESSAGE_CHARS = int(os.getenv("LOG_MAX_MESSAGE_CHARS", "2000"))
+
+# 第三方库的日志逐个请求输出（httpx在INFO级别记录每个请求），默认只保留警告
+NOISY_LOGGERS = ("httpx", "httpcore", "openai", "hpack")
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def redact(text: str) -> str:
+    for pattern in _SECRET_PATTERNS:
+        if pattern.groups:
+            text = pattern.sub(lambda m: m.group(1) + "***", text)
+        else:
+            text = pattern.sub("***", text)
+    if len(text) > MAX_MESSAGE_CHARS:
+        text = f"{text[:MAX_MESSAGE_CHARS]}... ({len(text)} chars)"
+    return text
+
+
+def bind_job(job_id: Optional[str]) -> contextvars.Token:
+    """把后续日志关联到job_id，返回的token用于job_context.reset"""
+    return job_context.set(job_id)
+
+
+class JobContextFilter(logging.Filter):
+    """在调用方线程中记录当前的job_id，日志写出时已经不在原来的上下文中"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not hasattr(record, "job_id"):
+            record.job_id = job_context.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """高频日志抽样：extra={"sample_every": n}的日志每n条只输出一条"""
+
+    def __init__(self):
+        super().__init__()
+        self._counts: Dict[Tuple[str, str], int] = defaultdict(int)
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        every = getattr(record, "sample_every", None)
+        if not every or every <= 1:
+            return True
+        key = (record.name, str(record.msg))
+        count = self._counts[key]
+        self._counts[key] = count + 1
+        if count % every:
+            return False
+        record.sampled = every
+        return True
+
+
+class RedactingFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        record.job = getattr(record, "job_id", None) or "-"
+        text = super().format(record)
+        if getattr(record, "sampled", None):
+            text += f" (sampled 1/{record.sampled})"
+        return redact(text)
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created)),
+            "level": record.levelname,
+            "logger": record.name,
+            "job_id": getattr(record, "job_id", None),
+            "message": redact(record.getMessage()),
+        }
+        if getattr(record, "sampled", None):
+            payload["sampled"] = record.sampled
+        if record.exc_info:
+            payload["exception"] = redact(self.formatException(record.exc_info))
+        return json.dumps(payload, ensure_ascii=False)
+
+
+def setup_logging(level: Optional[str] = None, fmt: Optional[str] = None):
+    """配置根日志：调用方只把日志放入队列，由后台线程格式化、脱敏并写到stderr
+
+    级别和格式由环境变量LOG_LEVEL（默认INFO）和LOG_FORMAT（text或json）控制，
+    第三方库的级别由LOG_LEVEL_THIRD_PARTY（默认WARNING）控制，重复调用无效。
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    level = (level or os.getenv("LOG_LEVEL", "INFO")).upper()
+    fmt = (fmt or os.getenv("LOG_FORMAT", "text")).lower()
+
+    output = logging.StreamHandler(sys.stderr)
+    if fmt == "json":
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(
+            RedactingFormatter(
+                "%(asctime)s %(levelname)s %(name)s [%(job)s] %(message)s"
+            )
+        )
+
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(JobContextFilter())
+    queue_handler.addFilter(SamplingFilter())
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(queue_handler)
+    third_party_level = os.getenv("LOG_LEVEL_THIRD_PARTY", "WARNING").upper()
+    for name in NOISY_LOGGERS:
+        logging.getLogger(name).setLevel(third_party_level)
+
+    _listener = logging.handlers.QueueListener(log_queue, output)
+    _listener.start()
+    atexit.register(_listener.stop)
@@ -2,31 +2,47 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from dotenv import load_dotenv
+import logging
 import os
 import uvicorn
 
+# 确保加载 .env 文件；需在导入API模块之前，其中的任务队列和状态存储配置才会生效
+load_dotenv(override=True)
+
 # 导入API路由
-from api import app
+from api import app  # noqa: E402
+from logging_setup import setup_logging  # noqa: E402
 
-# 确保加载 .env 文件
-load_dotenv(override=True)
-print("Environment variables loaded from .env file")
+# 日志级别和格式可以在 .env 中配置，因此在加载之后初始化
+setup_logging()
+logger = logging.getLogger(__name__)
+logger.info("Environment variables loaded from .env file")
 
 # 确保当前目录存在
 current_dir = os.path.dirname(os.path.abspath(__file__))
 os.makedirs(current_dir, exist_ok=True)
 
-if __name__ == "__main__":
-    # 挂载静态文件目录，使生成的文件可以被前端访问
-    # 注意：这里使用"/static"作为路径前缀，避免与API路由冲突
-    app.mount("/static", StaticFiles(directory=current_dir), name="static")
 
+def create_app():
+    """挂载前端静态文件后返回应用；启动多个工作进程时由每个进程各自调用
+
+    生成的论文和导出文件由/api/artifacts提供下载，不再挂载源码目录。
+    """
     # 挂载前端静态文件
     frontend_dir = os.path.join(os.path.dirname(current_dir), "frontend", "build")
     if os.path.exists(frontend_dir):
         app.mount("/", StaticFiles(directory=frontend_dir, html=True), name="frontend")
-        print(f"Frontend static files mounted from {frontend_dir}")
+        logger.info("Frontend static files mounted from %s", frontend_dir)
     else:
-        print(f"Frontend build directory not found at {frontend_dir}")
+        logger.warning("Frontend build directory not found at %s", frontend_dir)
+    return app
+
 
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+if __name__ == "__main__":
+    # 任务和进度保存在共享状态存储中，可以启动多个工作进程
+    workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+    if workers > 1 and os.getenv("STATE_STORE", "sqlite").lower() == "memory":
+        logger.warning("STATE_STORE=memory is not shared between workers")
+    uvicorn.run(
+        "main:create_app", factory=True, host="0.0.0.0", port=8000, workers=workers
+    )
@@ -0,0 +1,300 @@
+import abc
+import math
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# 默认的延迟分桶（秒），覆盖从毫秒级的缓存命中到数分钟的长章节
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300, 600)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class _Metric(abc.ABC):
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        # 导出器在线程池中运行，指标可能在事件循环之外更新
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, object]) -> LabelValues:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(
+                f"Metric {self.name} expects labels {self.labelnames}, got {tuple(labels)}"
+            )
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    @abc.abstractmethod
+    def samples(self) -> Iterable[Tuple[str, str, float]]:
+        """返回(样本名, 标签文本, 值)"""
+
+    def render(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type_name}",
+        ]
+        for name, labels, value in self.samples():
+            lines.append(f"{name}{labels} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            yield self.name, _format_labels(self.labelnames, key), value
+
+
+class Gauge(_Metric):
+    type_name = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def value(self, **labels) -> float:
+        key = self._key(labels)
+        with self._lock:
+            return self._values.get(key, 0.0)
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            yield self.name, _format_labels(self.labelnames, key), value
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # 每组标签对应(各分桶计数, 总和, 总数)
+        self._values: Dict[LabelValues, Tuple[List[int], float, int]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total, count = self._values.get(
+                key, ([0] * len(self.buckets), 0.0, 0)
+            )
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._values[key] = (counts, total + value, count + 1)
+
+    def samples(self):
+        with self._lock:
+            values = sorted(
+                (key, (list(counts), total, count))
+                for key, (counts, total, count) in self._values.items()
+            )
+        for key, (counts, total, count) in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _format_labels(
+                    self.labelnames + ("le",), key + (_format_value(bound),)
+                )
+                yield f"{self.name}_bucket", labels, cumulative
+            labels = _format_labels(self.labelnames, key)
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, count
+
+
+# 抓取时回调的采集函数，返回(指标名, 类型, 说明, [(标签, 值)])
+Collector = Callable[
+    [], Iterable[Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]]
+]
+
+
+class MetricsRegistry:
+    """进程内的指标注册表，按Prometheus文本格式输出，无需额外依赖"""
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Collector] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames=()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames=()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames=(),
+        buckets: Optional[Sequence[float]] = None,
+    ) -> Histogram:
+        return self.register(
+            Histogram(name, documentation, labelnames, buckets or DEFAULT_BUCKETS)
+        )
+
+    def add_collector(self, collector: Collector):
+        """注册抓取时计算的指标，例如队列长度和缓存统计"""
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            for name, type_name, documentation, samples in collector():
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {type_name}")
+                for labels, value in samples:
+                    label_text = _format_labels(list(labels), list(labels.values()))
+                    lines.append(f"{name}{label_text} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+# 全局指标注册表
+metrics_registry = MetricsRegistry()
+
+LLM_REQUEST_DURATION = metrics_registry.histogram(
+    "paper_llm_request_duration_seconds",
+    "Latency of model requests by stage (title, outline, section)",
+    ["stage"],
+)
+LLM_TIME_TO_FIRST_TOKEN = metrics_registry.histogram(
+    "paper_llm_time_to_first_token_seconds",
+    "Time from sending a streaming request to its first content token",
+    ["stage"],
+)
+LLM_ERRORS = metrics_registry.counter(
+    "paper_llm_errors_total",
+    "Failed model requests by stage and upstream status code",
+    ["stage", "status"],
+)
+LLM_PROMPT_TOKENS = metrics_registry.counter(
+    "paper_llm_prompt_tokens_total",
+    "Prompt tokens sent to the model, from response usage when available",
+    ["stage"],
+)
+LLM_COMPLETION_TOKENS = metrics_registry.counter(
+    "paper_llm_completion_tokens_total",
+    "Completion tokens returned by the model, from response usage when available",
+    ["stage"],
+)
+LLM_CACHED_PROMPT_TOKENS = metrics_registry.counter(
+    "paper_llm_cached_prompt_tokens_total",
+    "Prompt tokens served from the upstream prefix cache, as reported in response usage",
+    ["stage"],
+)
+LLM_ABORTED_REQUESTS = metrics_registry.counter(
+    "paper_llm_aborted_requests_total",
+    "In-flight model requests aborted because their job or caller was cancelled",
+    ["stage"],
+)
+LLM_CACHE_LOOKUPS = metrics_registry.counter(
+    "paper_llm_cache_lookups_total",
+    "Response cache lookups by stage and result (hit or miss)",
+    ["stage", "result"],
+)
+SECTIONS_IN_FLIGHT = metrics_registry.gauge(
+    "paper_sections_in_flight", "Section requests currently sent to the model"
+)
+SECTIONS_QUEUED = metrics_registry.gauge(
+    "paper_sections_queued",
+    "Sections waiting for a scheduler slot, including those backing off for a retry",
+)
+SECTION_RETRIES = metrics_registry.counter(
+    "paper_section_retries_total",
+    "Section retries scheduled after a failure, by upstream status code",
+    ["status"],
+)
+EXPORT_DURATION = metrics_registry.histogram(
+    "paper_export_duration_seconds",
+    "Document export latency by format, backend and cache result",
+    ["format", "backend", "cached"],
+)
+EXPORT_FAILURES = metrics_registry.counter(
+    "paper_export_failures_total", "Failed document exports by format", ["format"]
+)
+ARTIFACT_BYTES = metrics_registry.gauge(
+    "paper_artifact_bytes",
+    "Total size of stored papers and exports, including compressed copies",
+)
+JOBS_ACTIVE = metrics_registry.gauge(
+    "paper_jobs",
+    "Paper generation jobs currently queued or running, across all workers",
+    ["state"],
+)
+JOBS_FINISHED = metrics_registry.counter(
+    "paper_jobs_finished_total", "Finished paper generation jobs by state", ["state"]
+)
+JOB_DURATION = metrics_registry.histogram(
+    "paper_job_duration_seconds",
+    "Wall-clock time to generate all sections of a paper",
+    buckets=(10, 30, 60, 120, 300, 600, 1200, 1800, 3600),
+)
+JOB_SECTIONS_PER_MINUTE = metrics_registry.histogram(
+    "paper_job_sections_per_minute",
+    "Per-job throughput of sections generated by the model",
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500),
+)
+SPECULATIVE_RESULTS = metrics_registry.counter(
+    "paper_speculative_results_total",
+    "Speculative outline prefetches by outcome (hit, miss, cancelled, expired, skipped)",
+    ["result"],
+)
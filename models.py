@@ -1,12 +1,28 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import List, Optional, Union, Dict, Any
 
 
 # API 配置
+class EndpointConfig(BaseModel):
+    # repr=False：打印或记录配置时不会带出密钥
+    api_key: str = Field(repr=False)
+    base_url: str = "https://api.openai.com/v1"
+    # 为空时沿用APIConfig.model_name
+    model_name: Optional[str] = None
+    # 相对权重，权重越大分到的请求越多
+    weight: float = 1.0
+
+    model_config = {"protected_namespaces": ()}
+
+
 class APIConfig(BaseModel):
-    api_key: str
+    api_key: str = Field(repr=False)
     base_url: str = "https://api.openai.com/v1"
     model_name: str = "gpt-4o"
+    # 额外的上游端点，与上面的主端点一起组成端点池，请求在其间负载均衡和故障转移
+    endpoints: List[EndpointConfig] = []
+    # 端点选择策略：least_outstanding（在途请求最少）或ewma（延迟加权）
+    routing_strategy: str = "least_outstanding"
 
     model_config = {"protected_namespaces": ()}
 
@@ -16,8 +32,21 @@ class ModelConfig(BaseModel):
     temperature: float = 0.7
     max_tokens: int = 4096
     top_p: float = 0.9
-    chunk_size: int = 15000  # 每个块的大小
+    chunk_size: int = 15000  # 单次章节请求的提示词token上限，超出时压缩大纲
     concurrent_requests: int = 64  # 并发请求数
+    max_retries: int = 5  # 章节请求遇到限流或5xx时的最大重试次数
+    requests_per_minute: Optional[int] = None  # 每个base_url每分钟请求数上限
+    tokens_per_minute: Optional[int] = None  # 每个base_url每分钟token数上限
+    compact_outline: bool = True  # 章节提示词只保留相关大纲条目，其余折叠为一级标题
+    # 章节请求使用前缀缓存友好的布局：同一篇论文各章节的提示词开头（系统提示、主题、标题、
+    # 完整大纲）逐字节相同，章节指令放在最后；开启后不再按章节压缩大纲
+    prefix_cache: bool = False
+    stream_sections: bool = True  # 以流式方式生成章节，通过SSE推送给前端
+    # 流式请求附带stream_options.include_usage，要求上游在最后一个chunk中返回usage；
+    # 不支持该参数的服务返回400时会自动去掉重试，也可以直接关闭
+    stream_usage: bool = True
+    use_cache: bool = False  # 启用响应缓存，相同请求直接返回缓存结果
+    refresh_cache: bool = False  # 跳过缓存查询，强制请求模型并刷新缓存
 
     model_config = {"protected_namespaces": ()}
 
@@ -28,8 +57,47 @@ class PaperConfig(BaseModel):
     title: str = ""
     outline: List[str] = []
     api_config: Optional[Union[Dict[str, Any], APIConfig]] = None
-    model_config: Optional[Union[Dict[str, Any], ModelConfig]] = None
+    # 字段名model_config与pydantic的类配置冲突，使用别名接收请求中的model_config
+    model_params: Optional[Union[Dict[str, Any], ModelConfig]] = Field(
+        None, alias="model_config"
+    )
     custom_prompt: Optional[str] = None
     is_new_generation: Optional[bool] = False
+    # 一键生成：大纲为空时流式生成大纲（标题为空时先生成标题），章节随大纲条目到达立即开始生成
+    auto_outline: bool = False
+    # 返回标题建议后在后台为前N个建议推测生成大纲，同一会话随后请求这些标题的大纲时直接返回
+    prefetch_outlines: int = 0
+    content_sections: List[int] = []  # 有下级章节但仍需生成正文的大纲条目序号
+    regenerate_sections: List[int] = []  # 重新生成时需要重新请求模型的大纲条目序号
+    export_formats: List[str] = ["docx"]  # 生成完成后导出的格式：docx/html/pdf/latex
+    export_backend: str = (
+        "native"  # docx导出后端：native（内置，失败时回退pandoc）/pandoc
+    )
+    # 客户端断开事件流（/api/paper-generation-events）且未在宽限期内重连时取消任务
+    cancel_on_disconnect: bool = False
 
-    model_config = {"protected_namespaces": ()}
+    model_config = {"protected_namespaces": (), "populate_by_name": True}
+
+
+# 导出请求
+class ExportRequest(BaseModel):
+    formats: List[str] = ["docx"]
+    backend: Optional[str] = None  # 为空时沿用生成请求中的export_backend
+
+
+# 恢复任务请求
+class ResumeRequest(BaseModel):
+    # 检查点中不保存API密钥；任务已不在内存中时必须提供
+    api_config: Optional[Union[Dict[str, Any], APIConfig]] = None
+
+
+# 重新生成部分章节请求
+class RegenerateRequest(BaseModel):
+    sections: List[Union[int, str]]  # 大纲序号或大纲条目
+    custom_prompt: Optional[str] = None  # 针对这些章节的修改指令
+    api_config: Optional[Union[Dict[str, Any], APIConfig]] = None
+    model_params: Optional[Union[Dict[str, Any], ModelConfig]] = Field(
+        None, alias="model_config"
+    )
+
+    model_config = {"protected_namespaces": (), "populate_by_name": True}
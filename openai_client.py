@@ -1,121 +1,321 @@
-from openai import AsyncOpenAI
+from openai import APIConnectionError, AsyncOpenAI, BadRequestError
 from fastapi import HTTPException
+import asyncio
+import logging
 import re
-from typing import List
+import time
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Set, Tuple
 from models import APIConfig, ModelConfig
-from utils import prompt_templates
+from client_pool import client_registry
+from llm_cache import llm_cache
+from router import get_router
+from metrics import (
+    LLM_ABORTED_REQUESTS,
+    LLM_CACHE_LOOKUPS,
+    LLM_CACHED_PROMPT_TOKENS,
+    LLM_COMPLETION_TOKENS,
+    LLM_ERRORS,
+    LLM_PROMPT_TOKENS,
+    LLM_REQUEST_DURATION,
+    LLM_TIME_TO_FIRST_TOKEN,
+)
+from prompt_compaction import count_message_tokens, count_tokens, fit_section_outline
+from prompt_store import prompt_store
+
+logger = logging.getLogger(__name__)
+
+# 拒绝stream_options参数（返回400）的端点，之后的流式请求不再附带该参数
+_stream_usage_unsupported: Set[str] = set()
+
+
+def provider_error(e: Exception) -> HTTPException:
+    """把上游异常转换为HTTPException，保留状态码和Retry-After以便调用方决定是否重试"""
+    if isinstance(e, HTTPException):
+        return e
+    if isinstance(e, APIConnectionError):
+        # 连接失败和超时视为上游暂时不可用
+        return HTTPException(status_code=503, detail=str(e))
+
+    status_code = getattr(e, "status_code", None) or 500
+    headers = None
+    response = getattr(e, "response", None)
+    if response is not None and response.headers.get("retry-after"):
+        headers = {"Retry-After": response.headers["retry-after"]}
+    return HTTPException(status_code=status_code, detail=str(e), headers=headers)
+
+
+def _usage_field(usage: Any, name: str) -> Any:
+    # 较旧的SDK不认识的字段（流式chunk的usage、prompt_tokens_details）以dict返回
+    if isinstance(usage, dict):
+        return usage.get(name)
+    return getattr(usage, name, None)
+
+
+def cached_prompt_tokens(usage: Any) -> int:
+    """响应usage中命中上游前缀缓存的提示词token数，服务未返回时为0"""
+    details = _usage_field(usage, "prompt_tokens_details")
+    cached = _usage_field(details, "cached_tokens") if details else None
+    if cached is None:
+        # DeepSeek等服务在usage中直接返回命中缓存的token数
+        cached = _usage_field(usage, "prompt_cache_hit_tokens")
+    return cached or 0
+
+
+def _rejects_stream_options(e: BadRequestError) -> bool:
+    """400错误是否因为上游不支持stream_options参数"""
+    text = f"{e} {getattr(e, 'body', '') or ''}".lower()
+    return "stream_options" in text or "include_usage" in text
+
+
+def _error_label(e: Exception) -> str:
+    """错误指标的status标签：上游状态码，连接失败为connection"""
+    if isinstance(e, APIConnectionError):
+        return "connection"
+    return str(getattr(e, "status_code", None) or "unknown")
 
 
 class OpenAIClient:
-    def __init__(self, api_config: APIConfig):
-        self.client = AsyncOpenAI(
-            api_key=api_config.api_key,
-            base_url=api_config.base_url,
-        )
+    def __init__(
+        self, api_config: APIConfig, model_config: Optional[ModelConfig] = None
+    ):
+        self.api_config = api_config
         self.model = api_config.model_name
+        # 连接池大小与并发请求数一致
+        self.max_connections = (model_config or ModelConfig()).concurrent_requests
+        # 配置了多个端点时由路由器选择端点并在失败时转移
+        self.router = get_router(api_config)
 
-    def build_system_prompt(self, prompt_type: str) -> str:
-        """从format_requirements构建系统提示"""
-        global prompt_templates
-
-        role_map = {
-            "title": "学术论文标题生成助手",
-            "title_suggestions": "学术论文标题生成助手",
-            "outline": "学术论文大纲生成助手",
-            "section": "学术论文内容生成助手",
-        }
-
-        # 获取角色
-        role = role_map.get(prompt_type, "学术论文助手")
-
-        # 获取格式要求
-        requirements = prompt_templates["format_requirements"].get(prompt_type, [])
-
-        # 构建基本要求
-        base_requirements = []
-        if prompt_type in ["title", "title_suggestions"]:
-            # 标题类型的提示都需要包含标题的基本要求
-            base_requirements = prompt_templates["format_requirements"]["title"]
-
-            # 如果是标题建议，还需要添加特定要求
-            if prompt_type == "title_suggestions":
-                base_requirements = (
-                    base_requirements
-                    + prompt_templates["format_requirements"]["title_suggestions"]
-                )
-        else:
-            base_requirements = requirements
-
-        # 添加额外的输出格式要求
-        if prompt_type == "title":
-            base_requirements.append("只返回标题本身，不需要其他解释")
-        elif prompt_type == "title_suggestions":
-            base_requirements.append("每行一个标题，不需要编号或其他解释")
-        elif prompt_type == "outline":
-            base_requirements.append("直接返回目录大纲，不需要其他解释")
-        elif prompt_type == "section":
-            base_requirements.append("直接返回该章节的完整内容，不需要其他解释")
-
-        # 构建系统提示
-        system_prompt = f"你是一个专业的{role}。\n请遵循以下格式要求："
+    def endpoint_client(self, api_config: APIConfig) -> AsyncOpenAI:
+        # 每次从注册表获取端点的共享客户端，同时刷新其最近使用时间
+        return client_registry.get(api_config, self.max_connections)
 
-        for i, req in enumerate(base_requirements, 1):
-            system_prompt += f"\n{i}. {req}"
+    async def _complete(
+        self,
+        messages: List[Dict[str, Any]],
+        config: ModelConfig,
+        temperature: Optional[float] = None,
+        on_delta: Optional[Callable[[str], None]] = None,
+        sdk_retries: bool = True,
+        stage: str = "other",
+        on_usage: Optional[Callable[[int, int, int], None]] = None,
+    ) -> Optional[str]:
+        """发送一次对话补全请求
+
+        config.use_cache为True时先查询响应缓存，未命中再请求模型并写入缓存；
+        config.refresh_cache为True时跳过查询、强制请求并刷新缓存。
+        传入on_delta时以流式方式请求，每收到一段文本回调一次。
+        sdk_retries为False时关闭SDK内置重试，由调用方（章节调度器）负责退避重试。
+        请求由路由器发往端点池中负载最低的端点，端点失败时转移到其他端点。
+        每次请求的延迟、首个token时间、错误和token用量按stage记录到指标中，
+        并以(提示词token数, 输出token数, 命中前缀缓存的token数)回调on_usage。
+        """
+        if temperature is None:
+            temperature = config.temperature
+
+        cache_key = None
+        if config.use_cache:
+            cache_key = self.request_key(messages, config, temperature)
+            if not config.refresh_cache:
+                cached = await llm_cache.get(cache_key)
+                LLM_CACHE_LOOKUPS.inc(
+                    stage=stage, result="miss" if cached is None else "hit"
+                )
+                if cached is not None:
+                    if on_delta:
+                        on_delta(cached)
+                    return cached
+
+        # 流式请求已经输出部分内容后不能再转移到其他端点，交给调用方重试
+        streamed = False
+
+        async def _request(api_config: APIConfig) -> Optional[str]:
+            nonlocal streamed
+            client = self.endpoint_client(api_config)
+            if not sdk_retries:
+                client = client.with_options(max_retries=0)
+
+            started = time.monotonic()
+            try:
+                if on_delta is None:
+                    response = await client.chat.completions.create(
+                        model=api_config.model_name,
+                        messages=messages,
+                        temperature=temperature,
+                        max_tokens=config.max_tokens,
+                        top_p=config.top_p,
+                    )
+                    content = response.choices[0].message.content
+                    usage = response.usage
+                else:
+                    stream_usage = (
+                        config.stream_usage
+                        and api_config.base_url not in _stream_usage_unsupported
+                    )
+                    try:
+                        stream = await self._create_stream(
+                            client,
+                            api_config,
+                            messages,
+                            config,
+                            temperature,
+                            stream_usage,
+                        )
+                    except BadRequestError as e:
+                        # 部分OpenAI兼容服务不认识stream_options，去掉后重试一次；
+                        # 上下文过长等其他400直接抛出，不重复请求
+                        if not stream_usage or not _rejects_stream_options(e):
+                            raise
+                        logger.warning(
+                            "Endpoint %s rejected stream_options, retrying without usage",
+                            api_config.base_url,
+                        )
+                        _stream_usage_unsupported.add(api_config.base_url)
+                        stream = await self._create_stream(
+                            client, api_config, messages, config, temperature, False
+                        )
+                    parts = []
+                    usage = None
+                    try:
+                        async for chunk in stream:
+                            # 部分服务在最后一个chunk中返回usage
+                            usage = getattr(chunk, "usage", None) or usage
+                            if not chunk.choices:
+                                continue
+                            delta = chunk.choices[0].delta.content
+                            if delta:
+                                if not streamed:
+                                    LLM_TIME_TO_FIRST_TOKEN.observe(
+                                        time.monotonic() - started, stage=stage
+                                    )
+                                parts.append(delta)
+                                streamed = True
+                                on_delta(delta)
+                    finally:
+                        # 被取消或出错时立即关闭响应，上游停止生成，连接归还连接池
+                        await stream.close()
+                    content = "".join(parts) or None
+            except asyncio.CancelledError:
+                LLM_ABORTED_REQUESTS.inc(stage=stage)
+                raise
+            except Exception as e:
+                LLM_ERRORS.inc(stage=stage, status=_error_label(e))
+                raise
+
+            LLM_REQUEST_DURATION.observe(time.monotonic() - started, stage=stage)
+            cached_tokens = 0
+            if usage is not None:
+                prompt_tokens = _usage_field(usage, "prompt_tokens")
+                completion_tokens = _usage_field(usage, "completion_tokens")
+                cached_tokens = cached_prompt_tokens(usage)
+            else:
+                # 流式响应没有usage时按本地分词估算
+                prompt_tokens = count_message_tokens(messages)
+                completion_tokens = count_tokens(content or "")
+            LLM_PROMPT_TOKENS.inc(prompt_tokens or 0, stage=stage)
+            LLM_COMPLETION_TOKENS.inc(completion_tokens or 0, stage=stage)
+            LLM_CACHED_PROMPT_TOKENS.inc(cached_tokens, stage=stage)
+            if on_usage:
+                on_usage(prompt_tokens or 0, completion_tokens or 0, cached_tokens)
+            return content
+
+        content = await self.router.call(_request, can_failover=lambda: not streamed)
+
+        if cache_key and content:
+            await llm_cache.set(cache_key, content)
+        return content
+
+    @staticmethod
+    async def _create_stream(
+        client: AsyncOpenAI,
+        api_config: APIConfig,
+        messages: List[Dict[str, Any]],
+        config: ModelConfig,
+        temperature: float,
+        stream_usage: bool,
+    ):
+        # 要求在最后一个chunk中返回usage，以便统计命中缓存的token数
+        extra_body = (
+            {"stream_options": {"include_usage": True}} if stream_usage else None
+        )
+        return await client.chat.completions.create(
+            model=api_config.model_name,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=config.max_tokens,
+            top_p=config.top_p,
+            stream=True,
+            extra_body=extra_body,
+        )
 
-        return system_prompt
+    def request_key(
+        self,
+        messages: List[Dict[str, Any]],
+        config: ModelConfig,
+        temperature: Optional[float] = None,
+    ) -> str:
+        """请求的内容键，参数相同的请求得到相同的键，用于响应缓存和推测结果的匹配"""
+        return llm_cache.make_key(
+            self.router.model_key,
+            messages,
+            config.temperature if temperature is None else temperature,
+            config.top_p,
+            config.max_tokens,
+            prompt_store.current.version,
+        )
 
-    async def generate_title(self, topic: str, config: ModelConfig) -> str:
-        global prompt_templates
+    def build_system_prompt(self, prompt_type: str) -> str:
+        """返回当前版本模板中预先构建的系统提示"""
+        return prompt_store.current.system_prompt(prompt_type)
 
+    def title_messages(self, topic: str) -> List[Dict[str, Any]]:
+        templates = prompt_store.current
         messages = []
 
         # 构建系统提示
-        system_prompt = self.build_system_prompt("title")
+        system_prompt = templates.system_prompt("title")
         messages.append({"role": "system", "content": system_prompt})
 
         # 用户提示
-        prompt = prompt_templates["title_prompt"].format(topic=topic)
+        prompt = templates.render("title_prompt", topic=topic)
         messages.append({"role": "user", "content": prompt})
+        return messages
+
+    async def generate_title(self, topic: str, config: ModelConfig) -> str:
+        messages = self.title_messages(topic)
 
         try:
-            response = await self.client.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                temperature=config.temperature,
-                max_tokens=config.max_tokens,
-                top_p=config.top_p,
+            title = (
+                await self._complete(messages, config, stage="title")
+                or "生成失败，请重试"
             )
-            title = response.choices[0].message.content or "生成失败，请重试"
 
             return title
         except Exception as e:
-            print(f"Error generating title: {str(e)}")
-            raise HTTPException(status_code=500, detail=str(e))
+            logger.warning("Error generating title: %s", e)
+            raise provider_error(e)
 
     async def generate_title_suggestions(
         self, topic: str, config: ModelConfig
     ) -> List[str]:
-        global prompt_templates
-
+        templates = prompt_store.current
         messages = []
 
         # 构建系统提示
-        system_prompt = self.build_system_prompt("title_suggestions")
+        system_prompt = templates.system_prompt("title_suggestions")
         messages.append({"role": "system", "content": system_prompt})
 
         # 用户提示
-        prompt = prompt_templates["title_suggestions_prompt"].format(topic=topic)
+        prompt = templates.render("title_suggestions_prompt", topic=topic)
         messages.append({"role": "user", "content": prompt})
 
         try:
-            response = await self.client.chat.completions.create(
-                model=self.model,
-                messages=messages,
+            titles_text = await self._complete(
+                messages,
+                config,
                 temperature=config.temperature + 0.1,  # 稍微提高多样性
-                max_tokens=config.max_tokens,
-                top_p=config.top_p,
+                stage="title_suggestions",
             )
-            titles_text = response.choices[0].message.content.strip()
+            titles_text = titles_text.strip()
 
             # 处理标题格式
             titles = titles_text.split("\n")
@@ -133,8 +333,8 @@ class OpenAIClient:
 
             return cleaned_titles[:4]  # 最多返回4个
         except Exception as e:
-            print(f"Error generating title suggestions: {str(e)}")
-            raise HTTPException(status_code=500, detail=str(e))
+            logger.warning("Error generating title suggestions: %s", e)
+            raise provider_error(e)
 
     async def generate_title_with_custom_prompt(
         self,
@@ -144,8 +344,6 @@ class OpenAIClient:
         is_new_generation: bool = False,
         current_title: str = "",
     ) -> str:
-        global prompt_templates
-
         messages = []
 
         # 构建系统提示
@@ -166,61 +364,94 @@ class OpenAIClient:
         messages.append({"role": "user", "content": prompt})
 
         try:
-            response = await self.client.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                temperature=config.temperature,
-                max_tokens=config.max_tokens,
-                top_p=config.top_p,
+            title = (
+                await self._complete(messages, config, stage="title")
+                or "生成失败，请重试"
             )
-            title = response.choices[0].message.content or "生成失败，请重试"
 
             return title
         except Exception as e:
-            print(f"Error generating title with custom prompt: {str(e)}")
-            raise HTTPException(status_code=500, detail=str(e))
-
-    async def generate_outline(
-        self, topic: str, title: str, config: ModelConfig
-    ) -> List[str]:
-        global prompt_templates
+            logger.warning("Error generating title with custom prompt: %s", e)
+            raise provider_error(e)
 
+    def outline_messages(self, topic: str, title: str) -> List[Dict[str, Any]]:
+        templates = prompt_store.current
         messages = []
 
         # 构建系统提示
-        system_prompt = self.build_system_prompt("outline")
+        system_prompt = templates.system_prompt("outline")
         messages.append({"role": "system", "content": system_prompt})
 
         # 用户提示
-        prompt = prompt_templates["outline_prompt"].format(topic=topic, title=title)
+        prompt = templates.render("outline_prompt", topic=topic, title=title)
         messages.append({"role": "user", "content": prompt})
+        return messages
 
-        try:
-            response = await self.client.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                temperature=config.temperature,
-                max_tokens=config.max_tokens,
-                top_p=config.top_p,
-            )
-            outline_text = response.choices[0].message.content.strip()
+    @staticmethod
+    def parse_outline(outline_text: str) -> List[str]:
+        # 处理大纲格式，确保每行是一个条目，但保留编号和层级标记
+        outline_lines = outline_text.strip().split("\n")
+        cleaned_outline = []
 
-            # 处理大纲格式，确保每行是一个条目，但保留编号和层级标记
-            outline_lines = outline_text.split("\n")
-            cleaned_outline = []
+        for line in outline_lines:
+            line = line.strip()
+            if not line:
+                continue
 
-            for line in outline_lines:
-                line = line.strip()
-                if not line:
-                    continue
+            # 不再移除编号和项目符号，保留原始格式
+            cleaned_outline.append(line)
 
-                # 不再移除编号和项目符号，保留原始格式
-                cleaned_outline.append(line)
+        return cleaned_outline
 
-            return cleaned_outline
+    async def generate_outline(
+        self, topic: str, title: str, config: ModelConfig
+    ) -> List[str]:
+        messages = self.outline_messages(topic, title)
+
+        try:
+            return self.parse_outline(
+                await self._complete(messages, config, stage="outline")
+            )
         except Exception as e:
-            print(f"Error generating outline: {str(e)}")
-            raise HTTPException(status_code=500, detail=str(e))
+            logger.warning("Error generating outline: %s", e)
+            raise provider_error(e)
+
+    async def stream_outline(
+        self, topic: str, title: str, config: ModelConfig
+    ) -> AsyncIterator[str]:
+        """流式生成大纲，每个条目所在的行一结束就产生该条目，条目与parse_outline的结果一致"""
+        messages = self.outline_messages(topic, title)
+        deltas: asyncio.Queue = asyncio.Queue()
+        request = asyncio.create_task(
+            self._complete(
+                messages, config, on_delta=deltas.put_nowait, stage="outline"
+            )
+        )
+        # 请求结束（包括失败）后放入None，结束读取
+        request.add_done_callback(lambda _: deltas.put_nowait(None))
+
+        buffer = ""
+        try:
+            while True:
+                text = await deltas.get()
+                if text is None:
+                    break
+                buffer += text
+                *lines, buffer = buffer.split("\n")
+                for line in lines:
+                    line = line.strip()
+                    if line:
+                        yield line
+            await request
+            if buffer.strip():
+                yield buffer.strip()
+        except Exception as e:
+            logger.warning("Error streaming outline: %s", e)
+            raise provider_error(e)
+        finally:
+            # 调用方提前结束（如章节失败导致任务取消）时取消请求
+            if not request.done():
+                request.cancel()
 
     async def generate_outline_with_custom_prompt(
         self,
@@ -231,8 +462,6 @@ class OpenAIClient:
         is_new_generation: bool = False,
         current_outline: List[str] = [],
     ) -> List[str]:
-        global prompt_templates
-
         messages = []
 
         # 构建系统提示
@@ -254,14 +483,9 @@ class OpenAIClient:
         messages.append({"role": "user", "content": prompt})
 
         try:
-            response = await self.client.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                temperature=config.temperature,
-                max_tokens=config.max_tokens,
-                top_p=config.top_p,
-            )
-            outline_text = response.choices[0].message.content.strip()
+            outline_text = (
+                await self._complete(messages, config, stage="outline")
+            ).strip()
 
             # 处理大纲格式，确保每行是一个条目，但保留编号和层级标记
             outline_lines = outline_text.split("\n")
@@ -277,41 +501,119 @@ class OpenAIClient:
 
             return cleaned_outline
         except Exception as e:
-            print(f"Error generating outline with custom prompt: {str(e)}")
-            raise HTTPException(status_code=500, detail=str(e))
+            logger.warning("Error generating outline with custom prompt: %s", e)
+            raise provider_error(e)
 
-    async def generate_section(
+    def section_messages(
         self,
         topic: str,
         title: str,
         outline: List[str],
         section: str,
         config: ModelConfig,
-    ) -> str:
-        global prompt_templates
-
-        messages = []
+        section_index: Optional[int] = None,
+        custom_prompt: Optional[str] = None,
+        current_content: Optional[str] = None,
+    ) -> Tuple[List[Dict[str, Any]], int, int]:
+        """构建章节请求的消息，返回(消息, 完整大纲的提示词token数, 实际发送的token数)
+
+        提示词中的大纲按section_index压缩，并保证整条请求不超过config.chunk_size个token。
+        config.prefix_cache为True时，系统提示和主题、标题、完整大纲组成的开头部分对同一篇
+        论文的所有章节逐字节相同，章节指令放在最后，上游可以复用前缀缓存；此时大纲只在
+        超出chunk_size时压缩。
+        重新生成时可传入custom_prompt作为修改指令，current_content为该章节的现有内容。
+        """
+        templates = prompt_store.current
 
         # 构建系统提示
-        system_prompt = self.build_system_prompt("section")
-        messages.append({"role": "system", "content": system_prompt})
+        system_prompt = templates.system_prompt("section")
+
+        def _build_messages(outline_text: str) -> List[Dict[str, Any]]:
+            # 用户提示
+            if config.prefix_cache:
+                prompt = (
+                    templates.render(
+                        "section_context_prompt",
+                        topic=topic,
+                        title=title,
+                        outline_text=outline_text,
+                    )
+                    + "\n\n"
+                    + templates.render("section_task_prompt", section=section)
+                )
+            else:
+                prompt = templates.render(
+                    "section_prompt",
+                    topic=topic,
+                    title=title,
+                    outline_text=outline_text,
+                    section=section,
+                )
+            if custom_prompt:
+                # 在已有内容基础上修改
+                if current_content:
+                    prompt += f"\n\n当前章节内容是：\n\n{current_content}\n\n根据以下指令修改该章节：\n{custom_prompt}"
+                else:
+                    prompt += f"\n\n{custom_prompt}"
+            return [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": prompt},
+            ]
+
+        if section_index is None and section in outline:
+            section_index = outline.index(section)
+        outline_text, full_tokens, sent_tokens = fit_section_outline(
+            outline,
+            section_index,
+            lambda text: count_message_tokens(_build_messages(text)),
+            config.chunk_size,
+            compact=config.compact_outline and not config.prefix_cache,
+        )
+        return _build_messages(outline_text), full_tokens, sent_tokens
 
-        # 用户提示
-        outline_text = "\n".join(outline)
-        prompt = prompt_templates["section_prompt"].format(
-            topic=topic, title=title, outline_text=outline_text, section=section
+    async def generate_section(
+        self,
+        topic: str,
+        title: str,
+        outline: List[str],
+        section: str,
+        config: ModelConfig,
+        on_delta: Optional[Callable[[str], None]] = None,
+        sdk_retries: bool = True,
+        section_index: Optional[int] = None,
+        on_prompt_tokens: Optional[Callable[[int, int], None]] = None,
+        custom_prompt: Optional[str] = None,
+        current_content: Optional[str] = None,
+        on_usage: Optional[Callable[[int, int, int], None]] = None,
+    ) -> str:
+        """生成单个章节；传入on_delta时以流式方式请求，每收到一段文本回调一次
+
+        on_prompt_tokens以(完整大纲的提示词token数, 实际发送的token数)回调，
+        on_usage见_complete，其余参数见section_messages。
+        """
+        messages, full_tokens, sent_tokens = self.section_messages(
+            topic,
+            title,
+            outline,
+            section,
+            config,
+            section_index=section_index,
+            custom_prompt=custom_prompt,
+            current_content=current_content,
         )
-        messages.append({"role": "user", "content": prompt})
+        if on_prompt_tokens:
+            on_prompt_tokens(full_tokens, sent_tokens)
 
         try:
-            response = await self.client.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                temperature=config.temperature,
-                max_tokens=config.max_tokens,
-                top_p=config.top_p,
+            content = await self._complete(
+                messages,
+                config,
+                on_delta=on_delta,
+                sdk_retries=sdk_retries,
+                stage="section",
+                on_usage=on_usage,
             )
-            return response.choices[0].message.content or "生成失败，请重试"
+            return content or "生成失败，请重试"
         except Exception as e:
-            print(f"Error generating section: {str(e)}")
-            raise HTTPException(status_code=500, detail=str(e))
+            logger.warning("Error generating section: %s", e)
+            raise provider_error(e)
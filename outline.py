@@ -0,0 +1,153 @@
+import re
+from typing import Iterable, List, Optional, Tuple, Union
+
+# 数字编号的大纲条目："1. 引言"、"1.1 研究背景"、"1.1.1 研究问题"；一级编号后必须有"."或"、"，
+# 否则"2023 年研究进展"这样以数字开头的标题会被当成编号
+_NUMBERED_RE = re.compile(r"^(\d+(?:\.\d+)+)(?:[\.、]\s*|\s+)|^(\d+)[\.、]\s*")
+# 中文章节编号："第一章"、"第二节"
+_CHAPTER_RE = re.compile(r"^第[一二三四五六七八九十百零\d]+([章节])")
+_MARKDOWN_HEADING_RE = re.compile(r"^(#{1,6})\s+")
+
+
+def parse_outline_line(line: str) -> Tuple[int, Optional[List[int]], str]:
+    """解析单个大纲条目，返回(层级, 数字编号, 标题)
+
+    层级从1开始；没有数字编号时编号为None，无法识别层级的条目视为一级标题。
+    """
+    line = line.strip()
+    match = _NUMBERED_RE.match(line)
+    if match:
+        number = [int(part) for part in (match.group(1) or match.group(2)).split(".")]
+        return len(number), number, line[match.end() :].strip()
+    match = _CHAPTER_RE.match(line)
+    if match:
+        return (1 if match.group(1) == "章" else 2), None, line
+    match = _MARKDOWN_HEADING_RE.match(line)
+    if match:
+        return len(match.group(1)), None, line[match.end() :].strip()
+    return 1, None, line
+
+
+def outline_level(line: str) -> int:
+    return parse_outline_line(line)[0]
+
+
+def format_number(number: List[int], title: str) -> str:
+    # 与大纲提示词要求的格式一致：一级为"1. 引言"，其余为"1.1 研究背景"
+    if len(number) == 1:
+        return f"{number[0]}. {title}"
+    return f"{'.'.join(str(part) for part in number)} {title}"
+
+
+class OutlineNode:
+    def __init__(self, index: int, text: str, level: int, number: Optional[List[int]]):
+        self.index = index  # 在原始大纲中的位置
+        self.text = text
+        self.raw_text = text
+        self.level = level
+        self.number = number
+        self.title = text
+        self.parent: Optional["OutlineNode"] = None
+        self.children: List["OutlineNode"] = []
+        self.needs_content = False
+
+    @property
+    def is_leaf(self) -> bool:
+        return not self.children
+
+    def heading(self) -> str:
+        """不需要生成正文的章节只输出Markdown标题，论文标题占用了一级"""
+        return f"{'#' * min(self.level + 1, 6)} {self.text}"
+
+
+class OutlineTree:
+    """解析后的大纲树
+
+    根据编号确定层级和父子关系，并在本地修复常见的编号错误（层级跳跃、重复或不连续的编号），
+    无需重新请求模型。只有叶子章节（以及显式指定的章节）需要调用模型生成正文，
+    上级章节只输出标题。
+    """
+
+    def __init__(self, nodes: List[OutlineNode]):
+        self.nodes = nodes
+        self.roots = [node for node in nodes if node.parent is None]
+        self.repaired = 0
+
+    @classmethod
+    def parse(
+        cls, outline: List[str], content_indices: Iterable[int] = ()
+    ) -> "OutlineTree":
+        nodes: List[OutlineNode] = []
+        # 栈中保存(原始层级, 节点)，按原始层级判断父子关系
+        stack: List[Tuple[int, OutlineNode]] = []
+        for index, line in enumerate(outline):
+            level, number, title = parse_outline_line(line)
+            node = OutlineNode(index, line.strip(), level, number)
+            node.title = title
+
+            while stack and stack[-1][0] >= level:
+                stack.pop()
+            if stack:
+                node.parent = stack[-1][1]
+                node.parent.children.append(node)
+            # 层级跳跃（如"1."之后直接出现"1.1.1"）时挂到最近的上级下面
+            node.level = node.parent.level + 1 if node.parent else 1
+            stack.append((level, node))
+            nodes.append(node)
+
+        tree = cls(nodes)
+        tree._renumber(tree.roots, [])
+
+        content_indices = set(content_indices)
+        for node in nodes:
+            node.needs_content = node.is_leaf or node.index in content_indices
+        return tree
+
+    def _renumber(
+        self, children: List[OutlineNode], parent_number: Optional[List[int]]
+    ):
+        ordinal = 0
+        for node in children:
+            if node.number is not None:
+                ordinal += 1
+                # 上级没有数字编号（如"第一章"）时保留原有前缀
+                prefix = node.number[:-1] if parent_number is None else parent_number
+                expected = prefix + [ordinal]
+                if expected != node.number:
+                    node.number = expected
+                    node.text = format_number(expected, node.title)
+                    self.repaired += 1
+            self._renumber(node.children, node.number)
+
+    def lines(self) -> List[str]:
+        """修复后的大纲，与原始大纲一一对应"""
+        return [node.text for node in self.nodes]
+
+    def content_nodes(self) -> List[OutlineNode]:
+        return [node for node in self.nodes if node.needs_content]
+
+    def find(self, entry: Union[int, str]) -> OutlineNode:
+        """按大纲序号或条目文本（原始或修复后）查找节点"""
+        if isinstance(entry, int):
+            if 0 <= entry < len(self.nodes):
+                return self.nodes[entry]
+        else:
+            entry = entry.strip()
+            for node in self.nodes:
+                if entry in (node.text, node.raw_text):
+                    return node
+        raise ValueError(f"Outline entry not found: {entry}")
+
+    def select(self, entries: Iterable[Union[int, str]]) -> List[int]:
+        """返回指定条目中需要生成正文的章节序号，上级章节展开为其下的所有正文章节"""
+        selected = set()
+        for entry in entries:
+            stack = [self.find(entry)]
+            while stack:
+                node = stack.pop()
+                if node.needs_content:
+                    selected.add(node.index)
+                    # 指定生成正文的上级章节只重新生成自身
+                    continue
+                stack.extend(node.children)
+        return sorted(selected)
@@ -0,0 +1,650 @@
+import os
+import asyncio
+import logging
+import time
+from typing import (
+    Any,
+    AsyncIterable,
+    AsyncIterator,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+)
+
+from artifact_store import artifact_store
+from checkpoint import checkpoint_journal
+from exporter import paper_exporter
+from jobs import Job
+from logging_setup import bind_job, job_context
+from metrics import JOB_DURATION, JOB_SECTIONS_PER_MINUTE, SECTION_RETRIES
+from models import ModelConfig
+from outline import OutlineNode, OutlineTree
+from openai_client import OpenAIClient
+from prompt_compaction import count_tokens
+from rate_control import RetryPolicy, error_status, get_upstream
+from scheduler import SectionScheduler
+from state_store import DEFAULT_LEASE_SECONDS, WORKER_ID, StateStore
+from utils import safe_filename
+
+logger = logging.getLogger(__name__)
+
+# 等待其他进程生成章节时查询结果的间隔（秒）
+SECTION_POLL_INTERVAL = 0.5
+
+# 前缀缓存布局下，其余章节等待第一个章节收到首个token的最长时间（秒）
+PREFIX_WARMUP_TIMEOUT = float(os.getenv("PREFIX_WARMUP_TIMEOUT", "10"))
+
+# 每个章节都会输出的日志（提示词token数、重试）每N条输出一条
+LOG_SAMPLE_EVERY = int(os.getenv("LOG_SECTION_SAMPLE_EVERY", "10"))
+
+
+async def generate_paper_section(
+    client: OpenAIClient,
+    topic: str,
+    title: str,
+    outline: List[str],
+    section: str,
+    config: ModelConfig,
+    on_delta: Optional[Callable[[str], None]] = None,
+    section_index: Optional[int] = None,
+    on_prompt_tokens: Optional[Callable[[int, int], None]] = None,
+    custom_prompt: Optional[str] = None,
+    current_content: Optional[str] = None,
+    on_usage: Optional[Callable[[int, int, int], None]] = None,
+) -> str:
+    # 重试由章节调度器负责，关闭SDK内置重试以便及时感知限流
+    return await client.generate_section(
+        topic,
+        title,
+        outline,
+        section,
+        config,
+        on_delta=on_delta,
+        sdk_retries=False,
+        section_index=section_index,
+        on_prompt_tokens=on_prompt_tokens,
+        custom_prompt=custom_prompt,
+        current_content=current_content,
+        on_usage=on_usage,
+    )
+
+
+async def generate_section_for_job(job: Job, index: int, section: str) -> str:
+    """为其他进程运行的任务生成单个章节，空闲的工作协程协助生成时调用"""
+    config = job.config
+    outline = OutlineTree.parse(config.outline, config.content_sections).lines()
+    log_token = bind_job(job.job_id)
+    try:
+        return await generate_paper_section(
+            OpenAIClient(job.api_config, job.model_config),
+            config.topic,
+            config.title,
+            outline,
+            section,
+            job.model_config,
+            section_index=index,
+        )
+    finally:
+        job_context.reset(log_token)
+
+
+async def claim_section(store: StateStore, job_id: str, index: int) -> Optional[str]:
+    """认领章节，返回None表示由调用方生成；章节已由其他进程生成时返回其内容，
+    正在生成时等待其完成，对方租约过期（进程退出）后接手
+    """
+    while True:
+        claimed, content = await store.claim_section(
+            job_id, index, WORKER_ID, DEFAULT_LEASE_SECONDS
+        )
+        if claimed:
+            return None
+        if content is not None:
+            return content
+        await asyncio.sleep(SECTION_POLL_INTERVAL)
+
+
+def section_content(node: OutlineNode, content: str) -> str:
+    # 模型返回的正文没有标题时补上本地标题，保持文档层级一致
+    if not content.lstrip().startswith("#"):
+        return f"{node.heading()}\n\n{content}"
+    return content
+
+
+def assemble_markdown(title: str, sections: List[str]) -> str:
+    return f"# {title}\n\n" + "\n\n".join(sections)
+
+
+async def save_markdown(
+    title: str, markdown: str, output_dir: Optional[str] = None
+) -> Dict[str, Any]:
+    """保存论文的Markdown，返回markdown_file路径
+
+    默认保存到生成文件存储并同时返回artifact（id、文件名、大小和下载地址），
+    指定output_dir（批量生成）时以论文标题为文件名写入该目录。
+    """
+    filename = f"{safe_filename(title)}.md"
+    if output_dir is None:
+        artifact = await asyncio.to_thread(
+            artifact_store.put_bytes, markdown.encode("utf-8"), filename
+        )
+        return {
+            "markdown_file": await asyncio.to_thread(
+                artifact_store.path, artifact["id"]
+            ),
+            "artifact": artifact,
+        }
+    md_file = os.path.join(output_dir, filename)
+    with open(md_file, "w", encoding="utf-8") as f:
+        f.write(markdown)
+    return {"markdown_file": md_file}
+
+
+def start_export(
+    job: Job,
+    md_file: str,
+    formats: List[str],
+    backend: str,
+    output_dir: Optional[str] = None,
+) -> asyncio.Task:
+    """在后台导出论文，各格式的进度写入job.status["export"]"""
+    export_status = job.status["export"]
+    for fmt in formats:
+        export_status[fmt] = {"state": "pending"}
+
+    def _on_progress(fmt: str, info: Dict[str, Any]):
+        export_status[fmt] = info
+        job.publish("export", {"format": fmt, **info})
+
+    job.export_task = asyncio.create_task(
+        paper_exporter.export(
+            md_file,
+            safe_filename(job.config.title),
+            formats,
+            job.config.title,
+            job.sections,
+            backend=backend,
+            on_progress=_on_progress,
+            output_dir=output_dir,
+        )
+    )
+    return job.export_task
+
+
+async def stream_outline_nodes(lines: AsyncIterable[str]) -> AsyncIterator[OutlineNode]:
+    """逐条解析流式生成的大纲，条目的编号和是否需要生成正文确定后立即产生
+
+    条目是否有下级章节要等下一条到达才能确定，因此每个条目在下一条到达（或大纲结束）时产生；
+    编号修复只依赖之前的条目，结果与完整解析一致。
+    """
+    received: List[str] = []
+    async for line in lines:
+        received.append(line)
+        if len(received) > 1:
+            yield OutlineTree.parse(received).nodes[-2]
+    if received:
+        yield OutlineTree.parse(received).nodes[-1]
+
+
+async def run_paper_generation(
+    job: Job,
+    scheduler: Optional[SectionScheduler] = None,
+    output_dir: Optional[str] = None,
+) -> Dict[str, Any]:
+    """生成整篇论文，进度写入job.status
+
+    批量生成时可传入共享的scheduler，使多篇论文共用同一个并发控制器和预算。
+    一键生成（config.auto_outline）且没有大纲时，先生成缺少的标题，再流式生成大纲，
+    每解析出一个需要正文的章节就交给调度器，大纲生成与章节生成重叠进行。
+    """
+    config = job.config
+    model_config = job.model_config
+    paper_generation_status = job.status
+    pipelined = config.auto_outline and not config.outline
+
+    # 本次生成（包括章节子任务和后台导出）的日志都带上job_id
+    log_token = bind_job(job.job_id)
+    try:
+        # 只有叶子章节调用模型，上级章节在本地输出标题；流式生成大纲时条目逐个加入
+        tree = OutlineTree.parse(config.outline, config.content_sections)
+        outline = tree.lines()
+        content_nodes = tree.content_nodes()
+        if pipelined:
+            logger.info("Streaming outline, sections start as entries arrive")
+        else:
+            logger.info(
+                "Outline length: %d, %d sections need content, %d entries renumbered",
+                len(outline),
+                len(content_nodes),
+                tree.repaired,
+            )
+
+        # 初始化生成状态，进度按需要调用模型的章节计算
+        paper_generation_status.update(
+            {
+                "is_generating": True,
+                "total_sections": len(content_nodes),
+                "completed_sections": 0,
+                "current_section": content_nodes[0].text if content_nodes else "",
+                "completed_content": [],
+                "start_time": time.time(),
+                "estimated_time_remaining": None,
+                "retries": 0,
+                "concurrency_limit": model_config.concurrent_requests,
+                "prompt_tokens": {
+                    "full": 0,
+                    "sent": 0,
+                    "saved": 0,
+                    "upstream": 0,
+                    "cached": 0,
+                },
+                # 任务被取消时中止的在途模型请求数
+                "aborted_calls": 0,
+                "resumed_sections": 0,
+                # 流式生成大纲时total_sections随条目到达而增加，大纲完整后为True
+                "outline_complete": not pipelined,
+            }
+        )
+
+        client = OpenAIClient(job.api_config, model_config)
+        if pipelined and not config.title:
+            config.title = await client.generate_title(config.topic, model_config)
+            logger.info("Generated title: %s", config.title)
+
+        # 粗略估算单次请求的token数：提示词不超过chunk_size，再加上max_tokens
+        outline_tokens = min(count_tokens("\n".join(outline)), model_config.chunk_size)
+
+        def _estimate_tokens(section: str) -> int:
+            return outline_tokens + count_tokens(section) + model_config.max_tokens
+
+        if scheduler is None:
+            # 同一上游的任务共享并发控制器和预算，一个任务遇到429时其他任务也会收缩
+            upstream = get_upstream(
+                job.api_config.base_url,
+                model_config.concurrent_requests,
+                model_config.requests_per_minute,
+                model_config.tokens_per_minute,
+            )
+            scheduler = SectionScheduler(
+                model_config.concurrent_requests,
+                retry_policy=RetryPolicy(max_retries=model_config.max_retries),
+                budget=upstream.budget,
+                limiter=upstream.limiter,
+            )
+
+        async def _start_checkpoint(outline_hash: str):
+            await checkpoint_journal.start(
+                job.job_id,
+                outline_hash,
+                {
+                    "tenant": job.tenant,
+                    "config": config.model_dump(exclude={"api_config", "model_params"}),
+                    "model_config": model_config.model_dump(),
+                    # 不保存API密钥，恢复时由请求重新提供
+                    "api_config": {
+                        "base_url": job.api_config.base_url,
+                        "model_name": job.api_config.model_name,
+                    },
+                },
+            )
+
+        # 每完成一个章节写入检查点；同一任务恢复运行时复用大纲未变化的已完成章节。
+        # 流式生成大纲时大纲哈希要等大纲完整后才能计算，此前完成的章节暂存在unsaved中
+        outline_hash: Optional[str] = None
+        unsaved: List[Tuple[int, str, str]] = []
+        restored: Dict[int, Dict[str, Any]] = {}
+        previous: Dict[int, str] = {}
+        if not pipelined:
+            outline_hash = checkpoint_journal.outline_hash(
+                config.topic, config.title, outline
+            )
+            restored = await checkpoint_journal.load_sections(job.job_id, outline_hash)
+            # 重新生成指定章节时，现有内容作为修改的基础
+            previous = {
+                index: restored.pop(index)["content"]
+                for index in config.regenerate_sections
+                if index in restored
+            }
+            if job.store is not None:
+                # 接手其他进程的任务时，复用已写入共享存储的章节
+                for index, content in (
+                    await job.store.done_sections(job.job_id)
+                ).items():
+                    restored.setdefault(index, {"content": content})
+            await _start_checkpoint(outline_hash)
+
+        # 上级章节的标题以及检查点中已有的章节直接作为已完成的内容
+        sections: List[str] = []
+        pending_nodes: List[OutlineNode] = []
+
+        def _add_node(node: OutlineNode) -> bool:
+            """按大纲顺序登记一个条目，返回是否需要调用模型生成正文"""
+            sections.append(node.heading())
+            if node.needs_content and node.index in restored:
+                sections[node.index] = section_content(
+                    node, restored[node.index]["content"]
+                )
+                paper_generation_status["completed_sections"] += 1
+            elif node.needs_content:
+                pending_nodes.append(node)
+                return True
+            paper_generation_status["completed_content"].append(
+                {
+                    "index": node.index,
+                    "title": node.text,
+                    "content": sections[node.index],
+                }
+            )
+            job.publish(
+                "section_done",
+                {
+                    "index": node.index,
+                    "title": node.text,
+                    "content": sections[node.index],
+                },
+            )
+            return False
+
+        for node in tree.nodes:
+            _add_node(node)
+        if job.store is not None:
+            # 登记待生成的章节，其他进程空闲时可以认领；重新生成的章节依赖本地的旧内容，不参与协作
+            await job.store.create_sections(
+                job.job_id,
+                [
+                    (node.index, node.text)
+                    for node in pending_nodes
+                    if node.index not in previous
+                ],
+            )
+        if previous:
+            logger.info("Regenerating %d sections", len(previous))
+        resumed = paper_generation_status["completed_sections"]
+        paper_generation_status["resumed_sections"] = resumed
+        if resumed:
+            logger.info("Resumed %d sections from checkpoint", resumed)
+
+        # 已开始生成的章节序号，流式大纲完整后其余章节才登记给其他进程
+        started = set()
+
+        # 前缀缓存布局下先只发出第一个章节，收到首个token（上游已完成预填充并缓存前缀）后
+        # 再发出其余章节，否则同时到达的请求都无法命中缓存；非流式请求无法得知预填充完成，不等待
+        prefix_ready: Optional[asyncio.Event] = None
+        if (
+            model_config.prefix_cache
+            and model_config.stream_sections
+            and not pipelined
+            and len(pending_nodes) > 1
+        ):
+            prefix_ready = asyncio.Event()
+
+        async def _stream_sections() -> AsyncIterator[str]:
+            nonlocal outline_hash, outline_tokens
+            try:
+                async for node in stream_outline_nodes(
+                    client.stream_outline(config.topic, config.title, model_config)
+                ):
+                    outline.append(node.text)
+                    outline_tokens = min(
+                        outline_tokens + count_tokens(node.text) + 1,
+                        model_config.chunk_size,
+                    )
+                    job.publish(
+                        "outline_entry", {"index": node.index, "title": node.text}
+                    )
+                    if _add_node(node):
+                        paper_generation_status["total_sections"] += 1
+                        yield node.text
+            except asyncio.CancelledError:
+                # 任务被取消，流式大纲请求随之中止
+                paper_generation_status["aborted_calls"] += 1
+                raise
+            if not outline:
+                raise ValueError("Outline generation returned no entries")
+
+            # 大纲完整：写入检查点头记录和之前暂存的章节，此后失败的任务按普通任务恢复
+            config.outline = list(outline)
+            outline_hash = checkpoint_journal.outline_hash(
+                config.topic, config.title, outline
+            )
+            await _start_checkpoint(outline_hash)
+            for index, section, content in unsaved:
+                await checkpoint_journal.append_section(
+                    job.job_id, outline_hash, index, section, content
+                )
+            unsaved.clear()
+            paper_generation_status["outline_complete"] = True
+            logger.info(
+                "Outline complete: %d entries, %d sections need content, %d started",
+                len(outline),
+                len(pending_nodes),
+                len(started),
+            )
+            if job.store is not None:
+                # 保存完整大纲，其他进程据此协助生成尚未开始的章节，或在本进程退出后接手任务
+                await job.store.save_job(
+                    job.job_id, {"spec": job.spec()}, [], owner=WORKER_ID
+                )
+                await job.store.create_sections(
+                    job.job_id,
+                    [
+                        (node.index, node.text)
+                        for node in pending_nodes
+                        if node.index not in started
+                    ],
+                )
+
+        async def _prefix_first(items: List[str]) -> AsyncIterator[str]:
+            # 其余章节在调度器之外等待，共享调度器时不会占着并发槽位阻塞其他论文
+            yield items[0]
+            try:
+                await asyncio.wait_for(prefix_ready.wait(), PREFIX_WARMUP_TIMEOUT)
+            except asyncio.TimeoutError:
+                logger.debug("Prefix warm-up timed out, sending remaining sections")
+            for item in items[1:]:
+                yield item
+
+        async def _generate(position: int, section: str) -> str:
+            index = pending_nodes[position].index
+            try:
+                return await _generate_section(position, index, section)
+            finally:
+                # 第一个章节失败时也不再让其余章节等待
+                if position == 0 and prefix_ready is not None:
+                    prefix_ready.set()
+
+        async def _generate_section(position: int, index: int, section: str) -> str:
+            on_delta = None
+            if model_config.stream_sections:
+                # 流式生成时把增量文本按章节序号推送给订阅者
+                def on_delta(text: str):
+                    if position == 0 and prefix_ready is not None:
+                        prefix_ready.set()
+                    job.publish("delta", {"index": index, "text": text})
+
+            def on_prompt_tokens(full_tokens: int, sent_tokens: int):
+                prompt_tokens = paper_generation_status["prompt_tokens"]
+                prompt_tokens["full"] += full_tokens
+                prompt_tokens["sent"] += sent_tokens
+                prompt_tokens["saved"] = prompt_tokens["full"] - prompt_tokens["sent"]
+                # 每个章节一条，数量多时抽样输出
+                logger.debug(
+                    "Section %d prompt %d tokens (saved %d of %d)",
+                    index,
+                    sent_tokens,
+                    full_tokens - sent_tokens,
+                    full_tokens,
+                    extra={"sample_every": LOG_SAMPLE_EVERY},
+                )
+
+            def on_usage(
+                prompt_tokens: int, completion_tokens: int, cached_tokens: int
+            ):
+                # 上游实际计费的提示词token数，以及其中命中前缀缓存的部分
+                usage = paper_generation_status["prompt_tokens"]
+                usage["upstream"] += prompt_tokens
+                usage["cached"] += cached_tokens
+
+            section_config = model_config
+            custom_prompt = None
+            if index in config.regenerate_sections:
+                # 重新生成的章节不能直接返回缓存中的旧内容
+                section_config = model_config.model_copy(update={"refresh_cache": True})
+                custom_prompt = config.custom_prompt
+
+            shared = job.store is not None and index not in previous
+            content = None
+            if shared:
+                content = await claim_section(job.store, job.job_id, index)
+            if content is None:
+                # 流式生成大纲时，章节提示词中的大纲是此刻已到达的部分
+                try:
+                    content = await generate_paper_section(
+                        client,
+                        config.topic,
+                        config.title,
+                        outline,
+                        section,
+                        section_config,
+                        on_delta=on_delta,
+                        section_index=index,
+                        on_prompt_tokens=on_prompt_tokens,
+                        custom_prompt=custom_prompt,
+                        current_content=previous.get(index),
+                        on_usage=on_usage,
+                    )
+                except asyncio.CancelledError:
+                    # 任务被取消，请求随之中止
+                    paper_generation_status["aborted_calls"] += 1
+                    raise
+                if shared:
+                    await job.store.complete_section(job.job_id, index, content)
+            if outline_hash is None:
+                unsaved.append((index, section, content))
+            else:
+                await checkpoint_journal.append_section(
+                    job.job_id, outline_hash, index, section, content
+                )
+            return content
+
+        def _on_start(position: int, section: str):
+            index = pending_nodes[position].index
+            started.add(index)
+            paper_generation_status["current_section"] = section
+            job.publish("section_start", {"index": index, "title": section})
+
+        def _on_complete(position: int, section: str, content: str):
+            node = pending_nodes[position]
+            index = node.index
+            content = section_content(node, content)
+            sections[index] = content
+            # 按完成顺序记录章节，index用于还原大纲顺序
+            paper_generation_status["completed_sections"] += 1
+            paper_generation_status["completed_content"].append(
+                {"index": index, "title": section, "content": content}
+            )
+
+            paper_generation_status["concurrency_limit"] = int(scheduler.limiter.limit)
+
+            # 计算预估剩余时间，大纲未完整时章节总数未知
+            elapsed_time = time.time() - paper_generation_status["start_time"]
+            completed = paper_generation_status["completed_sections"]
+            remaining_sections = paper_generation_status["total_sections"] - completed
+            # 同时有多个章节在途，按本次运行的吞吐量估算剩余时间
+            paper_generation_status["estimated_time_remaining"] = (
+                elapsed_time / (completed - resumed) * remaining_sections
+                if paper_generation_status["outline_complete"]
+                else None
+            )
+
+            job.publish(
+                "section_done", {"index": index, "title": section, "content": content}
+            )
+            job.publish(
+                "progress",
+                {
+                    "completed_sections": completed,
+                    "total_sections": paper_generation_status["total_sections"],
+                    "estimated_time_remaining": paper_generation_status[
+                        "estimated_time_remaining"
+                    ],
+                },
+            )
+
+        def _on_retry(position: int, section: str, error: Exception, delay: float):
+            index = pending_nodes[position].index
+            paper_generation_status["retries"] += 1
+            SECTION_RETRIES.inc(status=error_status(error) or "unknown")
+            paper_generation_status["concurrency_limit"] = int(scheduler.limiter.limit)
+            # 限流时重试会集中出现，抽样输出
+            logger.warning(
+                "Retrying section %d in %.1fs (concurrency limit %d): %s",
+                index,
+                delay,
+                int(scheduler.limiter.limit),
+                getattr(error, "detail", None) or str(error),
+                extra={"sample_every": LOG_SAMPLE_EVERY},
+            )
+            # 流式输出的部分内容作废，前端据此清空该章节
+            job.publish("section_retry", {"index": index, "title": section})
+
+        if pipelined or prefix_ready is not None:
+            await scheduler.run_stream(
+                (
+                    _stream_sections()
+                    if pipelined
+                    else _prefix_first([node.text for node in pending_nodes])
+                ),
+                _generate,
+                on_start=_on_start,
+                on_complete=_on_complete,
+                on_retry=_on_retry,
+                estimate_tokens=_estimate_tokens,
+            )
+        else:
+            await scheduler.run(
+                [node.text for node in pending_nodes],
+                _generate,
+                on_start=_on_start,
+                on_complete=_on_complete,
+                on_retry=_on_retry,
+                estimate_tokens=_estimate_tokens,
+            )
+        logger.info(
+            "Completed %d sections with %d retries",
+            len(pending_nodes),
+            paper_generation_status["retries"],
+        )
+        elapsed_time = time.time() - paper_generation_status["start_time"]
+        JOB_DURATION.observe(elapsed_time)
+        if pending_nodes and elapsed_time > 0:
+            JOB_SECTIONS_PER_MINUTE.observe(len(pending_nodes) / elapsed_time * 60)
+
+        # 合并所有章节
+        job.sections = sections
+        full_paper = "\n\n".join(sections)
+        logger.info("Generated full paper with %d characters", len(full_paper))
+
+        saved = await save_markdown(
+            config.title, assemble_markdown(config.title, sections), output_dir
+        )
+        md_file = saved["markdown_file"]
+        logger.info("Saved paper to %s", md_file)
+
+        # Markdown写入后立即返回结果，导出在后台进行
+        start_export(
+            job, md_file, config.export_formats, config.export_backend, output_dir
+        )
+
+        # 完成生成
+        paper_generation_status["is_generating"] = False
+        logger.info("Paper generation completed")
+
+        return {"paper": full_paper, **saved}
+    except (Exception, asyncio.CancelledError):
+        # 失败或被取消时已完成的章节保留在状态和检查点中，可通过恢复接口继续生成
+        paper_generation_status["is_generating"] = False
+        raise
+    finally:
+        job_context.reset(log_token)
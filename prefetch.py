@@ -0,0 +1,162 @@
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from metrics import SECTIONS_QUEUED, SPECULATIVE_RESULTS
+
+logger = logging.getLogger(__name__)
+
+
+class _Speculation:
+    def __init__(self, factory: Callable[[], Awaitable[Any]]):
+        self.factory = factory
+        self.created_at = time.monotonic()
+        # 取得运行槽位、开始请求模型后为True
+        self.started = False
+        self.task: Optional[asyncio.Task] = None
+
+
+class SpeculativeStore:
+    """按会话保存推测执行的结果
+
+    用户还没做出选择时，服务端先在后台执行下一步最可能的请求（如为标题建议生成大纲），
+    同一会话随后发来的相同请求直接取用结果。推测请求的优先级低于论文任务：同时运行的
+    推测请求数受max_concurrency限制，is_busy返回True（章节在排队等待槽位）时不再开始
+    新的推测请求。每个会话最多保留max_entries个结果，超过ttl秒的结果和最久未使用的
+    会话（超过max_sessions时）被淘汰，淘汰时取消仍在运行的请求。
+    """
+
+    def __init__(
+        self,
+        ttl: float = 600,
+        max_sessions: int = 256,
+        max_entries: int = 4,
+        max_concurrency: int = 2,
+        is_busy: Optional[Callable[[], bool]] = None,
+    ):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.max_entries = max_entries
+        self.max_concurrency = max(1, max_concurrency)
+        self.is_busy = is_busy
+        self._sessions: "OrderedDict[str, OrderedDict[str, _Speculation]]" = (
+            OrderedDict()
+        )
+        self._slots: Optional[asyncio.Semaphore] = None
+
+    @staticmethod
+    def _discard(speculation: _Speculation, result: str):
+        if speculation.task is not None and not speculation.task.done():
+            speculation.task.cancel()
+            SPECULATIVE_RESULTS.inc(result=result)
+
+    def _evict(self):
+        now = time.monotonic()
+        for session in list(self._sessions):
+            entries = self._sessions[session]
+            for key in list(entries):
+                if now - entries[key].created_at > self.ttl:
+                    self._discard(entries.pop(key), "expired")
+            if not entries:
+                del self._sessions[session]
+
+    async def _run(self, speculation: _Speculation) -> Any:
+        if self._slots is None:
+            # 信号量需在服务的事件循环中创建
+            self._slots = asyncio.Semaphore(self.max_concurrency)
+        async with self._slots:
+            if self.is_busy is not None and self.is_busy():
+                SPECULATIVE_RESULTS.inc(result="skipped")
+                return None
+            speculation.started = True
+            return await speculation.factory()
+
+    @staticmethod
+    def _on_done(task: asyncio.Task):
+        # 推测请求失败不影响用户，取出异常避免未处理的警告
+        if not task.cancelled() and task.exception() is not None:
+            logger.debug("Speculative request failed: %s", task.exception())
+
+    def submit(
+        self, session: str, key: str, factory: Callable[[], Awaitable[Any]]
+    ) -> bool:
+        """在后台执行factory()，结果以key保存在会话中；已有相同key时不重复执行"""
+        self._evict()
+        entries = self._sessions.setdefault(session, OrderedDict())
+        self._sessions.move_to_end(session)
+        if key in entries:
+            return False
+        while len(entries) >= self.max_entries:
+            self._discard(entries.popitem(last=False)[1], "expired")
+        while len(self._sessions) > self.max_sessions:
+            _, evicted = self._sessions.popitem(last=False)
+            for speculation in evicted.values():
+                self._discard(speculation, "expired")
+
+        speculation = _Speculation(factory)
+        speculation.task = asyncio.create_task(self._run(speculation))
+        speculation.task.add_done_callback(self._on_done)
+        entries[key] = speculation
+        return True
+
+    async def commit(self, session: str, key: str) -> Optional[Any]:
+        """用户已做出选择：取出key的推测结果并取消会话中其余的推测请求
+
+        结果已完成时直接返回，正在请求模型时等待其完成；没有结果、推测失败或尚未开始时
+        返回None，由调用方正常请求。
+        """
+        self._evict()
+        entries = self._sessions.get(session)
+        if not entries:
+            # 会话没有推测过，不计入命中率
+            return None
+        speculation = entries.pop(key, None)
+        self.cancel(session)
+        if speculation is None:
+            SPECULATIVE_RESULTS.inc(result="miss")
+            return None
+        task = speculation.task
+        if not task.done() and not speculation.started:
+            # 还在等待槽位，直接请求比排在其他推测请求后面更快
+            self._discard(speculation, "cancelled")
+            SPECULATIVE_RESULTS.inc(result="miss")
+            return None
+        try:
+            result = await task
+        except Exception:
+            result = None
+        SPECULATIVE_RESULTS.inc(result="miss" if result is None else "hit")
+        return result
+
+    def cancel(self, session: str) -> int:
+        """取消会话中的推测请求并丢弃结果，返回取消的请求数"""
+        entries = self._sessions.pop(session, None) or {}
+        running = [s for s in entries.values() if not s.task.done()]
+        for speculation in running:
+            self._discard(speculation, "cancelled")
+        return len(running)
+
+    def stats(self) -> Dict[str, int]:
+        self._evict()
+        return {
+            "sessions": len(self._sessions),
+            "entries": sum(len(entries) for entries in self._sessions.values()),
+            "running": sum(
+                1
+                for entries in self._sessions.values()
+                for s in entries.values()
+                if s.started and not s.task.done()
+            ),
+        }
+
+
+# 全局推测结果存储：章节在排队等待时不开始新的推测请求
+speculative_store = SpeculativeStore(
+    ttl=float(os.getenv("SPECULATIVE_TTL", "600")),
+    max_sessions=int(os.getenv("SPECULATIVE_MAX_SESSIONS", "256")),
+    max_concurrency=int(os.getenv("SPECULATIVE_MAX_CONCURRENCY", "2")),
+    is_busy=lambda: SECTIONS_QUEUED.value() > 0,
+)
@@ -0,0 +1,139 @@
+import functools
+import math
+import re
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from outline import outline_level
+
+# 每条消息除内容外的固定开销（role、分隔符等）
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# 中日韩字符及全角标点，大致每个字符一个token
+_CJK_RE = re.compile(r"[\u3000-\u303f\u3400-\u9fff\uf900-\ufaff\uff00-\uffef]")
+
+# 超出预算时依次尝试的压缩级别：先去掉同级章节，再去掉一级标题，最后去掉相邻章节
+_COMPACTION_LEVELS = [
+    {"siblings": True, "top_level": True, "neighbours": True},
+    {"siblings": False, "top_level": True, "neighbours": True},
+    {"siblings": False, "top_level": False, "neighbours": True},
+    {"siblings": False, "top_level": False, "neighbours": False},
+]
+
+# 被折叠的大纲条目用省略号占位，提示模型此处还有其他章节
+ELLIPSIS = "..."
+
+
+@functools.lru_cache(maxsize=None)
+def _get_encoding():
+    """安装了tiktoken时精确计数，否则返回None并改用估算"""
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        # 编码文件需要联网下载，失败时同样退回估算
+        return None
+
+
+def count_tokens(text: str) -> int:
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    # 估算：中文每字约一个token，其他字符约四个一个token
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+
+def count_message_tokens(messages: List[Dict[str, Any]]) -> int:
+    return sum(
+        count_tokens(message["content"]) + MESSAGE_OVERHEAD_TOKENS
+        for message in messages
+    )
+
+
+def compact_outline(
+    outline: List[str],
+    index: int,
+    siblings: bool = True,
+    top_level: bool = True,
+    neighbours: bool = True,
+) -> List[str]:
+    """以第index个条目为中心压缩大纲
+
+    保留当前章节的所有上级标题、同级章节和前后相邻条目，其余部分只保留一级标题，
+    被省略的连续条目用一个省略号代替。
+    """
+    levels = [outline_level(line) for line in outline]
+    keep = {index}
+
+    # 上级标题：向前查找层级逐级变浅的条目
+    level = levels[index]
+    for j in range(index - 1, -1, -1):
+        if level == 1:
+            break
+        if levels[j] < level:
+            keep.add(j)
+            level = levels[j]
+
+    if neighbours:
+        keep.update(j for j in (index - 1, index + 1) if 0 <= j < len(outline))
+
+    if siblings:
+        # 同级章节：同一上级标题下层级相同的条目
+        own_level = levels[index]
+        for step in (-1, 1):
+            j = index + step
+            while 0 <= j < len(outline) and levels[j] >= own_level:
+                if levels[j] == own_level:
+                    keep.add(j)
+                j += step
+
+    if top_level:
+        keep.update(j for j, level in enumerate(levels) if level == 1)
+
+    lines = []
+    previous = -1
+    for j in sorted(keep):
+        if j > previous + 1:
+            lines.append(ELLIPSIS)
+        lines.append(outline[j])
+        previous = j
+    if previous < len(outline) - 1:
+        lines.append(ELLIPSIS)
+    return lines
+
+
+def fit_section_outline(
+    outline: List[str],
+    index: Optional[int],
+    count_prompt_tokens: Callable[[str], int],
+    budget: int,
+    compact: bool = True,
+) -> Tuple[str, int, int]:
+    """选出放入章节提示词的大纲文本
+
+    count_prompt_tokens根据大纲文本计算整条请求的提示词token数。
+    compact为True时总是压缩大纲，否则只在完整大纲超出budget时压缩；
+    压缩级别逐步提高，直到不超过budget或无法再压缩。
+    返回(大纲文本, 完整大纲的token数, 实际发送的token数)。
+    """
+    full_text = "\n".join(outline)
+    full_tokens = count_prompt_tokens(full_text)
+    # 找不到当前章节时无法确定上下文，只能发送完整大纲
+    if index is None or not 0 <= index < len(outline):
+        return full_text, full_tokens, full_tokens
+    if not compact and full_tokens <= budget:
+        return full_text, full_tokens, full_tokens
+
+    text, tokens = full_text, full_tokens
+    for options in _COMPACTION_LEVELS:
+        text = "\n".join(compact_outline(outline, index, **options))
+        tokens = count_prompt_tokens(text)
+        if tokens <= budget:
+            break
+    # 条目很少时省略号反而可能更长
+    if tokens >= full_tokens:
+        return full_text, full_tokens, full_tokens
+    return text, full_tokens, tokens
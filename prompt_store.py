@@ -0,0 +1,324 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import string
+from typing import Any, Dict, Optional
+
+from state_store import StateStore
+from utils import current_dir
+
+logger = logging.getLogger(__name__)
+
+# 默认模板
+DEFAULT_PROMPT_TEMPLATES = {
+    "title_prompt": "作为一个学术论文专家，请为以下主题生成一个专业的学术论文标题：\n主题：{topic}\n要求：\n1. 标题要专业、准确\n2. 标题要有学术性\n3. 标题长度适中\n请直接返回标题，不需要其他解释。",
+    "title_suggestions_prompt": "作为一个学术论文专家，请为以下主题生成4个不同的专业学术论文标题建议：\n主题：{topic}\n要求：\n1. 标题要专业、准确\n2. 标题要有学术性\n3. 标题长度适中\n4. 每个标题要有不同的角度或侧重点\n请直接返回4个标题，每行一个，不需要编号或其他解释。",
+    "outline_prompt": "作为一个学术论文专家，请为以下论文生成详细的目录大纲：\n主题：{topic}\n标题：{title}\n要求：\n1. 使用标准的学术论文结构\n2. 包含引言、文献综述、研究方法、结果分析、结论等主要部分\n3. 每个部分要有详细的子目录\n4. 严格按照以下格式标记层级：\n   - 第一级标题使用数字加点，如：1. 引言\n   - 第二级标题使用数字加点，如：1.1 研究背景\n   - 第三级标题使用数字加点，如：1.1.1 研究问题\n   - 确保每个编号后有一个空格\n   - 不要使用其他格式的编号\n\n请直接返回目录大纲，每行一个条目，确保层级清晰。",
+    "section_prompt": "作为一个学术论文专家，请为以下论文生成一个章节的详细内容：\n主题：{topic}\n标题：{title}\n大纲：{outline_text}\n当前章节：{section}\n要求：\n1. 内容要专业、准确、有深度\n2. 使用学术语言和适当的术语\n3. 如果是方法或结果部分，要有具体的数据和分析\n4. 如果是引言或结论，要有清晰的论点和总结\n请直接返回该章节的完整内容，使用Markdown格式。",
+    # 前缀缓存布局（模型配置prefix_cache）：同一篇论文的所有章节请求共用section_context_prompt，
+    # 只有最后的section_task_prompt不同
+    "section_context_prompt": "作为一个学术论文专家，请为以下论文逐章生成详细内容：\n主题：{topic}\n标题：{title}\n大纲：\n{outline_text}\n要求：\n1. 内容要专业、准确、有深度\n2. 使用学术语言和适当的术语\n3. 如果是方法或结果部分，要有具体的数据和分析\n4. 如果是引言或结论，要有清晰的论点和总结\n每次只生成指定的一个章节，直接返回该章节的完整内容，使用Markdown格式。",
+    "section_task_prompt": "当前章节：{section}",
+    "format_requirements": {
+        "title": ["标题要专业、准确", "标题要有学术性", "标题长度适中"],
+        "title_suggestions": [
+            "每个标题要有不同的角度或侧重点",
+            "生成4个不同的标题建议",
+        ],
+        "outline": [
+            "使用标准的学术论文结构",
+            "包含引言、文献综述、研究方法、结果分析、结论等主要部分",
+            "每个部分要有详细的子目录",
+            "严格使用数字编号格式：1., 1.1, 1.1.1等，确保每个编号后有一个空格",
+        ],
+        "section": [
+            "内容要专业、准确、有深度",
+            "使用学术语言和适当的术语",
+            "如果是方法或结果部分，要有具体的数据和分析",
+            "如果是引言或结论，要有清晰的论点和总结",
+        ],
+    },
+}
+
+# 每个模板允许使用的占位符
+TEMPLATE_FIELDS = {
+    "title_prompt": {"topic"},
+    "title_suggestions_prompt": {"topic"},
+    "outline_prompt": {"topic", "title"},
+    "section_prompt": {"topic", "title", "outline_text", "section"},
+}
+# 可选模板，缺少时使用默认模板（兼容之前保存的模板文件）
+OPTIONAL_TEMPLATE_FIELDS = {
+    "section_context_prompt": {"topic", "title", "outline_text"},
+    "section_task_prompt": {"section"},
+}
+
+# 各类提示对应的系统角色
+SYSTEM_ROLES = {
+    "title": "学术论文标题生成助手",
+    "title_suggestions": "学术论文标题生成助手",
+    "outline": "学术论文大纲生成助手",
+    "section": "学术论文内容生成助手",
+}
+
+# 额外的输出格式要求
+OUTPUT_REQUIREMENTS = {
+    "title": "只返回标题本身，不需要其他解释",
+    "title_suggestions": "每行一个标题，不需要编号或其他解释",
+    "outline": "直接返回目录大纲，不需要其他解释",
+    "section": "直接返回该章节的完整内容，不需要其他解释",
+}
+
+
+def template_version(templates: Dict[str, Any]) -> str:
+    """模板内容的版本号，内容不变则版本号不变，用作缓存键"""
+    payload = json.dumps(templates, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()[:12]
+
+
+def validate_templates(templates: Any):
+    """检查必需的模板及其占位符，不合法时抛出ValueError"""
+    if not isinstance(templates, dict):
+        raise ValueError("Prompt templates must be a JSON object")
+    for key, fields in {**TEMPLATE_FIELDS, **OPTIONAL_TEMPLATE_FIELDS}.items():
+        if key not in templates:
+            if key in OPTIONAL_TEMPLATE_FIELDS:
+                continue
+            raise ValueError(f"Missing required template: {key}")
+        template = templates[key]
+        if not isinstance(template, str):
+            raise ValueError(f"Template {key} must be a string")
+        try:
+            parsed = list(string.Formatter().parse(template))
+        except ValueError as e:
+            raise ValueError(f"Invalid template {key}: {e}")
+        for _, field_name, _, _ in parsed:
+            if field_name is None:
+                continue
+            name = field_name.split(".")[0].split("[")[0]
+            if name not in fields:
+                raise ValueError(f"Unknown placeholder {{{field_name}}} in {key}")
+
+    requirements = templates.get("format_requirements", {})
+    if not isinstance(requirements, dict) or not all(
+        isinstance(items, list) and all(isinstance(item, str) for item in items)
+        for items in requirements.values()
+    ):
+        raise ValueError("format_requirements must map prompt types to string lists")
+
+
+class PromptTemplates:
+    """某一版本的模板快照，创建后不再修改
+
+    创建时校验模板并预先构建各类系统提示，请求时直接取用，不再逐次拼接。
+    """
+
+    def __init__(self, templates: Dict[str, Any]):
+        validate_templates(templates)
+        # 深拷贝一份，调用方之后修改传入的字典不会影响快照
+        self._data = json.loads(json.dumps(templates, ensure_ascii=False))
+        self.version = template_version(self._data)
+        self._system_prompts = {
+            prompt_type: self._build_system_prompt(prompt_type)
+            for prompt_type in SYSTEM_ROLES
+        }
+
+    def _build_system_prompt(self, prompt_type: str) -> str:
+        """从format_requirements构建系统提示"""
+        format_requirements = self._data.get("format_requirements", {})
+        role = SYSTEM_ROLES.get(prompt_type, "学术论文助手")
+
+        if prompt_type in ["title", "title_suggestions"]:
+            # 标题类型的提示都需要包含标题的基本要求
+            requirements = list(format_requirements.get("title", []))
+            # 如果是标题建议，还需要添加特定要求
+            if prompt_type == "title_suggestions":
+                requirements += format_requirements.get("title_suggestions", [])
+        else:
+            requirements = list(format_requirements.get(prompt_type, []))
+
+        if prompt_type in OUTPUT_REQUIREMENTS:
+            requirements.append(OUTPUT_REQUIREMENTS[prompt_type])
+
+        system_prompt = f"你是一个专业的{role}。\n请遵循以下格式要求："
+        for i, requirement in enumerate(requirements, 1):
+            system_prompt += f"\n{i}. {requirement}"
+        return system_prompt
+
+    def system_prompt(self, prompt_type: str) -> str:
+        prompt = self._system_prompts.get(prompt_type)
+        if prompt is None:
+            prompt = self._build_system_prompt(prompt_type)
+        return prompt
+
+    def render(self, name: str, **fields: Any) -> str:
+        template = self._data.get(name)
+        if template is None:
+            template = DEFAULT_PROMPT_TEMPLATES[name]
+        return template.format(**fields)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return json.loads(json.dumps(self._data, ensure_ascii=False))
+
+
+# 模板在共享状态存储中的键
+SHARED_KEY = "prompt_templates"
+
+
+class PromptTemplateStore:
+    """带版本的模板存储
+
+    current是当前版本的不可变快照，更新时整体替换，正在使用旧快照的请求不受影响；读取它不
+    访问文件或存储。start()后由后台任务每隔reload_interval秒检查模板文件，被外部修改后重新
+    加载，内容不合法时保留当前版本。指定shared时模板同时保存在共享状态存储中，任一工作进程
+    更新或重新加载的模板会在reload_interval秒内同步到其他进程，本地文件作为可直接编辑的副本。
+    文件读写在线程池中进行。
+    """
+
+    def __init__(
+        self,
+        path: str,
+        reload_interval: float = 1.0,
+        shared: Optional[StateStore] = None,
+    ):
+        self.path = path
+        self.reload_interval = reload_interval
+        self.shared = shared
+        self._mtime: Optional[int] = None
+        self.current = self._load_initial()
+        # 更新和重新加载依次进行，避免用旧版本覆盖刚更新的模板
+        self._lock = asyncio.Lock()
+        self._reload_task: Optional[asyncio.Task] = None
+
+    def _read(self) -> PromptTemplates:
+        with open(self.path, "r", encoding="utf-8") as f:
+            return PromptTemplates(json.load(f))
+
+    def _load_initial(self) -> PromptTemplates:
+        if not os.path.exists(self.path):
+            # 保存默认模板
+            templates = PromptTemplates(DEFAULT_PROMPT_TEMPLATES)
+            self._write(templates)
+            return templates
+        try:
+            self._mtime = os.stat(self.path).st_mtime_ns
+            return self._read()
+        except (OSError, ValueError) as e:
+            logger.warning(
+                "Invalid prompt templates in %s, using defaults: %s", self.path, e
+            )
+            return PromptTemplates(DEFAULT_PROMPT_TEMPLATES)
+
+    def _write(self, templates: PromptTemplates):
+        # 先写临时文件再替换，避免读到写了一半的模板
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(templates.to_dict(), f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+        self._mtime = os.stat(self.path).st_mtime_ns
+
+    async def _read_shared(self) -> Optional[PromptTemplates]:
+        value = await self.shared.get_value(SHARED_KEY)
+        if value is None:
+            return None
+        if value[1] == self.current.version:
+            return self.current
+        try:
+            return PromptTemplates(json.loads(value[0]))
+        except ValueError as e:
+            logger.warning("Ignoring invalid shared prompt templates: %s", e)
+            return None
+
+    async def _publish(self, templates: PromptTemplates):
+        if self.shared is not None:
+            await self.shared.put_value(
+                SHARED_KEY,
+                json.dumps(templates.to_dict(), ensure_ascii=False),
+                templates.version,
+            )
+
+    def _check_file(self) -> Optional[PromptTemplates]:
+        """模板文件被修改且内容合法时返回新版本；在线程池中运行"""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            mtime = self._mtime
+        if mtime == self._mtime:
+            return None
+        self._mtime = mtime
+        try:
+            templates = self._read()
+        except (OSError, ValueError) as e:
+            logger.warning("Ignoring invalid prompt templates in %s: %s", self.path, e)
+            return None
+        return templates if templates.version != self.current.version else None
+
+    async def _poll(self) -> Optional[PromptTemplates]:
+        """检查模板文件和共享存储，返回需要切换到的版本"""
+        templates = await asyncio.to_thread(self._check_file)
+        if templates is not None:
+            await self._publish(templates)
+            logger.info("Reloaded prompt templates (version %s)", templates.version)
+            return templates
+
+        if self.shared is None:
+            return None
+        # 其他工作进程更新的模板；共享存储中还没有模板时发布本进程的版本
+        shared_templates = await self._read_shared()
+        if shared_templates is None:
+            await self._publish(self.current)
+            return None
+        if shared_templates.version == self.current.version:
+            return None
+        try:
+            await asyncio.to_thread(self._write, shared_templates)
+        except OSError as e:
+            logger.warning("Failed to write prompt templates to %s: %s", self.path, e)
+        logger.info(
+            "Synced prompt templates from shared store (version %s)",
+            shared_templates.version,
+        )
+        return shared_templates
+
+    async def _reload_loop(self):
+        while True:
+            try:
+                async with self._lock:
+                    templates = await self._poll()
+                    if templates is not None:
+                        self.current = templates
+            except Exception as e:
+                logger.warning("Failed to reload prompt templates: %s", e)
+            await asyncio.sleep(self.reload_interval)
+
+    def start(self, shared: Optional[StateStore] = None):
+        """启动后台重新加载任务，首次检查时与共享存储同步；服务启动时调用
+
+        shared未在创建时指定时可以在这里传入，全局模板存储由此使用任务管理器的状态存储。
+        """
+        if shared is not None:
+            self.shared = shared
+        if self._reload_task is None:
+            self._reload_task = asyncio.create_task(self._reload_loop())
+
+    async def close(self):
+        if self._reload_task is not None:
+            self._reload_task.cancel()
+            await asyncio.gather(self._reload_task, return_exceptions=True)
+            self._reload_task = None
+
+    async def update(self, templates: Dict[str, Any]) -> PromptTemplates:
+        """校验并保存新模板，成功后立即生效；不合法时抛出ValueError"""
+        compiled = PromptTemplates(templates)
+        async with self._lock:
+            await asyncio.to_thread(self._write, compiled)
+            await self._publish(compiled)
+            self.current = compiled
+        logger.info("Updated prompt templates (version %s)", compiled.version)
+        return compiled
+
+
+# 全局模板存储
+prompt_store = PromptTemplateStore(os.path.join(current_dir, "prompt_templates.json"))
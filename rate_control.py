@@ -0,0 +1,304 @@
+import asyncio
+import logging
+import random
+import time
+from collections import OrderedDict
+from typing import Optional
+from urllib.parse import urlsplit, urlunsplit
+
+logger = logging.getLogger(__name__)
+
+# 可重试的上游状态码：限流与临时性服务端错误
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+# 这些状态码说明上游限流或过载，需要收缩并发
+THROTTLE_STATUS_CODES = {429, 500, 502, 503, 504}
+# 上游控制器多久没有发放槽位后从注册表中移除（秒），与路由器注册表的空闲时间一致
+UPSTREAM_IDLE_TIMEOUT = 900.0
+# 注册表中最多保留的上游数，超出时移除最久未使用的空闲上游
+MAX_UPSTREAMS = 256
+
+
+def error_status(error: Exception) -> Optional[int]:
+    """从异常中取出上游状态码（HTTPException或openai.APIStatusError）"""
+    return getattr(error, "status_code", None)
+
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    """解析Retry-After响应头（仅支持秒数形式）"""
+    headers = getattr(error, "headers", None)
+    if headers is None:
+        response = getattr(error, "response", None)
+        headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    value = headers.get("Retry-After") or headers.get("retry-after")
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+class AdaptiveConcurrencyLimiter:
+    """AIMD并发控制器
+
+    成功时并发上限按1/limit加性增长（大约每一轮增加1），遇到限流或过载时乘性减半，
+    两次收缩之间至少间隔cooldown秒，避免同一波错误把并发压到最低。
+    收到Retry-After时，在指定时间内暂停发放新的请求槽位。
+    """
+
+    def __init__(
+        self,
+        max_limit: int,
+        min_limit: int = 1,
+        decrease_factor: float = 0.5,
+        cooldown: float = 1.0,
+    ):
+        self.max_limit = max(1, max_limit)
+        self.min_limit = max(1, min(min_limit, self.max_limit))
+        self.decrease_factor = decrease_factor
+        self.cooldown = cooldown
+
+        self.limit = float(self.max_limit)
+        self.in_flight = 0
+        self.last_used = time.monotonic()
+        self._paused_until = 0.0
+        self._last_decrease = 0.0
+        self._cond = asyncio.Condition()
+
+    async def acquire(self):
+        async with self._cond:
+            while True:
+                delay = self._paused_until - time.monotonic()
+                if delay > 0:
+                    try:
+                        await asyncio.wait_for(self._cond.wait(), delay)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                if self.in_flight < int(self.limit):
+                    break
+                await self._cond.wait()
+            self.in_flight += 1
+            self.last_used = time.monotonic()
+
+    async def release(self):
+        async with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.release()
+
+    def raise_max(self, max_limit: int):
+        """提高并发上限；当前没有被收缩时直接放开到新的上限"""
+        if max_limit <= self.max_limit:
+            return
+        if self.limit >= self.max_limit:
+            self.limit = float(max_limit)
+        self.max_limit = max_limit
+
+    def on_success(self):
+        self.limit = min(float(self.max_limit), self.limit + 1.0 / self.limit)
+
+    def on_throttle(self, retry_after: Optional[float] = None):
+        now = time.monotonic()
+        if now - self._last_decrease >= self.cooldown:
+            self.limit = max(float(self.min_limit), self.limit * self.decrease_factor)
+            self._last_decrease = now
+        if retry_after:
+            self._paused_until = max(self._paused_until, now + retry_after)
+
+
+class TokenBucket:
+    """按分钟配额匀速补充的令牌桶"""
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.tokens = float(per_minute)
+        self.fill_rate = per_minute / 60.0
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self._updated) * self.fill_rate
+        )
+        self._updated = now
+
+    def set_rate(self, per_minute: int):
+        # 只会被调低：先按旧速率补充，再把已有令牌截断到新容量
+        self._refill()
+        self.capacity = float(per_minute)
+        self.tokens = min(self.tokens, self.capacity)
+        self.fill_rate = per_minute / 60.0
+
+    async def acquire(self, amount: float = 1.0):
+        # 单次请求超过桶容量时按容量计，避免永远等不到
+        amount = min(float(amount), self.capacity)
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.fill_rate)
+
+
+class RateBudget:
+    """单个上游（base_url）的每分钟请求数与token数预算"""
+
+    def __init__(
+        self,
+        requests_per_minute: Optional[int] = None,
+        tokens_per_minute: Optional[int] = None,
+    ):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._requests = (
+            TokenBucket(requests_per_minute) if requests_per_minute else None
+        )
+        self._tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+
+    def restrict(
+        self,
+        requests_per_minute: Optional[int] = None,
+        tokens_per_minute: Optional[int] = None,
+    ):
+        """合并另一个任务声明的配额：取更严格的值，未设置的配额视为不限"""
+        if requests_per_minute and (
+            not self.requests_per_minute
+            or requests_per_minute < self.requests_per_minute
+        ):
+            if self._requests:
+                self._requests.set_rate(requests_per_minute)
+            else:
+                self._requests = TokenBucket(requests_per_minute)
+            self.requests_per_minute = requests_per_minute
+        if tokens_per_minute and (
+            not self.tokens_per_minute or tokens_per_minute < self.tokens_per_minute
+        ):
+            if self._tokens:
+                self._tokens.set_rate(tokens_per_minute)
+            else:
+                self._tokens = TokenBucket(tokens_per_minute)
+            self.tokens_per_minute = tokens_per_minute
+
+    async def acquire(self, tokens: int = 0):
+        if self._requests:
+            await self._requests.acquire(1)
+        if self._tokens and tokens:
+            await self._tokens.acquire(tokens)
+
+
+def normalize_base_url(base_url: str) -> str:
+    """统一base_url的写法（协议和主机名小写，去掉末尾的"/"），同一上游只对应一个键"""
+    parts = urlsplit(base_url.strip())
+    return urlunsplit(
+        (
+            parts.scheme.lower(),
+            parts.netloc.lower(),
+            parts.path.rstrip("/"),
+            parts.query,
+            "",
+        )
+    )
+
+
+class UpstreamControl:
+    """单个上游共享的AIMD并发控制器和RPM/TPM预算
+
+    同一上游的所有任务共用，任一任务遇到429都会收缩其他任务的并发。
+    并发上限取各任务并发请求数的最大值（与连接池的大小一致），每个任务的工作协程数
+    仍不超过自己的并发请求数；配额不同时取最严格的值，因为它们限制的是同一个上游。
+    """
+
+    def __init__(self, base_url: str, concurrency: int):
+        self.base_url = base_url
+        self.limiter = AdaptiveConcurrencyLimiter(concurrency)
+        # 没有任务声明配额时预算为空，不做限制；之后加入的任务声明的配额对已在运行的任务同样生效
+        self.budget = RateBudget()
+
+    def join(
+        self,
+        concurrency: int,
+        requests_per_minute: Optional[int],
+        tokens_per_minute: Optional[int],
+    ):
+        budget = self.budget
+        declared = (budget.requests_per_minute, budget.tokens_per_minute)
+        self.limiter.raise_max(max(1, concurrency))
+        budget.restrict(requests_per_minute, tokens_per_minute)
+        if (requests_per_minute, tokens_per_minute) != declared and any(declared):
+            logger.warning(
+                "Conflicting rate limits for %s (rpm=%s, tpm=%s vs rpm=%s, tpm=%s), "
+                "using rpm=%s, tpm=%s",
+                self.base_url,
+                requests_per_minute,
+                tokens_per_minute,
+                declared[0],
+                declared[1],
+                budget.requests_per_minute,
+                budget.tokens_per_minute,
+            )
+
+
+# 按规范化的base_url共享的上游控制器
+_upstreams: "OrderedDict[str, UpstreamControl]" = OrderedDict()
+
+
+def _evict_upstreams(keep: str):
+    # 新建控制器时顺带清理：只移除没有在途请求的控制器，仍持有它的调度器可以继续使用，
+    # 只是不再与新任务共享并发和预算
+    now = time.monotonic()
+    for key, upstream in list(_upstreams.items()):
+        if key == keep or upstream.limiter.in_flight:
+            continue
+        idle = now - upstream.limiter.last_used
+        if len(_upstreams) > MAX_UPSTREAMS or idle > UPSTREAM_IDLE_TIMEOUT:
+            del _upstreams[key]
+
+
+def get_upstream(
+    base_url: str,
+    concurrency: int,
+    requests_per_minute: Optional[int] = None,
+    tokens_per_minute: Optional[int] = None,
+) -> UpstreamControl:
+    key = normalize_base_url(base_url)
+    upstream = _upstreams.get(key)
+    if upstream is None:
+        upstream = UpstreamControl(key, max(1, concurrency))
+        _upstreams[key] = upstream
+        _evict_upstreams(key)
+    else:
+        _upstreams.move_to_end(key)
+    upstream.limiter.last_used = time.monotonic()
+    upstream.join(concurrency, requests_per_minute, tokens_per_minute)
+    return upstream
+
+
+class RetryPolicy:
+    """带抖动的指数退避重试策略"""
+
+    def __init__(
+        self, max_retries: int = 5, base_delay: float = 1.0, max_delay: float = 60.0
+    ):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def should_retry(self, error: Exception, attempt: int) -> bool:
+        if attempt >= self.max_retries:
+            return False
+        return error_status(error) in RETRYABLE_STATUS_CODES
+
+    def delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+        # Full jitter：在[0, base*2^attempt]内随机
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
@@ -0,0 +1,306 @@
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, TypeVar
+
+from fastapi import HTTPException
+from openai import APIConnectionError
+
+from metrics import metrics_registry
+from models import APIConfig
+from rate_control import RETRYABLE_STATUS_CODES, error_status, retry_after_seconds
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# 这些状态码说明问题出在当前端点（限流、过载、密钥失效），换一个端点可能成功
+FAILOVER_STATUS_CODES = RETRYABLE_STATUS_CODES | {401, 403}
+# 延迟EWMA的平滑系数
+EWMA_ALPHA = 0.3
+# 路由器多久没有被使用后从注册表中移除（秒），与客户端注册表的空闲时间一致
+ROUTER_IDLE_TIMEOUT = 900.0
+# 注册表中最多保留的路由器数，超出时移除最久未使用的空闲路由器
+MAX_ROUTERS = 256
+
+CIRCUIT_CLOSED = "closed"
+CIRCUIT_OPEN = "open"
+CIRCUIT_HALF_OPEN = "half_open"
+
+
+def should_failover(error: Exception) -> bool:
+    if isinstance(error, APIConnectionError):
+        return True
+    return error_status(error) in FAILOVER_STATUS_CODES
+
+
+class CircuitBreaker:
+    """单个端点的熔断器
+
+    连续失败failure_threshold次后打开，在reset_timeout秒（或上游要求的Retry-After）内
+    不再向该端点发送请求；之后进入半开状态，只放行一个探测请求，成功则关闭，失败则重新打开。
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CIRCUIT_CLOSED
+        self.failures = 0
+        self.opened_until = 0.0
+        self._probing = False
+
+    def available(self) -> bool:
+        if self.state == CIRCUIT_OPEN and time.monotonic() >= self.opened_until:
+            self.state = CIRCUIT_HALF_OPEN
+            self._probing = False
+        if self.state == CIRCUIT_HALF_OPEN:
+            return not self._probing
+        return self.state == CIRCUIT_CLOSED
+
+    def on_dispatch(self):
+        if self.state == CIRCUIT_HALF_OPEN:
+            self._probing = True
+
+    def on_success(self):
+        self.state = CIRCUIT_CLOSED
+        self.failures = 0
+        self._probing = False
+
+    def on_failure(self, retry_after: Optional[float] = None) -> bool:
+        """记录一次失败，熔断器因此打开时返回True"""
+        self.failures += 1
+        self._probing = False
+        if self.state == CIRCUIT_HALF_OPEN or self.failures >= self.failure_threshold:
+            self.state = CIRCUIT_OPEN
+            self.opened_until = time.monotonic() + max(
+                self.reset_timeout, retry_after or 0.0
+            )
+            return True
+        return False
+
+
+class Endpoint:
+    def __init__(self, api_config: APIConfig, weight: float = 1.0):
+        self.api_config = api_config
+        self.weight = max(weight, 0.01)
+        self.outstanding = 0
+        # 尚无样本时为None，新端点会优先得到请求
+        self.latency_ewma: Optional[float] = None
+        self.requests = 0
+        self.failures = 0
+        self.breaker = CircuitBreaker()
+
+    @property
+    def name(self) -> str:
+        return f"{self.api_config.base_url.rstrip('/')} ({self.api_config.model_name})"
+
+    def score(self, strategy: str) -> Tuple[float, float]:
+        load = (self.outstanding + 1) / self.weight
+        latency = self.latency_ewma or 0.0
+        if strategy == "ewma":
+            return latency * load, load
+        return load, latency
+
+    def record_latency(self, seconds: float):
+        if self.latency_ewma is None:
+            self.latency_ewma = seconds
+        else:
+            self.latency_ewma += EWMA_ALPHA * (seconds - self.latency_ewma)
+
+
+class EndpointRouter:
+    """在多个上游端点之间分发请求
+
+    按在途请求数（或延迟EWMA）除以权重选择负载最低的健康端点；请求因限流、过载、
+    连接失败或密钥失效而失败时，记录到该端点的熔断器，并在同一次调用中转移到其他端点。
+    所有端点都不可用时抛出503并带上最早恢复的时间，由章节调度器退避重试。
+    只有一个端点时不做熔断，行为与直接调用一致。
+    """
+
+    def __init__(self, endpoints: List[Endpoint], strategy: str = "least_outstanding"):
+        self.endpoints = endpoints
+        self.strategy = strategy
+        self.last_used = time.monotonic()
+
+    @property
+    def outstanding(self) -> int:
+        return sum(endpoint.outstanding for endpoint in self.endpoints)
+
+    @classmethod
+    def from_config(cls, api_config: APIConfig) -> "EndpointRouter":
+        endpoints = [Endpoint(api_config)]
+        for endpoint in api_config.endpoints:
+            endpoints.append(
+                Endpoint(
+                    APIConfig(
+                        api_key=endpoint.api_key,
+                        base_url=endpoint.base_url,
+                        model_name=endpoint.model_name or api_config.model_name,
+                    ),
+                    endpoint.weight,
+                )
+            )
+        return cls(endpoints, api_config.routing_strategy)
+
+    @property
+    def model_key(self) -> str:
+        """端点池中的模型名，用于响应缓存键；单个模型时即为模型名本身"""
+        return "|".join(
+            sorted({endpoint.api_config.model_name for endpoint in self.endpoints})
+        )
+
+    def _select(self, tried: List[Endpoint]) -> Optional[Endpoint]:
+        candidates = [endpoint for endpoint in self.endpoints if endpoint not in tried]
+        if len(self.endpoints) > 1:
+            candidates = [
+                endpoint for endpoint in candidates if endpoint.breaker.available()
+            ]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda endpoint: endpoint.score(self.strategy))
+
+    def _unavailable_error(self) -> HTTPException:
+        now = time.monotonic()
+        wait = min(
+            max(0.0, endpoint.breaker.opened_until - now) for endpoint in self.endpoints
+        )
+        return HTTPException(
+            status_code=503,
+            detail="All upstream endpoints are unavailable",
+            headers={"Retry-After": str(max(1, int(wait + 0.999)))},
+        )
+
+    async def call(
+        self,
+        request: Callable[[APIConfig], Awaitable[T]],
+        can_failover: Optional[Callable[[], bool]] = None,
+    ) -> T:
+        """用选中的端点执行request，失败时转移到其他端点
+
+        can_failover返回False时不再转移（例如流式请求已经输出了部分内容），直接抛出错误。
+        """
+        self.last_used = time.monotonic()
+        tried: List[Endpoint] = []
+        last_error: Optional[Exception] = None
+        while True:
+            endpoint = self._select(tried)
+            if endpoint is None:
+                if last_error is not None:
+                    raise last_error
+                raise self._unavailable_error()
+            tried.append(endpoint)
+
+            endpoint.breaker.on_dispatch()
+            endpoint.outstanding += 1
+            endpoint.requests += 1
+            started = time.monotonic()
+            try:
+                result = await request(endpoint.api_config)
+            except Exception as e:
+                if not should_failover(e):
+                    raise
+                endpoint.failures += 1
+                if endpoint.breaker.on_failure(retry_after_seconds(e)):
+                    logger.warning(
+                        "Circuit opened for endpoint %s after %d failures: %s",
+                        endpoint.name,
+                        endpoint.breaker.failures,
+                        e,
+                    )
+                last_error = e
+                if can_failover is not None and not can_failover():
+                    raise
+                if len(tried) < len(self.endpoints):
+                    logger.warning(
+                        "Endpoint %s failed, failing over: %s", endpoint.name, e
+                    )
+                continue
+            else:
+                endpoint.record_latency(time.monotonic() - started)
+                endpoint.breaker.on_success()
+                return result
+            finally:
+                endpoint.outstanding -= 1
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        return [
+            {
+                "endpoint": endpoint.name,
+                "weight": endpoint.weight,
+                "outstanding": endpoint.outstanding,
+                "latency_ewma": endpoint.latency_ewma,
+                "requests": endpoint.requests,
+                "failures": endpoint.failures,
+                "circuit": endpoint.breaker.state,
+            }
+            for endpoint in self.endpoints
+        ]
+
+
+# 按端点池共享的路由器，同一组端点的所有任务共用负载、延迟和熔断状态；按最近使用排序
+_routers: "OrderedDict[str, EndpointRouter]" = OrderedDict()
+
+
+def _router_key(api_config: APIConfig) -> str:
+    parts = [(api_config.base_url, api_config.api_key, api_config.model_name, 1.0)]
+    parts += [
+        (e.base_url, e.api_key, e.model_name or api_config.model_name, e.weight)
+        for e in api_config.endpoints
+    ]
+    payload = repr((parts, api_config.routing_strategy))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _evict_routers(keep: str):
+    # 新建路由器时顺带清理：只移除没有在途请求的路由器，仍持有它的客户端可以继续使用，
+    # 只是不再与新任务共享负载和熔断状态
+    now = time.monotonic()
+    for key, router in list(_routers.items()):
+        if key == keep or router.outstanding:
+            continue
+        if len(_routers) > MAX_ROUTERS or now - router.last_used > ROUTER_IDLE_TIMEOUT:
+            del _routers[key]
+
+
+def get_router(api_config: APIConfig) -> EndpointRouter:
+    key = _router_key(api_config)
+    router = _routers.get(key)
+    if router is None:
+        router = EndpointRouter.from_config(api_config)
+        _routers[key] = router
+        _evict_routers(key)
+    else:
+        _routers.move_to_end(key)
+    router.last_used = time.monotonic()
+    return router
+
+
+def _collect_endpoint_metrics():
+    # 同一端点可能属于多个端点池，在途请求数相加，任一池熔断即视为熔断
+    outstanding: Dict[str, int] = {}
+    circuit_open: Dict[str, int] = {}
+    for router in _routers.values():
+        for endpoint in router.endpoints:
+            name = endpoint.name
+            outstanding[name] = outstanding.get(name, 0) + endpoint.outstanding
+            circuit_open[name] = max(
+                circuit_open.get(name, 0), int(endpoint.breaker.state == CIRCUIT_OPEN)
+            )
+    return [
+        (
+            "paper_endpoint_outstanding_requests",
+            "gauge",
+            "In-flight requests per upstream endpoint",
+            [({"endpoint": name}, value) for name, value in outstanding.items()],
+        ),
+        (
+            "paper_endpoint_circuit_open",
+            "gauge",
+            "Whether the endpoint circuit breaker is open",
+            [({"endpoint": name}, value) for name, value in circuit_open.items()],
+        ),
+    ]
+
+
+metrics_registry.add_collector(_collect_endpoint_metrics)
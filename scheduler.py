@@ -0,0 +1,219 @@
+import asyncio
+from typing import (
+    Any,
+    AsyncIterable,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Sequence,
+)
+
+from metrics import SECTIONS_IN_FLIGHT, SECTIONS_QUEUED
+from rate_control import (
+    THROTTLE_STATUS_CODES,
+    AdaptiveConcurrencyLimiter,
+    RateBudget,
+    RetryPolicy,
+    error_status,
+    retry_after_seconds,
+)
+
+
+class SectionScheduler:
+    """滑动窗口式的章节调度器
+
+    固定数量的工作协程从共享队列中领取章节，任意一个章节完成后立即开始下一个，
+    因此不会因为某个慢章节阻塞整个批次。结果按输入顺序返回。
+
+    在途请求数由AIMD并发控制器决定：上游返回429/5xx时收缩并按Retry-After暂停，
+    恢复正常后逐步增长回concurrency。失败的章节按退避策略重试，等待期间不占用并发槽位。
+    传入limiter时使用共享的控制器（见rate_control.get_upstream），同一上游的任务一起收缩。
+    """
+
+    def __init__(
+        self,
+        concurrency: int,
+        retry_policy: Optional[RetryPolicy] = None,
+        budget: Optional[RateBudget] = None,
+        estimate_tokens: Optional[Callable[[Any], int]] = None,
+        limiter: Optional[AdaptiveConcurrencyLimiter] = None,
+    ):
+        self.concurrency = max(1, concurrency)
+        self.limiter = limiter or AdaptiveConcurrencyLimiter(self.concurrency)
+        self.retry_policy = retry_policy or RetryPolicy(max_retries=0)
+        self.budget = budget
+        self.estimate_tokens = estimate_tokens
+        self.retries = 0
+
+    async def _run_item(
+        self,
+        index: int,
+        item: Any,
+        worker: Callable[[int, Any], Awaitable[Any]],
+        on_retry: Optional[Callable[[int, Any, Exception, float], None]],
+        estimate_tokens: Optional[Callable[[Any], int]],
+    ) -> Any:
+        attempt = 0
+        while True:
+            if self.budget:
+                tokens = estimate_tokens(item) if estimate_tokens else 0
+                await self.budget.acquire(tokens)
+
+            async with self.limiter:
+                SECTIONS_IN_FLIGHT.inc()
+                try:
+                    result = await worker(index, item)
+                    self.limiter.on_success()
+                    return result
+                except Exception as e:
+                    error = e
+                finally:
+                    SECTIONS_IN_FLIGHT.dec()
+
+            retry_after = retry_after_seconds(error)
+            if error_status(error) in THROTTLE_STATUS_CODES:
+                self.limiter.on_throttle(retry_after)
+            if not self.retry_policy.should_retry(error, attempt):
+                raise error
+
+            delay = self.retry_policy.delay(attempt, retry_after)
+            attempt += 1
+            self.retries += 1
+            if on_retry:
+                on_retry(index, item, error, delay)
+            # 退避等待期间计入排队数
+            SECTIONS_QUEUED.inc()
+            try:
+                await asyncio.sleep(delay)
+            finally:
+                SECTIONS_QUEUED.dec()
+
+    async def _consume(
+        self,
+        queue: asyncio.Queue,
+        results: Dict[int, Any],
+        worker: Callable[[int, Any], Awaitable[Any]],
+        on_start: Optional[Callable[[int, Any], None]],
+        on_complete: Optional[Callable[[int, Any, Any], None]],
+        on_retry: Optional[Callable[[int, Any, Exception, float], None]],
+        estimate_tokens: Optional[Callable[[Any], int]],
+    ):
+        # 工作协程：依次领取条目，收到None表示没有更多条目
+        while True:
+            entry = await queue.get()
+            if entry is None:
+                return
+            index, item = entry
+            SECTIONS_QUEUED.dec()
+            if on_start:
+                on_start(index, item)
+            result = await self._run_item(
+                index, item, worker, on_retry, estimate_tokens
+            )
+            results[index] = result
+            if on_complete:
+                on_complete(index, item, result)
+
+    @staticmethod
+    async def _wait(tasks: List[asyncio.Task], queue: asyncio.Queue):
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            # 任一章节失败时取消其余工作协程
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        finally:
+            # 失败或取消时仍在队列中的条目不再计入排队数
+            while not queue.empty():
+                if queue.get_nowait() is not None:
+                    SECTIONS_QUEUED.dec()
+
+    async def run(
+        self,
+        items: Sequence[Any],
+        worker: Callable[[int, Any], Awaitable[Any]],
+        on_start: Optional[Callable[[int, Any], None]] = None,
+        on_complete: Optional[Callable[[int, Any, Any], None]] = None,
+        on_retry: Optional[Callable[[int, Any, Exception, float], None]] = None,
+        estimate_tokens: Optional[Callable[[Any], int]] = None,
+    ) -> List[Any]:
+        """处理一批条目，返回按输入顺序排列的结果
+
+        同一个调度器可以被多个run()并发调用（如批量生成多篇论文），
+        此时它们共享并发控制器和预算；estimate_tokens可按批次覆盖构造时的估算函数。
+        """
+        estimate_tokens = estimate_tokens or self.estimate_tokens
+        results: Dict[int, Any] = {}
+        queue: asyncio.Queue = asyncio.Queue()
+        for index, item in enumerate(items):
+            queue.put_nowait((index, item))
+        SECTIONS_QUEUED.inc(len(items))
+
+        worker_count = min(self.concurrency, len(items))
+        for _ in range(worker_count):
+            queue.put_nowait(None)
+        workers = [
+            asyncio.create_task(
+                self._consume(
+                    queue,
+                    results,
+                    worker,
+                    on_start,
+                    on_complete,
+                    on_retry,
+                    estimate_tokens,
+                )
+            )
+            for _ in range(worker_count)
+        ]
+        await self._wait(workers, queue)
+        return [results[index] for index in range(len(items))]
+
+    async def run_stream(
+        self,
+        items: AsyncIterable[Any],
+        worker: Callable[[int, Any], Awaitable[Any]],
+        on_start: Optional[Callable[[int, Any], None]] = None,
+        on_complete: Optional[Callable[[int, Any, Any], None]] = None,
+        on_retry: Optional[Callable[[int, Any, Exception, float], None]] = None,
+        estimate_tokens: Optional[Callable[[Any], int]] = None,
+    ) -> List[Any]:
+        """与run()相同，但条目来自异步迭代器，每产生一个就开始调度，不必等全部产生
+
+        用于边流式生成大纲边生成章节。items抛出异常时取消在途的章节并抛出该异常。
+        """
+        estimate_tokens = estimate_tokens or self.estimate_tokens
+        results: Dict[int, Any] = {}
+        queue: asyncio.Queue = asyncio.Queue()
+        workers = [
+            asyncio.create_task(
+                self._consume(
+                    queue,
+                    results,
+                    worker,
+                    on_start,
+                    on_complete,
+                    on_retry,
+                    estimate_tokens,
+                )
+            )
+            for _ in range(self.concurrency)
+        ]
+
+        async def _produce() -> int:
+            count = 0
+            async for item in items:
+                queue.put_nowait((count, item))
+                SECTIONS_QUEUED.inc()
+                count += 1
+            for _ in workers:
+                queue.put_nowait(None)
+            return count
+
+        producer = asyncio.create_task(_produce())
+        await self._wait([producer, *workers], queue)
+        return [results[index] for index in range(producer.result())]
@@ -0,0 +1,1092 @@
+import abc
+import asyncio
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from utils import current_dir
+
+# 任务状态
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+FINISHED_STATES = (JOB_COMPLETED, JOB_FAILED, JOB_CANCELLED)
+
+# 章节任务状态
+SECTION_PENDING = "pending"
+SECTION_CLAIMED = "claimed"
+SECTION_DONE = "done"
+
+# 任务和章节租约的默认时长（秒），持有者每隔三分之一租约续约一次
+DEFAULT_LEASE_SECONDS = 30.0
+
+# 当前进程的标识，用于任务和章节的归属；进程退出后其租约过期，由其他进程接手
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+# 一个事件日志条目：(序号, 事件名, 数据)
+Event = Tuple[int, str, Dict[str, Any]]
+
+# API配置只保存在提交进程内存中的任务，该进程退出后无法继续运行
+ORPHANED_JOB_ERROR = (
+    "The worker holding the API configuration has stopped, "
+    "resume the job with api_config"
+)
+
+
+class JobQueueFullError(Exception):
+    """任务队列已满或租户超出配额时抛出，由接口层转换为429"""
+
+
+class JobConflictError(Exception):
+    """恢复的任务仍在排队或运行时抛出，由接口层转换为409"""
+
+
+class StateStore(abc.ABC):
+    """多个工作进程共享的任务状态存储
+
+    保存任务（配置、状态、进度、结果）、任务的事件日志、可认领的章节任务以及少量键值数据
+    （如提示词模板）。认领任务和章节都带租约，持有者定期续约；进程退出后租约过期，
+    其他进程可以接手。公开方法都是协程，由子类实现对应的同步方法；新增后端
+    （如Redis）只需实现这些同步方法。
+    """
+
+    async def _call(self, fn: Callable, *args) -> Any:
+        # 默认在线程池中执行，避免阻塞事件循环
+        return await asyncio.to_thread(fn, *args)
+
+    async def create_job(
+        self, record: Dict[str, Any], max_queued: int, max_per_tenant: int
+    ):
+        """准入控制并写入新任务；同一job_id的旧记录（已结束）连同事件和章节一起替换"""
+        await self._call(self._create_job, record, max_queued, max_per_tenant)
+
+    async def claim_job(self, owner: str, lease: float) -> Optional[Dict[str, Any]]:
+        """按租户公平调度认领一个排队中（或持有者租约已过期）的任务
+
+        key_holder不为空的任务（API配置只保存在该进程内存中）只由key_holder认领。
+        """
+        return await self._call(self._claim_job, owner, lease)
+
+    async def save_job(
+        self,
+        job_id: str,
+        fields: Dict[str, Any],
+        events: List[Event],
+        owner: Optional[str] = None,
+    ) -> bool:
+        """更新任务字段并追加事件；指定owner时仅在仍由其持有时写入"""
+        return await self._call(self._save_job, job_id, fields, events, owner)
+
+    async def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return await self._call(self._get_job, job_id)
+
+    async def delete_job(self, job_id: str, states: Tuple[str, ...]) -> bool:
+        """删除处于states之一的任务，返回是否删除"""
+        return await self._call(self._delete_job, job_id, states)
+
+    async def queue_position(self, job_id: str) -> int:
+        return await self._call(self._queue_position, job_id)
+
+    async def events_since(self, job_id: str, seq: int) -> List[Event]:
+        return await self._call(self._events_since, job_id, seq)
+
+    async def renew_leases(self, owner: str, lease: float):
+        """续约owner持有的运行中任务和章节，以及API配置由owner保存的排队任务"""
+        await self._call(self._renew_leases, owner, lease)
+
+    async def release_owner(self, owner: str):
+        """进程正常退出时交还任务和章节，其他进程无需等待租约过期即可接手；
+        API配置由owner保存的任务无法交还，标记为失败
+        """
+        await self._call(self._release_owner, owner)
+
+    async def prune(self, finished_ttl: float):
+        """删除过期的已结束任务，并把key_holder已退出（租约过期）的任务标记为失败"""
+        await self._call(self._prune, finished_ttl)
+
+    async def request_cancel(self, job_id: str, reason: str) -> bool:
+        """登记取消运行中任务的请求，由持有任务的进程在下次同步时取消；任务不在运行时返回False"""
+        return await self._call(self._request_cancel, job_id, reason)
+
+    async def touch_watchers(self, job_ids: List[str], at: float):
+        """记录job_ids在at时刻仍有客户端在某个工作进程上接收事件流，见记录中的watched_at"""
+        if job_ids:
+            await self._call(self._touch_watchers, job_ids, at)
+
+    async def create_sections(self, job_id: str, sections: List[Tuple[int, str]]):
+        """登记待生成的章节，已存在的章节（如接手任务时）保持原状态"""
+        await self._call(self._create_sections, job_id, sections)
+
+    async def claim_section(
+        self, job_id: str, index: int, owner: str, lease: float
+    ) -> Tuple[bool, Optional[str]]:
+        """认领指定章节，返回(是否认领成功, 已由其他进程生成的内容)"""
+        return await self._call(self._claim_section, job_id, index, owner, lease)
+
+    async def claim_any_section(
+        self, owner: str, lease: float
+    ) -> Optional[Dict[str, Any]]:
+        """认领其他进程运行的任务中一个尚未开始的章节，从大纲末尾开始，减少与任务所在进程冲突"""
+        return await self._call(self._claim_any_section, owner, lease)
+
+    async def complete_section(self, job_id: str, index: int, content: str):
+        await self._call(self._complete_section, job_id, index, content)
+
+    async def release_section(self, job_id: str, index: int, owner: str):
+        await self._call(self._release_section, job_id, index, owner)
+
+    async def done_sections(self, job_id: str) -> Dict[int, str]:
+        return await self._call(self._done_sections, job_id)
+
+    async def job_counts(self) -> Dict[str, int]:
+        """按状态统计任务数"""
+        return await self._call(self._job_counts)
+
+    async def get_value(self, key: str) -> Optional[Tuple[str, str]]:
+        """返回(值, 版本)，不存在时返回None"""
+        return await self._call(self._get_value, key)
+
+    async def put_value(self, key: str, value: str, version: str):
+        await self._call(self._put_value, key, value, version)
+
+    async def cancel_requests(self, job_ids: List[str]) -> Dict[str, str]:
+        """返回job_ids中已登记取消请求的任务及取消原因"""
+        return await self._call(self._cancel_requests_for, job_ids)
+
+    # 子类实现
+
+    @abc.abstractmethod
+    def _create_job(self, record, max_queued, max_per_tenant): ...
+
+    @abc.abstractmethod
+    def _claim_job(self, owner, lease): ...
+
+    @abc.abstractmethod
+    def _save_job(self, job_id, fields, events, owner): ...
+
+    @abc.abstractmethod
+    def _get_job(self, job_id): ...
+
+    @abc.abstractmethod
+    def _delete_job(self, job_id, states): ...
+
+    @abc.abstractmethod
+    def _queue_position(self, job_id): ...
+
+    @abc.abstractmethod
+    def _events_since(self, job_id, seq): ...
+
+    @abc.abstractmethod
+    def _renew_leases(self, owner, lease): ...
+
+    @abc.abstractmethod
+    def _release_owner(self, owner): ...
+
+    @abc.abstractmethod
+    def _prune(self, finished_ttl): ...
+
+    @abc.abstractmethod
+    def _request_cancel(self, job_id, reason): ...
+
+    @abc.abstractmethod
+    def _touch_watchers(self, job_ids, at): ...
+
+    @abc.abstractmethod
+    def _create_sections(self, job_id, sections): ...
+
+    @abc.abstractmethod
+    def _claim_section(self, job_id, index, owner, lease): ...
+
+    @abc.abstractmethod
+    def _claim_any_section(self, owner, lease): ...
+
+    @abc.abstractmethod
+    def _complete_section(self, job_id, index, content): ...
+
+    @abc.abstractmethod
+    def _release_section(self, job_id, index, owner): ...
+
+    @abc.abstractmethod
+    def _done_sections(self, job_id): ...
+
+    @abc.abstractmethod
+    def _job_counts(self): ...
+
+    @abc.abstractmethod
+    def _get_value(self, key): ...
+
+    @abc.abstractmethod
+    def _put_value(self, key, value, version): ...
+
+    @abc.abstractmethod
+    def _cancel_requests_for(self, job_ids): ...
+
+
+def _check_admission(
+    queued: int, tenant_active: int, max_queued: int, max_per_tenant: int
+):
+    if queued >= max_queued:
+        raise JobQueueFullError("Job queue is full, please retry later")
+    if tenant_active >= max_per_tenant:
+        raise JobQueueFullError(
+            f"Too many active jobs for tenant (limit {max_per_tenant})"
+        )
+
+
+class MemoryStateStore(StateStore):
+    """进程内的状态存储，只在单个进程中共享
+
+    用于单进程部署、批量任务和基准测试，同时作为Redis等外部存储的参考实现：
+    每个方法在锁内完成，对应外部存储中的一次事务或脚本。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._events: Dict[str, List[Event]] = {}
+        self._sections: Dict[str, Dict[int, Dict[str, Any]]] = {}
+        self._values: Dict[str, Tuple[str, str]] = {}
+        self._cancel_requests: Dict[str, str] = {}
+
+    async def _call(self, fn: Callable, *args) -> Any:
+        return fn(*args)
+
+    @staticmethod
+    def _copy(record: Dict[str, Any]) -> Dict[str, Any]:
+        # 返回副本，调用方修改记录不影响存储中的数据
+        return json.loads(json.dumps(record, ensure_ascii=False))
+
+    def _lease_valid(self, record: Dict[str, Any], now: float) -> bool:
+        return (record.get("lease_until") or 0) >= now
+
+    def _create_job(self, record, max_queued, max_per_tenant):
+        with self._lock:
+            job_id = record["job_id"]
+            existing = self._jobs.get(job_id)
+            queued = sum(1 for j in self._jobs.values() if j["state"] == JOB_QUEUED)
+            tenant_active = sum(
+                1
+                for j in self._jobs.values()
+                if j["tenant"] == record["tenant"]
+                and j["state"] in (JOB_QUEUED, JOB_RUNNING)
+            )
+            _check_admission(queued, tenant_active, max_queued, max_per_tenant)
+            if existing is not None and existing["state"] not in FINISHED_STATES:
+                raise JobConflictError(f"Job {job_id} is still {existing['state']}")
+            self._jobs[job_id] = self._copy(record)
+            self._events[job_id] = []
+            self._sections[job_id] = {}
+            self._cancel_requests.pop(job_id, None)
+
+    def _claim_job(self, owner, lease):
+        with self._lock:
+            now = time.time()
+            running: Dict[str, int] = {}
+            for job in self._jobs.values():
+                if job["state"] == JOB_RUNNING and self._lease_valid(job, now):
+                    running[job["tenant"]] = running.get(job["tenant"], 0) + 1
+            candidates = [
+                job
+                for job in self._jobs.values()
+                if (
+                    job["state"] == JOB_QUEUED
+                    or (job["state"] == JOB_RUNNING and not self._lease_valid(job, now))
+                )
+                and job.get("key_holder") in (None, owner)
+            ]
+            if not candidates:
+                return None
+            job = min(
+                candidates,
+                key=lambda j: (running.get(j["tenant"], 0), j["created_at"]),
+            )
+            job.update(state=JOB_RUNNING, owner=owner, lease_until=now + lease)
+            return self._copy(job)
+
+    def _save_job(self, job_id, fields, events, owner):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or (owner is not None and job.get("owner") != owner):
+                return False
+            job.update(self._copy(fields))
+            log = self._events.setdefault(job_id, [])
+            last = log[-1][0] if log else 0
+            for seq, event, data in events:
+                if seq > last:
+                    log.append((seq, event, self._copy(data)))
+                    last = seq
+            job["event_seq"] = max(job.get("event_seq", 0), last)
+            return True
+
+    def _get_job(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return self._copy(job) if job is not None else None
+
+    def _delete_job(self, job_id, states):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job["state"] not in states:
+                return False
+            del self._jobs[job_id]
+            self._events.pop(job_id, None)
+            self._sections.pop(job_id, None)
+            self._cancel_requests.pop(job_id, None)
+            return True
+
+    def _queue_position(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job["state"] != JOB_QUEUED:
+                return -1
+            return sum(
+                1
+                for other in self._jobs.values()
+                if other["state"] == JOB_QUEUED
+                and other["tenant"] == job["tenant"]
+                and other["created_at"] < job["created_at"]
+            )
+
+    def _events_since(self, job_id, seq):
+        with self._lock:
+            return [
+                (s, event, self._copy(data))
+                for s, event, data in self._events.get(job_id, [])
+                if s > seq
+            ]
+
+    def _renew_leases(self, owner, lease):
+        with self._lock:
+            until = time.time() + lease
+            for job_id, job in self._jobs.items():
+                if job["state"] == JOB_QUEUED and job.get("key_holder") == owner:
+                    job["lease_until"] = until
+                if job["state"] != JOB_RUNNING:
+                    continue
+                if job.get("owner") == owner:
+                    job["lease_until"] = until
+                for section in self._sections.get(job_id, {}).values():
+                    if (
+                        section["state"] == SECTION_CLAIMED
+                        and section["owner"] == owner
+                    ):
+                        section["lease_until"] = until
+
+    def _fail_orphaned(self, job: Dict[str, Any], now: float):
+        job.update(
+            state=JOB_FAILED,
+            error=ORPHANED_JOB_ERROR,
+            finished_at=now,
+            owner=None,
+            lease_until=None,
+            key_holder=None,
+        )
+
+    def _release_owner(self, owner):
+        with self._lock:
+            now = time.time()
+            for job in self._jobs.values():
+                if job["state"] not in (JOB_QUEUED, JOB_RUNNING):
+                    continue
+                if job.get("key_holder") == owner:
+                    self._fail_orphaned(job, now)
+                elif job["state"] == JOB_RUNNING and job.get("owner") == owner:
+                    job.update(state=JOB_QUEUED, owner=None, lease_until=None)
+            for sections in self._sections.values():
+                for section in sections.values():
+                    if (
+                        section["state"] == SECTION_CLAIMED
+                        and section["owner"] == owner
+                    ):
+                        section.update(
+                            state=SECTION_PENDING, owner=None, lease_until=None
+                        )
+
+    def _prune(self, finished_ttl):
+        with self._lock:
+            now = time.time()
+            for job in self._jobs.values():
+                if (
+                    job.get("key_holder") is not None
+                    and job["state"] in (JOB_QUEUED, JOB_RUNNING)
+                    and not self._lease_valid(job, now)
+                ):
+                    self._fail_orphaned(job, now)
+            cutoff = now - finished_ttl
+            expired = [
+                job_id
+                for job_id, job in self._jobs.items()
+                if job["state"] in FINISHED_STATES
+                and (job.get("finished_at") or 0) < cutoff
+            ]
+            for job_id in expired:
+                del self._jobs[job_id]
+                self._events.pop(job_id, None)
+                self._sections.pop(job_id, None)
+                self._cancel_requests.pop(job_id, None)
+
+    def _request_cancel(self, job_id, reason):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job["state"] != JOB_RUNNING:
+                return False
+            self._cancel_requests[job_id] = reason
+            return True
+
+    def _touch_watchers(self, job_ids, at):
+        with self._lock:
+            for job_id in job_ids:
+                job = self._jobs.get(job_id)
+                if job is not None:
+                    job["watched_at"] = max(job.get("watched_at") or 0, at)
+
+    def _create_sections(self, job_id, sections):
+        with self._lock:
+            existing = self._sections.setdefault(job_id, {})
+            for index, title in sections:
+                existing.setdefault(
+                    index,
+                    {
+                        "title": title,
+                        "state": SECTION_PENDING,
+                        "owner": None,
+                        "lease_until": None,
+                        "content": None,
+                    },
+                )
+
+    def _claim_section(self, job_id, index, owner, lease):
+        with self._lock:
+            now = time.time()
+            section = self._sections.get(job_id, {}).get(index)
+            if section is None:
+                # 未登记的章节不参与协作，由调用方直接生成
+                return True, None
+            if section["state"] == SECTION_DONE:
+                return False, section["content"]
+            if (
+                section["state"] == SECTION_CLAIMED
+                and section["owner"] != owner
+                and self._lease_valid(section, now)
+            ):
+                return False, None
+            section.update(state=SECTION_CLAIMED, owner=owner, lease_until=now + lease)
+            return True, None
+
+    def _claim_any_section(self, owner, lease):
+        with self._lock:
+            now = time.time()
+            for job_id, job in self._jobs.items():
+                if (
+                    job["state"] != JOB_RUNNING
+                    or job.get("owner") == owner
+                    or job.get("key_holder") is not None
+                    or not self._lease_valid(job, now)
+                ):
+                    continue
+                sections = self._sections.get(job_id, {})
+                for index in sorted(sections, reverse=True):
+                    section = sections[index]
+                    if section["state"] == SECTION_PENDING:
+                        section.update(
+                            state=SECTION_CLAIMED, owner=owner, lease_until=now + lease
+                        )
+                        return {
+                            "job_id": job_id,
+                            "index": index,
+                            "title": section["title"],
+                        }
+            return None
+
+    def _complete_section(self, job_id, index, content):
+        with self._lock:
+            section = self._sections.get(job_id, {}).get(index)
+            if section is not None:
+                section.update(
+                    state=SECTION_DONE, owner=None, lease_until=None, content=content
+                )
+
+    def _release_section(self, job_id, index, owner):
+        with self._lock:
+            section = self._sections.get(job_id, {}).get(index)
+            if (
+                section is not None
+                and section["state"] == SECTION_CLAIMED
+                and section["owner"] == owner
+            ):
+                section.update(state=SECTION_PENDING, owner=None, lease_until=None)
+
+    def _done_sections(self, job_id):
+        with self._lock:
+            return {
+                index: section["content"]
+                for index, section in self._sections.get(job_id, {}).items()
+                if section["state"] == SECTION_DONE
+            }
+
+    def _job_counts(self):
+        with self._lock:
+            counts: Dict[str, int] = {}
+            for job in self._jobs.values():
+                counts[job["state"]] = counts.get(job["state"], 0) + 1
+            return counts
+
+    def _get_value(self, key):
+        with self._lock:
+            return self._values.get(key)
+
+    def _put_value(self, key, value, version):
+        with self._lock:
+            self._values[key] = (value, version)
+
+    def _cancel_requests_for(self, job_ids):
+        with self._lock:
+            return {
+                job_id: self._cancel_requests[job_id]
+                for job_id in job_ids
+                if job_id in self._cancel_requests
+            }
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    tenant TEXT NOT NULL,
+    state TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    finished_at REAL,
+    owner TEXT,
+    lease_until REAL,
+    key_holder TEXT,
+    watched_at REAL,
+    spec TEXT NOT NULL,
+    status TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    event_seq INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, created_at);
+CREATE TABLE IF NOT EXISTS job_events (
+    job_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    event TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (job_id, seq)
+);
+CREATE TABLE IF NOT EXISTS sections (
+    job_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    title TEXT NOT NULL,
+    state TEXT NOT NULL,
+    owner TEXT,
+    lease_until REAL,
+    content TEXT,
+    PRIMARY KEY (job_id, idx)
+);
+CREATE INDEX IF NOT EXISTS sections_state ON sections (state, job_id);
+CREATE TABLE IF NOT EXISTS cancel_requests (
+    job_id TEXT PRIMARY KEY,
+    reason TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS kv (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    version TEXT NOT NULL
+);
+"""
+
+# 以JSON保存的列
+_JSON_COLUMNS = ("spec", "status", "result")
+_JOB_COLUMNS = (
+    "job_id",
+    "tenant",
+    "state",
+    "created_at",
+    "finished_at",
+    "owner",
+    "lease_until",
+    "key_holder",
+    "watched_at",
+    "spec",
+    "status",
+    "result",
+    "error",
+    "event_seq",
+)
+
+
+class SQLiteStateStore(StateStore):
+    """基于SQLite（WAL模式）的状态存储，同一台机器上的多个工作进程共享一个数据库文件
+
+    写操作在BEGIN IMMEDIATE事务中完成，认领任务和章节不会被两个进程同时拿到。
+    每个线程使用独立的连接。多台机器部署时把数据库放在共享存储上，或换用外部存储后端。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # 数据库文件只允许当前用户读写
+        os.close(os.open(path, os.O_CREAT | os.O_RDWR, 0o600))
+        conn = self._connect()
+        # executescript会自行提交，不放在事务中
+        conn.executescript(_SCHEMA)
+        columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+        # 旧版本创建的数据库补上新增的列
+        for column, type_name in (("key_holder", "TEXT"), ("watched_at", "REAL")):
+            if column not in columns:
+                conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {type_name}")
+        self._scrub_api_keys()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            # 删除或改写的内容在文件中清零，不残留在空闲页中
+            conn.execute("PRAGMA secure_delete=ON")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def _scrub_api_keys(self):
+        """清除旧版本以明文写入任务配置的API密钥（包括WAL中的副本）
+
+        这些任务中未结束的，之后被认领时因缺少API配置而失败，可通过恢复接口继续。
+        """
+        with self._transaction() as conn:
+            rows = conn.execute(
+                "SELECT job_id, spec FROM jobs WHERE spec LIKE '%\"api_config\"%'"
+            ).fetchall()
+            for row in rows:
+                spec = json.loads(row["spec"])
+                spec.pop("api_config", None)
+                conn.execute(
+                    "UPDATE jobs SET spec = ? WHERE job_id = ?",
+                    (json.dumps(spec, ensure_ascii=False), row["job_id"]),
+                )
+        if rows:
+            self._connect().execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    @staticmethod
+    def _to_record(row: sqlite3.Row) -> Dict[str, Any]:
+        record = dict(row)
+        for column in _JSON_COLUMNS:
+            if record.get(column) is not None:
+                record[column] = json.loads(record[column])
+        return record
+
+    @staticmethod
+    def _to_columns(fields: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            key: (
+                json.dumps(value, ensure_ascii=False)
+                if key in _JSON_COLUMNS and value is not None
+                else value
+            )
+            for key, value in fields.items()
+            if key in _JOB_COLUMNS
+        }
+
+    def _create_job(self, record, max_queued, max_per_tenant):
+        job_id = record["job_id"]
+        with self._transaction() as conn:
+            queued = conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE state = ?", (JOB_QUEUED,)
+            ).fetchone()[0]
+            tenant_active = conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE tenant = ? AND state IN (?, ?)",
+                (record["tenant"], JOB_QUEUED, JOB_RUNNING),
+            ).fetchone()[0]
+            _check_admission(queued, tenant_active, max_queued, max_per_tenant)
+            existing = conn.execute(
+                "SELECT state FROM jobs WHERE job_id = ?", (job_id,)
+            ).fetchone()
+            if existing is not None and existing["state"] not in FINISHED_STATES:
+                raise JobConflictError(f"Job {job_id} is still {existing['state']}")
+            conn.execute("DELETE FROM job_events WHERE job_id = ?", (job_id,))
+            conn.execute("DELETE FROM sections WHERE job_id = ?", (job_id,))
+            conn.execute("DELETE FROM cancel_requests WHERE job_id = ?", (job_id,))
+            columns = self._to_columns(record)
+            conn.execute(
+                f"INSERT OR REPLACE INTO jobs ({', '.join(columns)}) "
+                f"VALUES ({', '.join('?' for _ in columns)})",
+                tuple(columns.values()),
+            )
+
+    def _claim_job(self, owner, lease):
+        now = time.time()
+        claimable = (
+            "(jobs.state = ? OR (jobs.state = ? AND jobs.lease_until < ?)) "
+            "AND (jobs.key_holder IS NULL OR jobs.key_holder = ?)"
+        )
+        claimable_params = (JOB_QUEUED, JOB_RUNNING, now, owner)
+        conn = self._connect()
+        # 先用只读查询判断，空闲轮询时不争抢写锁
+        if (
+            conn.execute(
+                f"SELECT 1 FROM jobs WHERE {claimable} LIMIT 1", claimable_params
+            ).fetchone()
+            is None
+        ):
+            return None
+        with self._transaction() as conn:
+            row = conn.execute(
+                f"""
+                SELECT jobs.job_id FROM jobs
+                LEFT JOIN (
+                    SELECT tenant, COUNT(*) AS running FROM jobs
+                    WHERE state = ? AND lease_until >= ? GROUP BY tenant
+                ) AS active ON active.tenant = jobs.tenant
+                WHERE {claimable}
+                ORDER BY COALESCE(active.running, 0), jobs.created_at
+                LIMIT 1
+                """,
+                (JOB_RUNNING, now, *claimable_params),
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE jobs SET state = ?, owner = ?, lease_until = ? WHERE job_id = ?",
+                (JOB_RUNNING, owner, now + lease, row["job_id"]),
+            )
+            return self._to_record(
+                conn.execute(
+                    "SELECT * FROM jobs WHERE job_id = ?", (row["job_id"],)
+                ).fetchone()
+            )
+
+    def _save_job(self, job_id, fields, events, owner):
+        columns = self._to_columns(fields)
+        if events:
+            columns["event_seq"] = max(seq for seq, _, _ in events)
+        where, params = "job_id = ?", (job_id,)
+        if owner is not None:
+            where, params = "job_id = ? AND owner = ?", (job_id, owner)
+        with self._transaction() as conn:
+            if (
+                conn.execute(f"SELECT 1 FROM jobs WHERE {where}", params).fetchone()
+                is None
+            ):
+                return False
+            if columns:
+                conn.execute(
+                    f"UPDATE jobs SET {', '.join(f'{key} = ?' for key in columns)} "
+                    "WHERE job_id = ?",
+                    (*columns.values(), job_id),
+                )
+            conn.executemany(
+                "INSERT OR IGNORE INTO job_events (job_id, seq, event, data) "
+                "VALUES (?, ?, ?, ?)",
+                [
+                    (job_id, seq, event, json.dumps(data, ensure_ascii=False))
+                    for seq, event, data in events
+                ],
+            )
+            return True
+
+    def _get_job(self, job_id):
+        row = (
+            self._connect()
+            .execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,))
+            .fetchone()
+        )
+        return self._to_record(row) if row is not None else None
+
+    def _delete_job(self, job_id, states):
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                f"DELETE FROM jobs WHERE job_id = ? AND state IN ({', '.join('?' for _ in states)})",
+                (job_id, *states),
+            )
+            if cursor.rowcount == 0:
+                return False
+            conn.execute("DELETE FROM job_events WHERE job_id = ?", (job_id,))
+            conn.execute("DELETE FROM sections WHERE job_id = ?", (job_id,))
+            conn.execute("DELETE FROM cancel_requests WHERE job_id = ?", (job_id,))
+            return True
+
+    def _queue_position(self, job_id):
+        row = (
+            self._connect()
+            .execute(
+                """
+                SELECT COUNT(other.job_id) AS position FROM jobs
+                LEFT JOIN jobs AS other
+                    ON other.tenant = jobs.tenant AND other.state = ?
+                    AND other.created_at < jobs.created_at
+                WHERE jobs.job_id = ? AND jobs.state = ?
+                GROUP BY jobs.job_id
+                """,
+                (JOB_QUEUED, job_id, JOB_QUEUED),
+            )
+            .fetchone()
+        )
+        return row["position"] if row is not None else -1
+
+    def _events_since(self, job_id, seq):
+        rows = (
+            self._connect()
+            .execute(
+                "SELECT seq, event, data FROM job_events "
+                "WHERE job_id = ? AND seq > ? ORDER BY seq",
+                (job_id, seq),
+            )
+            .fetchall()
+        )
+        return [(row["seq"], row["event"], json.loads(row["data"])) for row in rows]
+
+    def _renew_leases(self, owner, lease):
+        until = time.time() + lease
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE jobs SET lease_until = ? "
+                "WHERE (owner = ? AND state = ?) OR (key_holder = ? AND state = ?)",
+                (until, owner, JOB_RUNNING, owner, JOB_QUEUED),
+            )
+            conn.execute(
+                """
+                UPDATE sections SET lease_until = ?
+                WHERE owner = ? AND state = ? AND job_id IN (
+                    SELECT job_id FROM jobs WHERE state = ?
+                )
+                """,
+                (until, owner, SECTION_CLAIMED, JOB_RUNNING),
+            )
+
+    def _fail_orphaned(self, conn: sqlite3.Connection, where: str, params: tuple):
+        conn.execute(
+            "UPDATE jobs SET state = ?, error = ?, finished_at = ?, owner = NULL, "
+            f"lease_until = NULL, key_holder = NULL WHERE state IN (?, ?) AND {where}",
+            (
+                JOB_FAILED,
+                ORPHANED_JOB_ERROR,
+                time.time(),
+                JOB_QUEUED,
+                JOB_RUNNING,
+                *params,
+            ),
+        )
+
+    def _release_owner(self, owner):
+        with self._transaction() as conn:
+            self._fail_orphaned(conn, "key_holder = ?", (owner,))
+            conn.execute(
+                "UPDATE jobs SET state = ?, owner = NULL, lease_until = NULL "
+                "WHERE owner = ? AND state = ?",
+                (JOB_QUEUED, owner, JOB_RUNNING),
+            )
+            conn.execute(
+                "UPDATE sections SET state = ?, owner = NULL, lease_until = NULL "
+                "WHERE owner = ? AND state = ?",
+                (SECTION_PENDING, owner, SECTION_CLAIMED),
+            )
+
+    def _prune(self, finished_ttl):
+        now = time.time()
+        cutoff = now - finished_ttl
+        with self._transaction() as conn:
+            self._fail_orphaned(
+                conn, "key_holder IS NOT NULL AND lease_until < ?", (now,)
+            )
+            expired = (
+                "SELECT job_id FROM jobs WHERE state IN "
+                f"({', '.join('?' for _ in FINISHED_STATES)}) AND finished_at < ?"
+            )
+            params = (*FINISHED_STATES, cutoff)
+            conn.execute(f"DELETE FROM job_events WHERE job_id IN ({expired})", params)
+            conn.execute(f"DELETE FROM sections WHERE job_id IN ({expired})", params)
+            conn.execute(
+                f"DELETE FROM cancel_requests WHERE job_id IN ({expired})", params
+            )
+            conn.execute(f"DELETE FROM jobs WHERE job_id IN ({expired})", params)
+
+    def _request_cancel(self, job_id, reason):
+        with self._transaction() as conn:
+            if (
+                conn.execute(
+                    "SELECT 1 FROM jobs WHERE job_id = ? AND state = ?",
+                    (job_id, JOB_RUNNING),
+                ).fetchone()
+                is None
+            ):
+                return False
+            conn.execute(
+                "INSERT OR REPLACE INTO cancel_requests (job_id, reason) VALUES (?, ?)",
+                (job_id, reason),
+            )
+            return True
+
+    def _touch_watchers(self, job_ids, at):
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE jobs SET watched_at = MAX(COALESCE(watched_at, 0), ?) "
+                f"WHERE job_id IN ({', '.join('?' for _ in job_ids)})",
+                (at, *job_ids),
+            )
+
+    def _create_sections(self, job_id, sections):
+        with self._transaction() as conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO sections (job_id, idx, title, state) "
+                "VALUES (?, ?, ?, ?)",
+                [(job_id, index, title, SECTION_PENDING) for index, title in sections],
+            )
+
+    def _claim_section(self, job_id, index, owner, lease):
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT state, owner, lease_until, content FROM sections "
+                "WHERE job_id = ? AND idx = ?",
+                (job_id, index),
+            ).fetchone()
+            if row is None:
+                # 未登记的章节不参与协作，由调用方直接生成
+                return True, None
+            if row["state"] == SECTION_DONE:
+                return False, row["content"]
+            if (
+                row["state"] == SECTION_CLAIMED
+                and row["owner"] != owner
+                and (row["lease_until"] or 0) >= now
+            ):
+                return False, None
+            conn.execute(
+                "UPDATE sections SET state = ?, owner = ?, lease_until = ? "
+                "WHERE job_id = ? AND idx = ?",
+                (SECTION_CLAIMED, owner, now + lease, job_id, index),
+            )
+            return True, None
+
+    def _claim_any_section(self, owner, lease):
+        now = time.time()
+        query = """
+            SELECT sections.job_id, sections.idx, sections.title FROM sections
+            JOIN jobs ON jobs.job_id = sections.job_id
+            WHERE sections.state = ? AND jobs.state = ?
+                AND jobs.owner != ? AND jobs.lease_until >= ?
+                AND jobs.key_holder IS NULL
+            ORDER BY jobs.created_at, sections.idx DESC
+            LIMIT 1
+        """
+        params = (SECTION_PENDING, JOB_RUNNING, owner, now)
+        if self._connect().execute(query, params).fetchone() is None:
+            return None
+        with self._transaction() as conn:
+            row = conn.execute(query, params).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE sections SET state = ?, owner = ?, lease_until = ? "
+                "WHERE job_id = ? AND idx = ?",
+                (SECTION_CLAIMED, owner, now + lease, row["job_id"], row["idx"]),
+            )
+            return {"job_id": row["job_id"], "index": row["idx"], "title": row["title"]}
+
+    def _complete_section(self, job_id, index, content):
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE sections SET state = ?, owner = NULL, lease_until = NULL, "
+                "content = ? WHERE job_id = ? AND idx = ?",
+                (SECTION_DONE, content, job_id, index),
+            )
+
+    def _release_section(self, job_id, index, owner):
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE sections SET state = ?, owner = NULL, lease_until = NULL "
+                "WHERE job_id = ? AND idx = ? AND owner = ? AND state = ?",
+                (SECTION_PENDING, job_id, index, owner, SECTION_CLAIMED),
+            )
+
+    def _done_sections(self, job_id):
+        rows = (
+            self._connect()
+            .execute(
+                "SELECT idx, content FROM sections WHERE job_id = ? AND state = ?",
+                (job_id, SECTION_DONE),
+            )
+            .fetchall()
+        )
+        return {row["idx"]: row["content"] for row in rows}
+
+    def _job_counts(self):
+        rows = (
+            self._connect()
+            .execute("SELECT state, COUNT(*) AS count FROM jobs GROUP BY state")
+            .fetchall()
+        )
+        return {row["state"]: row["count"] for row in rows}
+
+    def _get_value(self, key):
+        row = (
+            self._connect()
+            .execute("SELECT value, version FROM kv WHERE key = ?", (key,))
+            .fetchone()
+        )
+        return (row["value"], row["version"]) if row is not None else None
+
+    def _put_value(self, key, value, version):
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO kv (key, value, version) VALUES (?, ?, ?)",
+                (key, value, version),
+            )
+
+    def _cancel_requests_for(self, job_ids):
+        if not job_ids:
+            return {}
+        rows = (
+            self._connect()
+            .execute(
+                "SELECT job_id, reason FROM cancel_requests WHERE job_id IN "
+                f"({', '.join('?' for _ in job_ids)})",
+                tuple(job_ids),
+            )
+            .fetchall()
+        )
+        return {row["job_id"]: row["reason"] for row in rows}
+
+
+def create_state_store() -> StateStore:
+    """按STATE_STORE环境变量创建状态存储：sqlite（默认）或memory"""
+    backend = os.getenv("STATE_STORE", "sqlite").lower()
+    if backend == "memory":
+        return MemoryStateStore()
+    if backend != "sqlite":
+        raise ValueError(f"Unsupported STATE_STORE: {backend}")
+    return SQLiteStateStore(
+        os.getenv("STATE_STORE_PATH", os.path.join(current_dir, "state.db"))
+    )
+
+
+# 全局状态存储，首次使用时创建，导入本模块不会创建数据库文件
+_state_store: Optional[StateStore] = None
+
+
+def get_state_store() -> StateStore:
+    global _state_store
+    if _state_store is None:
+        _state_store = create_state_store()
+    return _state_store
@@ -0,0 +1,90 @@
+import asyncio
+import time
+
+import pytest
+
+from jobs import JobManager
+from state_store import JOB_QUEUED, SQLiteStateStore
+
+GRACE = 0.1
+
+
+async def _runner(job):
+    raise AssertionError("jobs are not run in these tests")
+
+
+@pytest.fixture
+def managers(tmp_path):
+    # 两个工作进程的任务管理器共享同一个数据库文件
+    path = str(tmp_path / "state.db")
+    managers = []
+    for _ in range(2):
+        manager = JobManager(_runner, store=SQLiteStateStore(path))
+        manager.cancelled = []
+
+        async def cancel(job_id, reason, manager=manager):
+            manager.cancelled.append((job_id, reason))
+
+        manager.cancel = cancel
+        managers.append(manager)
+    return managers
+
+
+async def _create_job(manager, job_id="job"):
+    await manager.store.create_job(
+        {
+            "job_id": job_id,
+            "tenant": "tenant",
+            "state": JOB_QUEUED,
+            "created_at": time.time(),
+            "spec": {},
+            "status": {},
+        },
+        10,
+        10,
+    )
+
+
+def test_abandoned_job_is_cancelled_after_the_grace_period(managers):
+    a, _ = managers
+
+    async def main():
+        await _create_job(a)
+        await a.watch("job")
+        a.unwatch("job", cancel_after=GRACE)
+        assert len(a._abandon_checks) == 1
+        await asyncio.sleep(GRACE + 0.1)
+
+    asyncio.run(main())
+    assert a.cancelled == [("job", "client disconnected")]
+    assert not a._abandon_checks
+
+
+def test_reconnect_to_another_worker_keeps_the_job(managers):
+    a, b = managers
+
+    async def main():
+        await _create_job(a)
+        await a.watch("job")
+        a.unwatch("job", cancel_after=GRACE)
+        # 浏览器重连时落到了另一个工作进程
+        await asyncio.sleep(GRACE / 4)
+        await b.watch("job")
+        await asyncio.sleep(GRACE + 0.1)
+
+    asyncio.run(main())
+    assert a.cancelled == []
+
+
+def test_local_reconnect_keeps_the_job(managers):
+    a, _ = managers
+
+    async def main():
+        await _create_job(a)
+        await a.watch("job")
+        a.unwatch("job", cancel_after=GRACE)
+        await a.watch("job")
+        await asyncio.sleep(GRACE + 0.1)
+
+    asyncio.run(main())
+    assert a.cancelled == []
@@ -0,0 +1,57 @@
+import pytest
+
+from outline import OutlineTree, parse_outline_line
+
+
+@pytest.mark.parametrize(
+    "line, expected",
+    [
+        ("1. 引言", (1, [1], "引言")),
+        ("2、方法", (1, [2], "方法")),
+        ("1.1 研究背景", (2, [1, 1], "研究背景")),
+        ("1.1. 研究背景", (2, [1, 1], "研究背景")),
+        ("1.1.1 研究问题", (3, [1, 1, 1], "研究问题")),
+        ("第一章 绪论", (1, None, "第一章 绪论")),
+        ("第二节 相关工作", (2, None, "第二节 相关工作")),
+        ("## 实验", (2, None, "实验")),
+        # 以数字开头但没有编号标点的标题不是编号
+        ("2023 年研究进展", (1, None, "2023 年研究进展")),
+        ("5G 网络概述", (1, None, "5G 网络概述")),
+    ],
+)
+def test_parse_outline_line(line, expected):
+    assert parse_outline_line(line) == expected
+
+
+def test_title_starting_with_a_year_keeps_its_text_and_numbering():
+    tree = OutlineTree.parse(
+        ["1. 引言", "1.1 背景", "2023 年研究进展", "2. 方法", "2.1 数据"], []
+    )
+    assert tree.lines() == [
+        "1. 引言",
+        "1.1 背景",
+        "2023 年研究进展",
+        "2. 方法",
+        "2.1 数据",
+    ]
+    assert tree.repaired == 0
+
+
+def test_repairs_duplicate_and_skipped_numbers():
+    tree = OutlineTree.parse(["1. 引言", "1.1 背景", "1.1 动机", "3. 方法", "3.2 数据"])
+    assert tree.lines() == ["1. 引言", "1.1 背景", "1.2 动机", "2. 方法", "2.1 数据"]
+    assert tree.repaired == 3
+
+
+def test_level_jump_attaches_to_nearest_parent():
+    tree = OutlineTree.parse(["1. 引言", "1.1.1 研究问题", "2. 方法"])
+    assert [node.level for node in tree.nodes] == [1, 2, 1]
+    assert tree.lines() == ["1. 引言", "1.1 研究问题", "2. 方法"]
+
+
+def test_only_leaves_and_selected_entries_need_content():
+    tree = OutlineTree.parse(["1. 引言", "1.1 背景", "1.2 动机", "2. 结论"], [0])
+    assert [node.index for node in tree.content_nodes()] == [0, 1, 2, 3]
+    tree = OutlineTree.parse(["1. 引言", "1.1 背景", "1.2 动机", "2. 结论"])
+    assert [node.index for node in tree.content_nodes()] == [1, 2, 3]
+    assert tree.select(["1. 引言"]) == [1, 2]
@@ -0,0 +1,142 @@
+import asyncio
+import time
+
+import pytest
+from fastapi import HTTPException
+
+import rate_control
+from rate_control import AdaptiveConcurrencyLimiter, RetryPolicy, get_upstream
+from scheduler import SectionScheduler
+
+
+def test_throttle_halves_limit_once_per_cooldown():
+    limiter = AdaptiveConcurrencyLimiter(16, cooldown=60)
+    limiter.on_throttle()
+    assert limiter.limit == 8
+    # 同一波429只收缩一次
+    limiter.on_throttle()
+    assert limiter.limit == 8
+
+
+def test_limit_never_drops_below_minimum():
+    limiter = AdaptiveConcurrencyLimiter(4, min_limit=2, cooldown=0)
+    for _ in range(5):
+        limiter.on_throttle()
+    assert limiter.limit == 2
+
+
+def test_success_grows_limit_additively():
+    limiter = AdaptiveConcurrencyLimiter(8, cooldown=0)
+    limiter.on_throttle()
+    limiter.on_throttle()
+    assert limiter.limit == 2
+    # 每次成功增加1/limit，大约一轮（limit个请求）增加1
+    limiter.on_success()
+    limiter.on_success()
+    assert limiter.limit == pytest.approx(2 + 1 / 2 + 1 / 2.5)
+    for _ in range(100):
+        limiter.on_success()
+    assert limiter.limit == 8
+
+
+def test_retry_after_pauses_new_slots():
+    async def main():
+        limiter = AdaptiveConcurrencyLimiter(4)
+        limiter.on_throttle(retry_after=0.1)
+        started = time.monotonic()
+        async with limiter:
+            return time.monotonic() - started
+
+    assert asyncio.run(main()) >= 0.09
+
+
+def test_scheduler_backs_off_and_retries_on_429():
+    attempts = []
+    retries = []
+
+    async def worker(index, item):
+        attempts.append(index)
+        if len(attempts) == 1:
+            raise HTTPException(
+                status_code=429, detail="rate limited", headers={"Retry-After": "0.05"}
+            )
+        return item
+
+    scheduler = SectionScheduler(
+        concurrency=8, retry_policy=RetryPolicy(max_retries=2, base_delay=0)
+    )
+    results = asyncio.run(
+        scheduler.run(
+            ["a"],
+            worker,
+            on_retry=lambda index, item, error, delay: retries.append(delay),
+        )
+    )
+
+    assert results == ["a"]
+    assert attempts == [0, 0]
+    # 按Retry-After等待后重试，并发上限减半后随成功略有回升
+    assert retries == [0.05]
+    assert scheduler.retries == 1
+    assert 4 <= scheduler.limiter.limit < 5
+
+
+@pytest.fixture
+def upstreams(monkeypatch):
+    monkeypatch.setattr(rate_control, "_upstreams", rate_control.OrderedDict())
+    return rate_control._upstreams
+
+
+def test_upstream_is_shared_per_normalized_base_url(upstreams):
+    first = get_upstream("http://Upstream/v1/", 4, 60, None)
+    assert get_upstream("http://upstream/v1", 4, 120, None) is first
+    assert get_upstream("http://other/v1", 4, 60, None) is not first
+    # 并发上限取各任务的最大值
+    get_upstream("http://upstream/v1", 16)
+    assert first.limiter.max_limit == 16
+    assert first.limiter.limit == 16
+
+
+def test_upstream_applies_most_restrictive_quota(upstreams):
+    upstream = get_upstream("http://upstream/v1", 4, 120, None)
+    get_upstream("http://upstream/v1", 4, 60, 10000)
+    get_upstream("http://upstream/v1", 4, 90, None)
+    assert upstream.budget.requests_per_minute == 60
+    assert upstream.budget.tokens_per_minute == 10000
+    assert upstream.budget._requests.capacity == 60
+    assert upstream.budget._requests.tokens <= 60
+
+
+def test_throttle_in_one_job_shrinks_the_other(upstreams):
+    async def main():
+        first = get_upstream("http://upstream/v1", 8)
+        second = get_upstream("http://upstream/v1", 8)
+        a = SectionScheduler(8, limiter=first.limiter, budget=first.budget)
+        b = SectionScheduler(8, limiter=second.limiter, budget=second.budget)
+
+        async def throttled(index, item):
+            raise HTTPException(status_code=429, detail="rate limited")
+
+        with pytest.raises(HTTPException):
+            await a.run(["a"], throttled)
+        return b.limiter.limit
+
+    assert asyncio.run(main()) == 4
+
+
+def test_idle_upstreams_are_evicted(upstreams, monkeypatch):
+    monkeypatch.setattr(rate_control, "MAX_UPSTREAMS", 2)
+    busy = get_upstream("http://busy/v1", 4)
+    busy.limiter.in_flight = 1
+    idle = get_upstream("http://idle/v1", 4)
+    get_upstream("http://third/v1", 4)
+    get_upstream("http://fourth/v1", 4)
+    # 有在途请求的上游不会被移除
+    assert "http://busy/v1" in upstreams
+    assert "http://idle/v1" not in upstreams
+    assert get_upstream("http://idle/v1", 4) is not idle
+
+    monkeypatch.setattr(rate_control, "UPSTREAM_IDLE_TIMEOUT", 0.0)
+    busy.limiter.in_flight = 0
+    get_upstream("http://fifth/v1", 4)
+    assert list(upstreams) == ["http://fifth/v1"]
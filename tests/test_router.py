@@ -0,0 +1,126 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+import pytest
+from fastapi import HTTPException
+
+import router
+from models import APIConfig, EndpointConfig
+from router import (
+    CIRCUIT_CLOSED,
+    CIRCUIT_HALF_OPEN,
+    CIRCUIT_OPEN,
+    CircuitBreaker,
+    EndpointRouter,
+    get_router,
+)
+
+
+def test_breaker_opens_after_consecutive_failures():
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=60)
+    assert not breaker.on_failure()
+    assert not breaker.on_failure()
+    assert breaker.on_failure()
+    assert breaker.state == CIRCUIT_OPEN
+    assert not breaker.available()
+
+
+def test_breaker_success_resets_failure_count():
+    breaker = CircuitBreaker(failure_threshold=2)
+    breaker.on_failure()
+    breaker.on_success()
+    assert not breaker.on_failure()
+    assert breaker.state == CIRCUIT_CLOSED
+
+
+def test_half_open_allows_a_single_probe():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    breaker.on_failure()
+    time.sleep(0.06)
+
+    assert breaker.available()
+    assert breaker.state == CIRCUIT_HALF_OPEN
+    breaker.on_dispatch()
+    # 探测请求返回之前不放行其他请求
+    assert not breaker.available()
+
+    breaker.on_success()
+    assert breaker.state == CIRCUIT_CLOSED
+    assert breaker.available()
+
+
+def test_failed_probe_reopens_the_breaker():
+    breaker = CircuitBreaker(failure_threshold=5, reset_timeout=0.05)
+    for _ in range(5):
+        breaker.on_failure()
+    time.sleep(0.06)
+    assert breaker.available()
+    breaker.on_dispatch()
+
+    # 半开状态下一次失败即重新打开，并遵循Retry-After
+    assert breaker.on_failure(retry_after=60)
+    assert breaker.state == CIRCUIT_OPEN
+    assert breaker.opened_until - time.monotonic() > 30
+    assert not breaker.available()
+
+
+def _pool_config(**kwargs) -> APIConfig:
+    return APIConfig(
+        api_key="primary",
+        base_url="http://primary/v1",
+        endpoints=[EndpointConfig(api_key="secondary", base_url="http://secondary/v1")],
+        **kwargs,
+    )
+
+
+def test_router_fails_over_and_skips_open_endpoint():
+    pool = EndpointRouter.from_config(_pool_config())
+    for endpoint in pool.endpoints:
+        endpoint.breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60)
+    calls = []
+
+    async def request(api_config):
+        calls.append(api_config.base_url)
+        if api_config.base_url == "http://primary/v1":
+            raise HTTPException(status_code=503, detail="overloaded")
+        return "ok"
+
+    assert asyncio.run(pool.call(request)) == "ok"
+    assert asyncio.run(pool.call(request)) == "ok"
+    # 主端点熔断后第二次调用直接发往备用端点
+    assert calls == ["http://primary/v1", "http://secondary/v1", "http://secondary/v1"]
+    assert pool.endpoints[0].breaker.state == CIRCUIT_OPEN
+
+
+def test_router_reports_unavailable_when_all_breakers_open():
+    pool = EndpointRouter.from_config(_pool_config())
+    for endpoint in pool.endpoints:
+        endpoint.breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60)
+        endpoint.breaker.on_failure()
+
+    async def request(api_config):
+        raise AssertionError("no endpoint should be called")
+
+    with pytest.raises(HTTPException) as info:
+        asyncio.run(pool.call(request))
+    assert info.value.status_code == 503
+    assert int(info.value.headers["Retry-After"]) >= 59
+
+
+def test_registry_evicts_idle_routers(monkeypatch):
+    monkeypatch.setattr(router, "_routers", OrderedDict())
+    monkeypatch.setattr(router, "MAX_ROUTERS", 2)
+    first = get_router(APIConfig(api_key="a"))
+    get_router(APIConfig(api_key="b"))
+    assert get_router(APIConfig(api_key="a")) is first
+
+    # 超出上限时移除最久未使用的路由器
+    get_router(APIConfig(api_key="c"))
+    assert len(router._routers) == 2
+    assert get_router(APIConfig(api_key="a")) is first
+
+    for pool in router._routers.values():
+        pool.last_used -= router.ROUTER_IDLE_TIMEOUT + 1
+    get_router(APIConfig(api_key="d"))
+    assert len(router._routers) == 1
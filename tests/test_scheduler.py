@@ -0,0 +1,108 @@
+import asyncio
+
+import pytest
+
+from metrics import SECTIONS_IN_FLIGHT, SECTIONS_QUEUED
+from rate_control import RetryPolicy
+from scheduler import SectionScheduler
+
+
+def test_results_follow_input_order():
+    delays = [0.05, 0.01, 0.03, 0.0, 0.02]
+
+    async def worker(index, delay):
+        await asyncio.sleep(delay)
+        return index
+
+    scheduler = SectionScheduler(concurrency=3)
+    assert asyncio.run(scheduler.run(delays, worker)) == [0, 1, 2, 3, 4]
+
+
+def test_slow_item_does_not_block_the_window():
+    # 一个慢章节占着一个槽位时，其余章节在另一个槽位中依次完成
+    completed = []
+    in_flight = 0
+    peak = 0
+
+    async def worker(index, delay):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        try:
+            await asyncio.sleep(delay)
+        finally:
+            in_flight -= 1
+        completed.append(index)
+        return index
+
+    scheduler = SectionScheduler(concurrency=2)
+    results = asyncio.run(scheduler.run([0.2, 0.01, 0.01, 0.01, 0.01], worker))
+
+    assert results == [0, 1, 2, 3, 4]
+    assert completed == [1, 2, 3, 4, 0]
+    assert peak == 2
+
+
+def test_run_stream_schedules_items_as_they_arrive():
+    started = []
+
+    async def items():
+        for item in ["a", "b", "c"]:
+            yield item
+            await asyncio.sleep(0.01)
+
+    async def worker(index, item):
+        started.append(item)
+        return item.upper()
+
+    scheduler = SectionScheduler(concurrency=2)
+    assert asyncio.run(scheduler.run_stream(items(), worker)) == ["A", "B", "C"]
+    assert started == ["a", "b", "c"]
+
+
+def test_failure_cancels_in_flight_items():
+    cancelled = []
+    queued_before = SECTIONS_QUEUED.value()
+    in_flight_before = SECTIONS_IN_FLIGHT.value()
+
+    async def worker(index, item):
+        if item == "bad":
+            await asyncio.sleep(0.01)
+            raise ValueError("bad section")
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(index)
+            raise
+
+    scheduler = SectionScheduler(concurrency=2, retry_policy=RetryPolicy(max_retries=3))
+    with pytest.raises(ValueError):
+        asyncio.run(scheduler.run(["slow", "bad", "slow", "slow"], worker))
+
+    # 不可重试的错误不重试，在途的章节被取消，队列中剩余的章节不再开始
+    assert scheduler.retries == 0
+    assert cancelled == [0]
+    assert SECTIONS_QUEUED.value() == queued_before
+    assert SECTIONS_IN_FLIGHT.value() == in_flight_before
+
+
+def test_cancelling_the_run_cancels_workers():
+    cancelled = []
+
+    async def worker(index, item):
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(index)
+            raise
+
+    async def main():
+        scheduler = SectionScheduler(concurrency=3)
+        task = asyncio.create_task(scheduler.run(range(5), worker))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(main())
+    assert sorted(cancelled) == [0, 1, 2]
@@ -0,0 +1,126 @@
+import asyncio
+import time
+
+import pytest
+
+from state_store import (
+    JOB_QUEUED,
+    JOB_RUNNING,
+    JobConflictError,
+    SQLiteStateStore,
+)
+
+LEASE = 0.2
+
+
+def _record(job_id: str, tenant: str = "tenant") -> dict:
+    return {
+        "job_id": job_id,
+        "tenant": tenant,
+        "state": JOB_QUEUED,
+        "created_at": time.time(),
+        "finished_at": None,
+        "owner": None,
+        "lease_until": None,
+        "key_holder": None,
+        "spec": {},
+        "status": {},
+        "result": None,
+        "error": None,
+        "event_seq": 0,
+    }
+
+
+@pytest.fixture
+def stores(tmp_path):
+    # 两个工作进程各自连接同一个数据库文件
+    path = str(tmp_path / "state.db")
+    return SQLiteStateStore(path), SQLiteStateStore(path)
+
+
+def test_claim_is_exclusive_until_the_lease_expires(stores):
+    a, b = stores
+
+    async def main():
+        await a.create_job(_record("job"), 10, 10)
+        claimed = await a.claim_job("worker-a", LEASE)
+        assert claimed["job_id"] == "job"
+        assert claimed["owner"] == "worker-a"
+        assert await b.claim_job("worker-b", LEASE) is None
+
+        # worker-a停止续约，租约过期后由worker-b接手
+        await asyncio.sleep(LEASE + 0.05)
+        taken = await b.claim_job("worker-b", LEASE)
+        assert taken["job_id"] == "job"
+        assert taken["state"] == JOB_RUNNING
+        assert (await a.get_job("job"))["owner"] == "worker-b"
+
+        # 原持有者的写入不再生效
+        assert not await a.save_job("job", {"error": "late"}, [], owner="worker-a")
+        assert await b.save_job(
+            "job", {"status": {"step": 1}}, [(1, "progress", {})], owner="worker-b"
+        )
+        assert (await a.get_job("job"))["error"] is None
+        assert await a.events_since("job", 0) == [(1, "progress", {})]
+
+    asyncio.run(main())
+
+
+def test_renewed_lease_is_not_taken_over(stores):
+    a, b = stores
+
+    async def main():
+        await a.create_job(_record("job"), 10, 10)
+        await a.claim_job("worker-a", LEASE)
+        for _ in range(3):
+            await asyncio.sleep(LEASE / 2)
+            await a.renew_leases("worker-a", LEASE)
+            assert await b.claim_job("worker-b", LEASE) is None
+
+    asyncio.run(main())
+
+
+def test_released_job_is_claimable_immediately(stores):
+    a, b = stores
+
+    async def main():
+        await a.create_job(_record("job"), 10, 10)
+        await a.claim_job("worker-a", 60)
+        await a.release_owner("worker-a")
+        assert (await b.get_job("job"))["state"] == JOB_QUEUED
+        assert (await b.claim_job("worker-b", 60))["owner"] == "worker-b"
+
+    asyncio.run(main())
+
+
+def test_running_job_cannot_be_resubmitted(stores):
+    a, b = stores
+
+    async def main():
+        await a.create_job(_record("job"), 10, 10)
+        await a.claim_job("worker-a", 60)
+        with pytest.raises(JobConflictError):
+            await b.create_job(_record("job"), 10, 10)
+
+    asyncio.run(main())
+
+
+def test_section_lease_expiry(stores):
+    a, b = stores
+
+    async def main():
+        await a.create_job(_record("job"), 10, 10)
+        await a.claim_job("worker-a", 60)
+        await a.create_sections("job", [(0, "引言"), (1, "方法")])
+
+        assert await a.claim_section("job", 0, "worker-a", LEASE) == (True, None)
+        assert await b.claim_section("job", 0, "worker-b", LEASE) == (False, None)
+        await asyncio.sleep(LEASE + 0.05)
+        assert await b.claim_section("job", 0, "worker-b", LEASE) == (True, None)
+
+        # 已完成的章节直接返回内容，不再认领
+        await b.complete_section("job", 0, "内容")
+        assert await a.claim_section("job", 0, "worker-a", LEASE) == (False, "内容")
+        assert await a.done_sections("job") == {0: "内容"}
+
+    asyncio.run(main())